@@ -0,0 +1,88 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+#
+# Copyright (C) 2011, TUBITAK/UEKAE
+#
+# This program is free software; you can redistribute it and/or modify it under
+# the terms of the GNU General Public License as published by the Free
+# Software Foundation; either version 2 of the License, or (at your option)
+# any later version.
+#
+# Please read the COPYING file.
+
+"""Times the COMAR calls of configuring packages against the stub link of
+tests/comarstub.py, which adds a fixed latency to every D-Bus call."""
+
+import os
+import sys
+import time
+import shutil
+import tempfile
+import optparse
+
+topdir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, topdir)
+sys.path.insert(0, os.path.join(topdir, "tests"))
+
+import comarstub
+
+
+class Script:
+    def __init__(self, om, name):
+        self.om = om
+        self.name = name
+        self.script = "%s.py" % name
+
+
+def main():
+    parser = optparse.OptionParser(usage="%prog [options]")
+    parser.add_option("-n", "--packages", type="int", default=200,
+                      help="number of packages (default: %default)")
+    parser.add_option("-s", "--scripts", type="int", default=2,
+                      help="COMAR scripts per package (default: %default)")
+    parser.add_option("-l", "--latency", type="float", default=2.0,
+                      help="latency of a D-Bus call in ms (default: %default)")
+    parser.add_option("--handlers", type="int", default=6,
+                      help="package handlers (default: %default)")
+    parser.add_option("--batched", type="int", default=4,
+                      help="package handlers accepting batched calls (default: %default)")
+    options, args = parser.parse_args()
+
+    daemon = comarstub.install(options.latency / 1000.0)
+    for i in range(options.handlers):
+        methods = {"setupPackage": None}
+        if i < options.batched:
+            methods["setupPackages"] = None
+            methods["acceptsBatchCalls"] = lambda: True
+        daemon.add_script("System.PackageHandler", "handler%d" % i, **methods)
+
+    import pisi.context as ctx
+    import pisi.comariface
+
+    tmp = tempfile.mkdtemp()
+    metapath = os.path.join(tmp, "metadata.xml")
+    filepath = os.path.join(tmp, "files.xml")
+    open(metapath, "w").write("<PISI/>")
+    open(filepath, "w").write("<Files/>")
+
+    try:
+        start = time.time()
+        ctx.comar_transaction += 1
+        for i in range(options.packages):
+            name = "package%d" % i
+            scripts = [Script("System.Service", "%s-%d" % (name, j))
+                       for j in range(options.scripts)]
+            pisi.comariface.post_install(name, scripts, tmp, metapath, filepath,
+                                         None, None, "1.0", "1")
+        ctx.comar_transaction -= 1
+        pisi.comariface.flush_triggers()
+        elapsed = time.time() - start
+    finally:
+        shutil.rmtree(tmp)
+
+    print "%d packages, %d D-Bus calls, %d links, at most %d calls in flight" % \
+            (options.packages, len(daemon.calls), daemon.links, daemon.max_in_flight)
+    print "%.3f s" % elapsed
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,45 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+#
+# Copyright (C) 2011, TUBITAK/UEKAE
+#
+# This program is free software; you can redistribute it and/or modify it under
+# the terms of the GNU General Public License as published by the Free
+# Software Foundation; either version 2 of the License, or (at your option)
+# any later version.
+#
+# Please read the COPYING file.
+
+"""Compares two JSON result files written by run.py."""
+
+import sys
+import json
+
+def main():
+    if len(sys.argv) != 3:
+        print "usage: %s BASE.json NEW.json" % sys.argv[0]
+        return 1
+
+    base = json.load(open(sys.argv[1]))
+    new = json.load(open(sys.argv[2]))
+
+    if base["parameters"] != new["parameters"]:
+        print "Warning: results are generated with different parameters."
+
+    print "%-24s %12s %12s %8s" % ("benchmark",
+                                   (base["commit"] or "base")[:12],
+                                   (new["commit"] or "new")[:12],
+                                   "change")
+    for name in sorted(set(base["results"]) | set(new["results"])):
+        old_time = base["results"].get(name, {}).get("seconds")
+        new_time = new["results"].get(name, {}).get("seconds")
+        if old_time is None or new_time is None:
+            change = "-"
+        else:
+            change = "%+.1f%%" % ((new_time - old_time) / old_time * 100)
+
+        fmt = lambda x: x is None and "-" or "%.3f" % x
+        print "%-24s %12s %12s %8s" % (name, fmt(old_time), fmt(new_time), change)
+
+if __name__ == "__main__":
+    sys.exit(main())
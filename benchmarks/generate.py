@@ -0,0 +1,409 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+#
+# Copyright (C) 2011, TUBITAK/UEKAE
+#
+# This program is free software; you can redistribute it and/or modify it under
+# the terms of the GNU General Public License as published by the Free
+# Software Foundation; either version 2 of the License, or (at your option)
+# any later version.
+#
+# Please read the COPYING file.
+
+"""Synthetic repository generator for the benchmark suite.
+
+Creates a source repository (pspec.xml and actions.py files), an "old"
+binary repository with the first release of every package and a "new"
+one in which a part of the packages have a second release and delta
+packages. The packages have random but reproducible runtime
+dependencies, skewed towards a small set of popular "library" packages,
+like a real distribution."""
+
+import os
+import sys
+import json
+import time
+import random
+import shutil
+import optparse
+
+import pisi
+import pisi.api
+import pisi.config
+import pisi.context as ctx
+import pisi.util as util
+import pisi.files
+import pisi.package
+import pisi.operations.delta
+
+pspecTemplate = """<?xml version="1.0" ?>
+<!DOCTYPE PISI SYSTEM "http://www.pardus.org.tr/projeler/pisi/pisi-spec.dtd">
+<PISI>
+    <Source>
+        <Name>%(name)s</Name>
+        <Homepage>http://www.pardus.org.tr</Homepage>
+        <Packager>
+            <Name>Joe Packager</Name>
+            <Email>joe@pardus.org.tr</Email>
+        </Packager>
+        <License>GPL-2</License>
+        <IsA>app:console</IsA>
+        <Summary>%(summary)s</Summary>
+        <Description>%(description)s</Description>
+        <Archive sha1sum="cc64dfa6e068fe1f6fb68a635878b1ea21acfac7" type="targz">http://example.com/%(name)s.tar.gz</Archive>
+    </Source>
+
+    <Package>
+        <Name>%(name)s</Name>
+        <RuntimeDependencies>
+%(dependencies)s        </RuntimeDependencies>
+        <Files>
+            <Path fileType="config">/etc</Path>
+            <Path fileType="library">/usr/lib</Path>
+            <Path fileType="data">/usr/share</Path>
+        </Files>
+    </Package>
+
+    <History>
+%(history)s    </History>
+</PISI>
+"""
+
+updateTemplate = """        <Update release="%(release)s">
+            <Date>%(date)s</Date>
+            <Version>%(version)s</Version>
+            <Comment>Release %(release)s</Comment>
+            <Name>Joe Packager</Name>
+            <Email>joe@pardus.org.tr</Email>
+        </Update>
+"""
+
+metadataTemplate = """<?xml version="1.0" ?>
+<PISI>
+    <Source>
+        <Name>%(name)s</Name>
+        <Homepage>http://www.pardus.org.tr</Homepage>
+        <Packager>
+            <Name>Joe Packager</Name>
+            <Email>joe@pardus.org.tr</Email>
+        </Packager>
+    </Source>
+    <Package>
+        <Name>%(name)s</Name>
+        <Summary xml:lang="en">%(summary)s</Summary>
+        <Description xml:lang="en">%(description)s</Description>
+        <IsA>app:console</IsA>
+        <PartOf>%(component)s</PartOf>
+        <License>GPL-2</License>
+        <RuntimeDependencies>
+%(dependencies)s        </RuntimeDependencies>
+        <Files>
+            <Path fileType="config">/etc</Path>
+            <Path fileType="library">/usr/lib</Path>
+            <Path fileType="data">/usr/share</Path>
+        </Files>
+        <History>
+%(history)s        </History>
+        <BuildHost>benchmark</BuildHost>
+        <Distribution>%(distribution)s</Distribution>
+        <DistributionRelease>%(distribution_release)s</DistributionRelease>
+        <Architecture>%(architecture)s</Architecture>
+        <InstalledSize>%(installed_size)d</InstalledSize>
+        <InstallTarHash>%(install_tar_hash)s</InstallTarHash>
+        <PackageFormat>%(package_format)s</PackageFormat>
+    </Package>
+</PISI>
+"""
+
+componentsTemplate = """        <Component>
+            <Name>%(name)s</Name>
+            <Summary>%(name)s</Summary>
+            <Description>%(name)s</Description>
+            <Group>system</Group>
+            <Packager>
+                <Name>Joe Packager</Name>
+                <Email>joe@pardus.org.tr</Email>
+            </Packager>
+        </Component>
+"""
+
+distributionTemplate = """<PISI>
+    <SourceName>Benchmark</SourceName>
+    <Version>%(version)s</Version>
+    <Description>Synthetic benchmark repository</Description>
+    <Type>Core</Type>
+</PISI>
+"""
+
+actionsTemplate = """
+from pisi.actionsapi import pisitools
+
+def install():
+    pisitools.dodir("/usr/share/%s")
+"""
+
+words = ("fast", "small", "network", "graphics", "library", "tool", "daemon",
+         "parser", "compression", "audio", "video", "editor", "terminal",
+         "database", "crypto", "font", "theme", "driver", "kernel", "python")
+
+
+class Package:
+    def __init__(self, index, name, component, dependencies, files, config):
+        self.index = index
+        self.name = name
+        self.component = component
+        self.dependencies = dependencies
+        self.files = files
+        self.config = config
+        self.releases = [("1.0", "1")]
+
+    def summary(self):
+        rnd = random.Random(self.index)
+        return "%s %s %s" % (self.name, rnd.choice(words), rnd.choice(words))
+
+    def description(self):
+        return "%s is a synthetic package used by the pisi benchmarks." % self.summary()
+
+    def dependency_xml(self, indent):
+        return "".join(["%s<Dependency>%s</Dependency>\n" % (indent, dep)
+                        for dep in self.dependencies])
+
+    def history_xml(self, releases, indent=""):
+        updates = []
+        for version, release in reversed(releases):
+            update = updateTemplate % {"release": release,
+                                       "version": version,
+                                       "date": time.strftime("%Y-%m-%d")}
+            updates.append("".join([indent + line + "\n"
+                                    for line in update.splitlines()]))
+        return "".join(updates)
+
+    def file_contents(self, release):
+        """Return {path: data} of the package files for the given release."""
+        contents = {}
+        for i in range(self.files):
+            path = "usr/share/%s/file%03d" % (self.name, i)
+            # most files do not change between releases, deltas include
+            # only the changed ones
+            if i % 4 == 0:
+                seed = "%s-%s-%d" % (self.name, release, i)
+            else:
+                seed = "%s-%d" % (self.name, i)
+            contents[path] = ("%s\n" % seed) * random.Random(seed).randint(16, 256)
+        contents["usr/lib/lib%s.so.1" % self.name] = "ELF %s %s\n" % (self.name, release) * 64
+        if self.config:
+            contents["etc/%s.conf" % self.name] = "# %s configuration\nkey = value\n" % self.name
+        return contents
+
+
+class SyntheticRepo:
+    def __init__(self, options):
+        self.options = options
+        self.random = random.Random(options.seed)
+        self.packages = []
+
+    def generate_packages(self):
+        count = self.options.packages
+        for i in range(count):
+            name = "bench%05d" % i
+            component = "bench.comp%02d" % (i % self.options.components)
+
+            # earlier packages are the "libraries", dependencies are
+            # skewed towards them
+            dependencies = set()
+            if i:
+                fanout = self.random.randint(0, self.options.fanout * 2)
+                for j in range(fanout):
+                    dependencies.add("bench%05d" % int(self.random.random() ** 3 * i))
+
+            config = self.random.random() < self.options.config_ratio
+            self.packages.append(Package(i, name, component, sorted(dependencies),
+                                         self.options.files, config))
+
+        updated = self.random.sample(self.packages,
+                                     int(count * self.options.update_ratio))
+        for package in updated:
+            package.releases.append(("1.1", "2"))
+            package.delta = self.random.random() < self.options.delta_ratio
+
+    def write_components(self, repo_dir):
+        components = sorted(set([pkg.component for pkg in self.packages] + ["bench"]))
+        xml = "<PISI>\n    <Components>\n"
+        xml += "".join([componentsTemplate % {"name": c} for c in components])
+        xml += "    </Components>\n</PISI>\n"
+        open(os.path.join(repo_dir, "components.xml"), "w").write(xml)
+        open(os.path.join(repo_dir, "distribution.xml"), "w").write(
+                distributionTemplate % {"version": ctx.config.values.general.distribution_release})
+
+    def create_source_repo(self, repo_dir):
+        for package in self.packages:
+            pkg_dir = os.path.join(repo_dir, package.component.replace(".", "/"), package.name)
+            os.makedirs(pkg_dir)
+            open(os.path.join(pkg_dir, "pspec.xml"), "w").write(pspecTemplate % {
+                        "name": package.name,
+                        "summary": package.summary(),
+                        "description": package.description(),
+                        "dependencies": package.dependency_xml(" " * 12),
+                        "history": package.history_xml(package.releases, " " * 4)})
+            open(os.path.join(pkg_dir, "actions.py"), "w").write(actionsTemplate % package.name)
+        self.write_components(repo_dir)
+
+    def create_binary_package(self, package, releases, repo_dir, work_dir):
+        version, release = releases[-1]
+        filename = "-".join((package.name, version, release,
+                             ctx.config.values.general.distribution_id,
+                             ctx.config.values.general.architecture)) + ctx.const.package_suffix
+        path = os.path.join(repo_dir, filename)
+
+        util.clean_dir(work_dir)
+        install_dir = os.path.join(work_dir, "install")
+
+        files = pisi.files.Files()
+        installed_size = 0
+        for fpath, data in sorted(package.file_contents(release).items()):
+            dest = os.path.join(install_dir, fpath)
+            util.ensure_dirs(os.path.dirname(dest))
+            open(dest, "w").write(data)
+            if fpath.startswith("etc/"):
+                ftype = "config"
+            elif fpath.startswith("usr/lib/"):
+                ftype = "library"
+            else:
+                ftype = "data"
+            files.list.append(pisi.files.FileInfo(path=fpath, type=ftype, size=len(data),
+                                                  hash=util.sha1_data(data), uid="0",
+                                                  gid="0", mode="0644"))
+            installed_size += len(data)
+
+        cwd = os.getcwd()
+        os.chdir(work_dir)
+        try:
+            files.write(ctx.const.files_xml)
+            pkg = pisi.package.Package(path, "w", tmp_dir=work_dir)
+            pkg.add_files_xml(ctx.const.files_xml)
+            for finfo in pkg.files.list:
+                pkg.add_to_install(util.join_path("install", finfo.path), finfo.path)
+            pkg.install_archive.close()
+            install_tar = pkg.install_archive_path
+            general = ctx.config.values.general
+            open(ctx.const.metadata_xml, "w").write(metadataTemplate % {
+                        "name": package.name,
+                        "summary": package.summary(),
+                        "description": package.description(),
+                        "component": package.component,
+                        "dependencies": package.dependency_xml(" " * 12),
+                        "history": package.history_xml(releases, " " * 8),
+                        "distribution": general.distribution,
+                        "distribution_release": general.distribution_release,
+                        "architecture": general.architecture,
+                        "installed_size": installed_size,
+                        "install_tar_hash": util.sha1_file(install_tar),
+                        "package_format": pkg.format})
+            pkg.add_metadata_xml(ctx.const.metadata_xml)
+            pkg.close()
+        finally:
+            os.chdir(cwd)
+
+        return path
+
+    def create_binary_repos(self, old_dir, new_dir, work_dir):
+        for package in self.packages:
+            old_package = self.create_binary_package(package, package.releases[:1],
+                                                     old_dir, work_dir)
+            if len(package.releases) == 1:
+                os.link(old_package, os.path.join(new_dir, os.path.basename(old_package)))
+                continue
+
+            new_package = self.create_binary_package(package, package.releases,
+                                                     new_dir, work_dir)
+            if package.delta:
+                pisi.operations.delta.create_delta_package(old_package, new_package)
+
+        for repo_dir in (old_dir, new_dir):
+            self.write_components(repo_dir)
+
+    def write_parameters(self, out_dir):
+        """Write the generator parameters and the package sets used by the
+        benchmarks."""
+        rnd = random.Random(self.options.seed + 1)
+        names = [pkg.name for pkg in self.packages]
+        installed = names[:int(len(names) * self.options.installed_ratio)]
+
+        # leaf packages can be removed without removing anything else
+        needed = set()
+        for package in self.packages:
+            if package.name in installed:
+                needed.update(package.dependencies)
+        leaves = [x for x in installed if x not in needed]
+
+        params = {"packages": self.options.packages,
+                  "components": self.options.components,
+                  "fanout": self.options.fanout,
+                  "files": self.options.files,
+                  "update_ratio": self.options.update_ratio,
+                  "delta_ratio": self.options.delta_ratio,
+                  "config_ratio": self.options.config_ratio,
+                  "seed": self.options.seed,
+                  "installed": installed,
+                  "remove": rnd.sample(leaves, min(self.options.remove, len(leaves))),
+                  "search": rnd.choice(words),
+                  "search_file": "/usr/share/%s/file000" % rnd.choice(installed)}
+        json.dump(params, open(os.path.join(out_dir, "parameters.json"), "w"), indent=2)
+
+    def create(self, out_dir):
+        if os.path.exists(out_dir):
+            shutil.rmtree(out_dir)
+
+        dirs = {}
+        for name in ("source", "old", "new", "work", "root"):
+            dirs[name] = os.path.join(out_dir, name)
+            os.makedirs(dirs[name])
+
+        self.generate_packages()
+        self.create_source_repo(dirs["source"])
+        self.create_binary_repos(dirs["old"], dirs["new"], dirs["work"])
+        shutil.rmtree(dirs["work"])
+        self.write_parameters(out_dir)
+
+
+def main():
+    parser = optparse.OptionParser(usage="%prog [options] OUTPUT_DIR")
+    parser.add_option("-n", "--packages", type="int", default=1000,
+                      help="number of packages (default: %default)")
+    parser.add_option("--components", type="int", default=50,
+                      help="number of components (default: %default)")
+    parser.add_option("--fanout", type="int", default=4,
+                      help="average number of runtime dependencies (default: %default)")
+    parser.add_option("--files", type="int", default=20,
+                      help="files per package (default: %default)")
+    parser.add_option("--update-ratio", type="float", default=0.2,
+                      help="ratio of packages with a new release (default: %default)")
+    parser.add_option("--delta-ratio", type="float", default=0.5,
+                      help="ratio of updated packages with a delta (default: %default)")
+    parser.add_option("--config-ratio", type="float", default=0.1,
+                      help="ratio of packages with a config file (default: %default)")
+    parser.add_option("--installed-ratio", type="float", default=0.5,
+                      help="ratio of packages installed in the root (default: %default)")
+    parser.add_option("--remove", type="int", default=50,
+                      help="number of packages to remove (default: %default)")
+    parser.add_option("--seed", type="int", default=0,
+                      help="random seed (default: %default)")
+    options, args = parser.parse_args()
+    if len(args) != 1:
+        parser.error("output directory is required")
+
+    if options.files < 1:
+        parser.error("packages need at least one file")
+
+    out_dir = os.path.abspath(args[0])
+
+    # delta packages are written next to the new packages
+    pisi_options = pisi.config.Options()
+    pisi_options.yes_all = True
+    pisi_options.output_dir = os.path.join(out_dir, "new")
+    pisi.api.set_options(pisi_options)
+
+    SyntheticRepo(options).create(out_dir)
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,165 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+#
+# Copyright (C) 2011, TUBITAK/UEKAE
+#
+# This program is free software; you can redistribute it and/or modify it under
+# the terms of the GNU General Public License as published by the Free
+# Software Foundation; either version 2 of the License, or (at your option)
+# any later version.
+#
+# Please read the COPYING file.
+
+"""Runs the pisi benchmarks on a repository created by generate.py.
+
+Every benchmark runs the pisi-cli of this source tree as a separate
+process against a scratch root (pisi -D), and its wall clock time is
+recorded. Read only benchmarks are repeated and the best time is kept.
+The results are written as JSON, see compare.py."""
+
+import os
+import sys
+import json
+import time
+import shutil
+import socket
+import optparse
+import subprocess
+
+topdir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+pisi_cli = os.path.join(topdir, "pisi-cli")
+
+repo_name = "bench"
+
+
+class Suite:
+    def __init__(self, data_dir, repeat, verbose):
+        self.data_dir = data_dir
+        self.root = os.path.join(data_dir, "root")
+        self.repeat = repeat
+        self.verbose = verbose
+        self.params = json.load(open(os.path.join(data_dir, "parameters.json")))
+        self.results = {}
+
+    def path(self, *args):
+        return os.path.join(self.data_dir, *args)
+
+    def pisi(self, args, destdir=True):
+        cmd = [sys.executable, pisi_cli]
+        if destdir:
+            cmd.extend(["-D", self.root])
+        cmd.extend(args)
+
+        env = dict(os.environ)
+        env["PYTHONPATH"] = topdir + os.pathsep + env.get("PYTHONPATH", "")
+
+        if self.verbose:
+            print " ".join(cmd)
+            output = None
+        else:
+            output = open(os.devnull, "w")
+
+        start = time.time()
+        ret = subprocess.call(cmd, env=env, stdout=output, stderr=output)
+        elapsed = time.time() - start
+
+        if ret != 0:
+            raise Exception("'%s' failed with exit code %d" % (" ".join(cmd), ret))
+        return elapsed
+
+    def run(self, name, args, repeat=False, destdir=True):
+        """Time a pisi command. Commands which do not modify the root
+        are repeated and the best time is kept."""
+        count = repeat and self.repeat or 1
+        times = [self.pisi(args, destdir) for i in range(count)]
+        self.results[name] = {"seconds": min(times), "runs": times}
+        print "%-24s %10.3f s" % (name, min(times))
+
+    def setup(self, args, destdir=True):
+        self.pisi(args, destdir)
+
+    def index_args(self, repo, output=None, skip_sources=True):
+        args = ["index", "--skip-signing", "-o", output or self.path(repo, "pisi-index.xml")]
+        if skip_sources:
+            args.append("--skip-sources")
+        return args + [self.path(repo)]
+
+    def run_all(self):
+        if os.path.exists(self.root):
+            shutil.rmtree(self.root)
+        os.makedirs(self.root)
+
+        installed = self.params["installed"]
+        remove = self.params["remove"]
+
+        # repository indexing
+        self.run("index-source", self.index_args("source", self.path("source-index.xml"),
+                                                 skip_sources=False), destdir=False)
+        self.run("index-binary", self.index_args("old"), destdir=False)
+        self.setup(self.index_args("new"), destdir=False)
+
+        # repository cache regeneration
+        self.setup(["add-repo", "--ignore-check", repo_name,
+                    self.path("old", "pisi-index.xml.xz")])
+        self.run("update-repo", ["update-repo", "--force", repo_name], repeat=True)
+
+        # package operations on the old repository
+        self.run("install-%d" % len(installed),
+                 ["install", "--yes-all", "--ignore-comar"] + installed)
+        self.run("check", ["check"], repeat=True)
+        self.run("search", ["search", self.params["search"]], repeat=True)
+        self.run("search-file", ["search-file", self.params["search_file"]], repeat=True)
+
+        # upgrade planning against the new repository
+        self.setup(["remove-repo", repo_name])
+        self.setup(["add-repo", "--ignore-check", repo_name,
+                    self.path("new", "pisi-index.xml.xz")])
+        self.run("list-upgrades", ["list-upgrades"], repeat=True)
+        self.run("upgrade-dry-run", ["upgrade", "--dry-run", "--bypass-update-repo"],
+                 repeat=True)
+
+        self.run("remove-%d" % len(remove),
+                 ["remove", "--yes-all", "--ignore-comar"] + remove)
+
+    def commit(self):
+        try:
+            p = subprocess.Popen(["git", "rev-parse", "HEAD"], cwd=topdir,
+                                 stdout=subprocess.PIPE, stderr=open(os.devnull, "w"))
+            return p.communicate()[0].strip() or None
+        except OSError:
+            return None
+
+    def report(self):
+        params = dict(self.params)
+        for key in ("installed", "remove"):
+            params[key] = len(params[key])
+
+        return {"commit": self.commit(),
+                "date": time.strftime("%Y-%m-%d %H:%M:%S"),
+                "host": socket.gethostname(),
+                "parameters": params,
+                "results": self.results}
+
+
+def main():
+    parser = optparse.OptionParser(usage="%prog [options] DATA_DIR")
+    parser.add_option("-o", "--output", default=None,
+                      help="JSON result file (default: results-<commit>.json)")
+    parser.add_option("-r", "--repeat", type="int", default=3,
+                      help="repetitions of read only benchmarks (default: %default)")
+    parser.add_option("-v", "--verbose", action="store_true", default=False,
+                      help="show the commands and their output")
+    options, args = parser.parse_args()
+    if len(args) != 1:
+        parser.error("data directory created by generate.py is required")
+
+    suite = Suite(os.path.abspath(args[0]), options.repeat, options.verbose)
+    suite.run_all()
+
+    report = suite.report()
+    output = options.output or "results-%s.json" % (report["commit"] or "unknown")[:12]
+    json.dump(report, open(output, "w"), indent=2, sort_keys=True)
+    print "Results written to %s" % output
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -44,8 +44,11 @@ import pisi.operations.history
 import pisi.operations.helper
 import pisi.operations.check
 import pisi.operations.emerge
+import pisi.operations.configure
 import pisi.operations.build
 import pisi.errors
+import pisi.profiler
+import pisi.peercache
 
 def locked(func):
     """
@@ -65,10 +68,18 @@ def locked(func):
                 raise pisi.errors.AnotherInstanceError(_("Another instance of PiSi is running. Only one instance is allowed."))
 
         try:
-            pisi.db.invalidate_caches()
-            ret = func(*__args,**__kw)
-            pisi.db.update_caches()
-            return ret
+            ctx.comar_transaction += 1
+            try:
+                pisi.db.invalidate_caches()
+                ret = func(*__args,**__kw)
+                pisi.db.update_caches()
+                return ret
+            finally:
+                ctx.comar_transaction -= 1
+                # run the package handler calls batched by the transaction
+                if not ctx.comar_transaction and ctx.comar_triggers:
+                    import pisi.comariface
+                    pisi.comariface.flush_triggers()
         finally:
             ctx.locked = False
             lock.close()
@@ -124,6 +135,15 @@ def set_dbus_timeout(timeout):
     """
     ctx.dbus_timeout = timeout
 
+def set_profiler(profiler):
+    """
+    Set the profiler collecting timed spans and counters of PiSi operations
+    @param profiler: pisi.profiler.Profiler object, None disables profiling
+    """
+    if profiler is None:
+        profiler = pisi.profiler.NullProfiler()
+    ctx.profiler = profiler
+
 def set_signal_handling(enable):
     """
     Enable signal handling. Signal handling in pisi mostly used for disabling keyboard interrupts
@@ -251,10 +271,10 @@ def list_upgradable():
     """
     Return a list of packages that are upgraded in the repository -> list_of_strings
     """
-    installdb = pisi.db.installdb.InstallDB()
-    is_upgradable = pisi.operations.upgrade.is_upgradable
+    candidates = pisi.operations.upgrade.upgrade_candidates()
 
-    upgradable = filter(is_upgradable, installdb.list_installed())
+    upgradable = [name for name, (installed, available, reason)
+                  in candidates.items() if reason == "release"]
     # replaced packages can not pass is_upgradable test, so we add them manually
     upgradable.extend(list_replaces())
 
@@ -414,6 +434,7 @@ def fetch(packages=[], path=os.path.curdir):
     """
     packagedb = pisi.db.packagedb.PackageDB()
     repodb = pisi.db.repodb.RepoDB()
+    urls = []
     for name in packages:
         package, repo = packagedb.get_package_repo(name)
         ctx.ui.info(_("%s package found in %s repository") % (package.name, repo))
@@ -423,11 +444,12 @@ def fetch(packages=[], path=os.path.curdir):
             ctx.ui.warning(_("%s package already fetched") % uri.path())
             continue
         if uri.is_absolute_path():
-            url = str(pkg_uri)
+            url = str(uri)
         else:
             url = os.path.join(os.path.dirname(repodb.get_repo_url(repo)), str(uri.path()))
+        urls.append(url)
 
-        fetcher.fetch_url(url, path, ctx.ui.Progress)
+    fetcher.fetch_urls(urls, path, ctx.ui.Progress)
 
 @locked
 def upgrade(packages=[], repo=None):
@@ -534,42 +556,33 @@ def delete_cache():
     pisi.util.clean_dir(ctx.config.archives_dir())
     ctx.ui.info(_("Cleaning temporary directory %s...") % ctx.config.tmp_dir())
     pisi.util.clean_dir(ctx.config.tmp_dir())
+    ctx.ui.info(_("Cleaning peer cache %s...") % ctx.config.peer_cache_dir())
+    pisi.util.clean_dir(ctx.config.peer_cache_dir())
     for cache in filter(lambda x: x.endswith(".cache"), os.listdir(ctx.config.cache_root_dir())):
         cache_file = pisi.util.join_path(ctx.config.cache_root_dir(), cache)
         ctx.ui.info(_("Removing cache file %s...") % cache_file)
         os.unlink(cache_file)
 
+def serve_cache(address="", port=pisi.peercache.default_port, max_age=300):
+    """
+    Serves the packages and index files of the active repositories to the other
+    machines of the network over HTTP, fetching the missing ones once. Runs until
+    interrupted. See pisi.peercache.
+    @param address: address to listen on, all addresses if empty -> string
+    @param port: port to listen on -> int
+    @param max_age: seconds to serve an index file before fetching it again -> int
+    """
+    pisi.peercache.serve(address, port, max_age)
+
 @locked
-def snapshot():
+def snapshot(incremental=False):
     """
     Takes snapshot of the system packages. The snapshot is only a record of which packages are currently
     installed. The record is kept by pisi history mechanism as it works automatically on install, remove
     and upgrade operations.
+    @param incremental: record only the packages and config files changed since the last snapshot
     """
-
-    installdb = pisi.db.installdb.InstallDB()
-    historydb = pisi.db.historydb.HistoryDB()
-    historydb.create_history("snapshot")
-
-    li = installdb.list_installed()
-    progress = ctx.ui.Progress(len(li))
-
-    processed = 0
-    for name in installdb.list_installed():
-        package = installdb.get_package(name)
-        historydb.add_package(pkgBefore=package, operation="snapshot")
-        # Save changed config files of the package in snapshot
-        for f in installdb.get_files(name).list:
-            if f.type == "config" and pisi.util.config_changed(f):
-                fpath = pisi.util.join_path(ctx.config.dest_dir(), f.path)
-                historydb.save_config(name, fpath)
-
-        processed += 1
-        ctx.ui.display_progress(operation = "snapshot",
-                                percent = progress.update(processed),
-                                info = _("Taking snapshot of the system"))
-
-    historydb.update_history()
+    pisi.operations.history.snapshot(incremental)
 
 def calculate_download_size(packages):
     """
@@ -692,43 +705,32 @@ def generate_pending_order(A):
 @locked
 def configure_pending(packages=None):
     # Import COMAR
-    import pisi.comariface
+    try:
+        import pisi.comariface
+    except ImportError:
+        raise pisi.Error(_("comar package is not fully installed"))
 
     # start with pending packages
-    # configure them in reverse topological order of dependency
+    # configure them in dependency levels, packages of a level are
+    # independent of each other and configured concurrently
     installdb = pisi.db.installdb.InstallDB()
     if not packages:
         packages = installdb.list_pending()
     else:
         packages = set(packages).intersection(installdb.list_pending())
 
-    order = generate_pending_order(packages)
-    try:
-        for x in order:
-            if installdb.has_package(x):
-                pkginfo = installdb.get_package(x)
-                pkg_path = installdb.package_path(x)
-                m = pisi.metadata.MetaData()
-                metadata_path = pisi.util.join_path(pkg_path, ctx.const.metadata_xml)
-                m.read(metadata_path)
-                # FIXME: we need a full package info here!
-                pkginfo.name = x
-                ctx.ui.notify(pisi.ui.configuring, package = pkginfo, files = None)
-                pisi.comariface.post_install(
-                    pkginfo.name,
-                    m.package.providesComar,
-                    pisi.util.join_path(pkg_path, ctx.const.comar_dir),
-                    pisi.util.join_path(pkg_path, ctx.const.metadata_xml),
-                    pisi.util.join_path(pkg_path, ctx.const.files_xml),
-                    None,
-                    None,
-                    m.package.version,
-                    m.package.release
-                )
-                ctx.ui.notify(pisi.ui.configured, package = pkginfo, files = None)
-            installdb.clear_pending(x)
-    except ImportError:
-        raise pisi.Error(_("comar package is not fully installed"))
+    for x in [x for x in packages if not installdb.has_package(x)]:
+        installdb.clear_pending(x)
+    packages = [x for x in packages if installdb.has_package(x)]
+
+    store = pisi.operations.configure.MetadataStore(installdb, packages)
+    G_f, levels = pisi.operations.configure.plan_configure(packages, store)
+    failed = pisi.operations.configure.configure_levels(
+            G_f, levels, store, installdb,
+            pisi.operations.configure.configure_jobs())
+    if failed:
+        raise pisi.Error(_("Configuration of the following packages failed: %s")
+                         % pisi.util.strlist(sorted(failed)))
 
 def info(package, installed = False):
     if package.endswith(ctx.const.package_suffix):
@@ -961,7 +963,8 @@ def clearCache(all=False):
                     pass
 
     def removeAll(cacheDir):
-        cached = glob.glob("%s/*.pisi" % cacheDir) + glob.glob("%s/*.part" % cacheDir)
+        cached = glob.glob("%s/*.pisi" % cacheDir) + glob.glob("%s/*.part" % cacheDir) \
+                 + glob.glob("%s/*.part.segments" % cacheDir)
         for pkg in cached:
             try:
                 os.remove(pkg)
@@ -27,6 +27,8 @@ import pisi.files
 import pisi.uri
 import pisi.ui
 import pisi.version
+import pisi.signature
+import pisi.hashcache
 import pisi.operations.delta
 import pisi.db
 
@@ -53,6 +55,16 @@ class AtomicOperation(object):
         "perform an atomic package operation"
         pass
 
+def check_free_space(pkginfos):
+    """Raise Error if the destination root has not enough free space
+    for the given packages."""
+    needed = sum([pkginfo.installedSize or 0 for pkginfo in pkginfos])
+    free = pisi.util.partition_freespace(ctx.config.dest_dir())
+    if needed > free:
+        raise Error(_("Not enough free space in %s: %.2f %s needed, %.2f %s available")
+                    % ((ctx.config.dest_dir(),) + pisi.util.human_readable_size(needed)
+                       + pisi.util.human_readable_size(free)))
+
 # possible paths of install operation
 (INSTALL, REINSTALL, UPGRADE, DOWNGRADE, REMOVE) = range(5)
 opttostr = {INSTALL:"install", REMOVE:"remove", REINSTALL:"reinstall", UPGRADE:"upgrade", DOWNGRADE:"downgrade"}
@@ -103,22 +115,39 @@ class Install(AtomicOperation):
 
             # Bug 4113
             cached_file = pisi.package.Package.is_cached(pkg_path)
-            if cached_file and util.sha1_file(cached_file) != pkg_hash:
+            if cached_file and not pisi.hashcache.check_file_hash(cached_file, pkg_hash):
                 os.unlink(cached_file)
+                pisi.hashcache.forget(cached_file)
                 cached_file = None
 
-            install_op = Install(pkg_path, ignore_dep)
-
-            # Bug 4113
             if not cached_file:
-                downloaded_file = install_op.package.filepath
-                if pisi.util.sha1_file(downloaded_file) != pkg_hash:
-                    raise pisi.Error(_("Download Error: Package does not match the repository package."))
+                Install.download(pkg_path, pkg_hash)
 
-            return install_op
+            return Install(pkg_path, ignore_dep)
         else:
             raise Error(_("Package %s not found in any active repository.") % name)
 
+    @staticmethod
+    def download(pkg_path, pkg_hash):
+        """Download the package at pkg_path into the package cache and
+        check it against the repository hash. A package from the peer
+        cache which doesn't match it is fetched from the repository."""
+        import pisi.peercache
+
+        uri = pisi.uri.URI(pkg_path)
+        downloaded_file = pisi.package.Package.download(uri)
+        if not pisi.hashcache.check_file_hash(downloaded_file, pkg_hash) \
+                and pisi.peercache.peer_uri(uri):
+            ctx.ui.warning(_("%s from the peer cache does not match the repository "
+                             "package, fetching it from the repository") % uri.filename())
+            os.unlink(downloaded_file)
+            pisi.hashcache.forget(downloaded_file)
+            downloaded_file = pisi.package.Package.download(uri, peer=False)
+
+        # Bug 4113
+        if not pisi.hashcache.check_file_hash(downloaded_file, pkg_hash):
+            raise pisi.Error(_("Download Error: Package does not match the repository package."))
+
     def __init__(self, package_fname, ignore_dep = None, ignore_file_conflicts = None):
         if not ctx.filesdb: ctx.filesdb = pisi.db.filesldb.FilesLDB()
         "initialize from a file name"
@@ -153,6 +182,7 @@ class Install(AtomicOperation):
         self.check_requirements()
         self.check_versioning(self.pkginfo.version, self.pkginfo.release)
         self.check_relations()
+        self.check_signature()
         self.check_operation()
 
         ctx.disable_keyboard_interrupts()
@@ -173,8 +203,11 @@ class Install(AtomicOperation):
 
     def check_requirements(self):
         """check system requirements"""
-        #TODO: IS THERE ENOUGH SPACE?
+        # a new package needs all of its installed size, an upgraded one
+        # mostly replaces its files
         # what to do if / is split into /usr, /var, etc.
+        if not self.installdb.has_package(self.pkginfo.name):
+            check_free_space([self.pkginfo])
         # check comar
         if self.metadata.package.providesComar and ctx.comar:
             import pisi.comariface as comariface
@@ -227,6 +260,15 @@ class Install(AtomicOperation):
             else:
                 raise Error(msg)
 
+    def check_signature(self):
+        """check the signature of the package and its install archive
+        before anything is extracted"""
+        if not ctx.config.values.general.verify_signatures:
+            return
+
+        status = self.package.verify_signature(ctx.config.trusted_certs_dir())
+        pisi.signature.check(status, self.pkginfo.name)
+
     def check_operation(self):
 
         self.old_pkginfo = None
@@ -409,12 +451,13 @@ class Install(AtomicOperation):
         # remove left over files from the old package.
         def clean_leftovers():
             stat_cache = {}
+            leftovers = []
 
             files_by_name = {}
-            new_paths = []
+            new_paths = set()
             for f in self.files.list:
                 files_by_name.setdefault(os.path.basename(f.path), []).append(f)
-                new_paths.append(f.path)
+                new_paths.add(f.path)
 
             for old_file in self.old_files.list:
                 if old_file.path in new_paths:
@@ -451,7 +494,9 @@ class Install(AtomicOperation):
                     if os.path.samestat(new_file_stat, old_file_stat):
                         break
                 else:
-                    Remove.remove_file(old_file, self.pkginfo.name, store_old_paths=self.store_old_paths)
+                    leftovers.append(old_file)
+
+            Remove.remove_files(leftovers, self.pkginfo.name, store_old_paths=self.store_old_paths)
 
         if self.reinstall():
             # get 'config' typed file objects
@@ -586,8 +631,7 @@ class Remove(AtomicOperation):
         self.check_dependencies()
 
         self.run_preremove()
-        for fileinfo in self.files.list:
-            self.remove_file(fileinfo, self.package_name, True)
+        self.remove_files(self.files.list, self.package_name, True)
 
         self.run_postremove()
 
@@ -606,57 +650,94 @@ class Remove(AtomicOperation):
 
     @staticmethod
     def remove_file(fileinfo, package_name, remove_permanent=False, store_old_paths=None):
+        Remove.remove_files([fileinfo], package_name, remove_permanent, store_old_paths)
 
-        if fileinfo.permanent and not remove_permanent:
-            return
+    @staticmethod
+    def remove_files(fileinfos, package_name, remove_permanent=False, store_old_paths=None):
+        """Remove the given files of a package and prune the directories
+        emptied by the removal."""
 
-        fpath = pisi.util.join_path(ctx.config.dest_dir(), fileinfo.path)
+        fileinfos = filter(lambda x: remove_permanent or not x.permanent, fileinfos)
+        if not fileinfos:
+            return
 
-        historydb = pisi.db.historydb.HistoryDB()
         # we should check if the file belongs to another
         # package (this can legitimately occur while upgrading
         # two packages such that a file has moved from one package to
         # another as in #2911)
-        pkg, existing_file = ctx.filesdb.get_file(fileinfo.path)
-        if pkg and not pkg == package_name:
-            ctx.ui.warning(_('Not removing conflicted file : %s') % fpath)
-            return
-
-        if fileinfo.type == ctx.const.conf:
-            # config files are precious, leave them as they are
-            # unless they are the same as provided by package.
-            # remove symlinks as they are, cause if the hash of the
-            # file it links has changed, it will be kept as is,
-            # and when the package is reinstalled the symlink will
-            # link to that changed file again.
-            try:
-                if os.path.islink(fpath) or pisi.util.sha1_file(fpath) == fileinfo.hash:
+        owners = ctx.filesdb.get_owners([x.path for x in fileinfos])
+
+        historydb = None
+        old_paths = []
+        parents = set()
+
+        # entries below a directory come before the directory itself
+        for fileinfo in sorted(fileinfos, key=lambda x: x.path, reverse=True):
+            fpath = pisi.util.join_path(ctx.config.dest_dir(), fileinfo.path)
+
+            pkg = owners.get(fileinfo.path)
+            if pkg and not pkg == package_name:
+                ctx.ui.warning(_('Not removing conflicted file : %s') % fpath)
+                continue
+
+            if fileinfo.type == ctx.const.conf:
+                # config files are precious, leave them as they are
+                # unless they are the same as provided by package.
+                # remove symlinks as they are, cause if the hash of the
+                # file it links has changed, it will be kept as is,
+                # and when the package is reinstalled the symlink will
+                # link to that changed file again.
+                try:
+                    if os.path.islink(fpath) or pisi.util.sha1_file(fpath) == fileinfo.hash:
+                        os.unlink(fpath)
+                    else:
+                        # keep changed file in history
+                        if historydb is None:
+                            historydb = pisi.db.historydb.HistoryDB()
+                        historydb.save_config(package_name, fpath)
+
+                        # after saving to history db, remove the config file any way
+                        if ctx.get_option("purge"):
+                            os.unlink(fpath)
+                except pisi.util.FileError:
+                    pass
+            else:
+                if os.path.isfile(fpath) or os.path.islink(fpath):
                     os.unlink(fpath)
+                    old_paths.append(fpath)
+                elif os.path.isdir(fpath) and not os.listdir(fpath):
+                    os.rmdir(fpath)
                 else:
-                    # keep changed file in history
-                    historydb.save_config(package_name, fpath)
+                    ctx.ui.warning(_('Installed file %s does not exist on system [Probably you manually deleted]') % fpath)
+                    continue
 
-                    # after saving to history db, remove the config file any way
-                    if ctx.get_option("purge"):
-                        os.unlink(fpath)
-            except pisi.util.FileError:
-                pass
-        else:
-            if os.path.isfile(fpath) or os.path.islink(fpath):
-                os.unlink(fpath)
-                if store_old_paths:
-                    open(store_old_paths, "a").write("%s\n" % fpath)
-            elif os.path.isdir(fpath) and not os.listdir(fpath):
-                os.rmdir(fpath)
-            else:
-                ctx.ui.warning(_('Installed file %s does not exist on system [Probably you manually deleted]') % fpath)
-                return
-
-        # remove emptied directories
-        dpath = os.path.dirname(fpath)
-        while dpath != '/' and not os.listdir(dpath):
-            os.rmdir(dpath)
-            dpath = os.path.dirname(dpath)
+            parents.add(os.path.dirname(fpath))
+
+        if store_old_paths and old_paths:
+            open(store_old_paths, "a").write("".join(["%s\n" % x for x in old_paths]))
+
+        Remove.remove_empty_dirs(parents)
+
+    @staticmethod
+    def remove_empty_dirs(dirs):
+        """Remove the empty ones of the given directories and their parents,
+        visiting each directory once, deepest first."""
+
+        levels = {}
+        for dpath in dirs:
+            levels.setdefault(dpath.count("/"), set()).add(dpath)
+
+        while levels:
+            depth = max(levels)
+            for dpath in levels.pop(depth):
+                if dpath == "/":
+                    continue
+                try:
+                    # rmdir fails on directories which are not empty
+                    os.rmdir(dpath)
+                except OSError:
+                    continue
+                levels.setdefault(depth - 1, set()).add(os.path.dirname(dpath))
 
     def run_preremove(self):
         if ctx.comar:
@@ -106,6 +106,12 @@ class Build(command.Command):
                          help=_("Do not constrain build process inside "
                                 "the build folder"))
 
+        group.add_option("--ignore-build-cache",
+                         action="store_true",
+                         default=False,
+                         help=_("Build the package even if its build "
+                                "results are found in the build cache"))
+
     def add_steps_options(self):
         group = optparse.OptionGroup(self.parser, _("build steps"))
 
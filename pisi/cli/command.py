@@ -19,6 +19,7 @@ __trans = gettext.translation('pisi', fallback=True)
 _ = __trans.ugettext
 
 import pisi.api
+import pisi.profiler
 import pisi.context as ctx
 
 class autocommand(type):
@@ -110,6 +111,10 @@ class Command(object):
                      default=False, help=_("Show debugging information"))
         group.add_option("-N", "--no-color", action="store_true", default=False,
                      help = _("Suppresses all coloring of PiSi's output"))
+        group.add_option("--profile", action="store", default=None,
+                     metavar="FILE",
+                     help = _("Write timing information to FILE as a JSON trace "
+                              "(folded stacks if FILE ends with .folded)"))
 
         p.add_option_group(group)
 
@@ -131,6 +136,9 @@ class Command(object):
                 os.makedirs(d)
             self.options.destdir = os.path.realpath(d)
 
+        if self.options.profile:
+            pisi.api.set_profiler(pisi.profiler.Profiler())
+
     def check_auth_info(self):
         username = self.options.username
         password = self.options.password
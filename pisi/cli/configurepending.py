@@ -38,6 +38,8 @@ configures those packages.
     def options(self):
         group = optparse.OptionGroup(self.parser, _("configure-pending options"))
         super(ConfigurePending, self).options(group)
+        group.add_option("-j", "--jobs", action="store",
+                               default=None, help=_("Number of packages to configure at once"))
         self.parser.add_option_group(group)
 
     def run(self):
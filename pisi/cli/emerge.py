@@ -51,6 +51,10 @@ You can also give the name of a component.
                      default=False, help=_("Ignore package conflicts"))
         group.add_option("--ignore-comar", action="store_true",
                                default=False, help=_("Bypass comar configuration agent"))
+        group.add_option("-j", "--jobs", action="store",
+                               default=None, help=_("Number of source packages to build at once"))
+        group.add_option("--keep-going", action="store_true",
+                               default=False, help=_("Continue with the independent source packages when a build fails"))
         self.parser.add_option_group(group)
 
     def run(self):
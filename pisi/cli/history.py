@@ -53,11 +53,13 @@ Lists previous operations.""")
                          help=_("Output only the last n operations"))
         group.add_option("-s", "--snapshot", action="store_true", default=False,
                          help=_("Take snapshot of the current system"))
+        group.add_option("--incremental", action="store_true", default=False,
+                         help=_("Record only the changes since the last snapshot"))
         group.add_option("-t", "--takeback", action="store", type="int", default=-1,
                          help=_("Takeback to the state after the given operation finished"))
 
     def take_snapshot(self):
-        pisi.api.snapshot()
+        pisi.api.snapshot(ctx.get_option('incremental'))
 
     def takeback(self, operation):
         pisi.api.takeback(operation)
@@ -68,7 +70,9 @@ Lists previous operations.""")
             print _("Date: %s %s") % (operation.date, operation.time)
             print
 
-            if operation.type == "snapshot":
+            if operation.type == "snapshot" and operation.base:
+                print _("    * There are %d changed packages since snapshot #%s.") % (len(operation.packages), operation.base)
+            elif operation.type == "snapshot":
                 print _("    * There are %d packages in this snapshot.") % len(operation.packages)
             elif operation.type == "repoupdate":
                 for repo in operation.repos:
@@ -68,6 +68,10 @@ expanded to package names.
                             "any pattern contained in file."))
         group.add_option("-s", "--store-lib-info", action="store_true",
                      default=False, help=_("Store previous libraries info when package is updating to newer version."))
+        group.add_option("--image", action="store_true",
+                     default=False, help=_("Populate an empty destination root in bulk (for building "
+                                           "system images) from the repositories. Packages are left "
+                                           "to be configured with configure-pending."))
         self.parser.add_option_group(group)
 
     def run(self):
@@ -19,6 +19,7 @@ _ = __trans.ugettext
 
 import pisi
 import pisi.cli
+import pisi.context as ctx
 import pisi.cli.command as command
 import pisi.cli.addrepo
 import pisi.cli.blame
@@ -53,6 +54,7 @@ import pisi.cli.enablerepo
 import pisi.cli.disablerepo
 import pisi.cli.searchfile
 import pisi.cli.search
+import pisi.cli.servecache
 import pisi.cli.updaterepo
 import pisi.cli.upgrade
 
@@ -141,4 +143,9 @@ class PisiCLI(object):
         sys.exit(1)
 
     def run_command(self):
-        self.command.run()
+        try:
+            self.command.run()
+        finally:
+            profile = getattr(self.command.options, "profile", None)
+            if profile and ctx.profiler.enabled:
+                ctx.profiler.write(profile)
@@ -0,0 +1,56 @@
+# -*- coding:utf-8 -*-
+#
+# Copyright (C) 2011, TUBITAK/UEKAE
+#
+# This program is free software; you can redistribute it and/or modify it under
+# the terms of the GNU General Public License as published by the Free
+# Software Foundation; either version 2 of the License, or (at your option)
+# any later version.
+#
+# Please read the COPYING file.
+#
+
+import optparse
+
+import gettext
+__trans = gettext.translation('pisi', fallback=True)
+_ = __trans.ugettext
+
+import pisi.cli.command as command
+import pisi.context as ctx
+import pisi.peercache
+import pisi.api
+
+class ServeCache(command.Command):
+    __doc__ = _("""Serve packages to the local network
+
+Usage: serve-cache
+
+Serves the packages and index files of the active repositories
+over HTTP. Files missing from the cache are fetched from the
+repositories once and kept for the next machines. Set peer_cache
+in pisi.conf of the other machines to the URL of this one,
+e.g. http://server:8630.
+""")
+    __metaclass__ = command.autocommand
+
+    def __init__(self, args):
+        super(ServeCache, self).__init__(args)
+
+    name = ("serve-cache", "sc")
+
+    def options(self):
+        group = optparse.OptionGroup(self.parser, _("serve-cache options"))
+        group.add_option("--address", action="store", default="",
+                               help=_("Address to listen on (default: all)"))
+        group.add_option("--port", action="store", type="int",
+                               default=pisi.peercache.default_port,
+                               help=_("Port to listen on (default: %default)"))
+        group.add_option("--max-age", action="store", type="int", default=300,
+                               help=_("Seconds to serve an index file before fetching it again"))
+        self.parser.add_option_group(group)
+
+    def run(self):
+        self.init(database=True, write=False)
+        pisi.api.serve_cache(ctx.config.options.address, ctx.config.options.port,
+                             ctx.config.options.max_age)
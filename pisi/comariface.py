@@ -12,11 +12,18 @@
 
 import gettext
 import os
+import sys
 import string
 import time
+import shutil
+import tempfile
+import threading
+import functools
 
 import pisi
 import pisi.context as ctx
+import pisi.profiler
+import pisi.util
 
 __trans = gettext.translation('pisi', fallback=True)
 _ = __trans.ugettext
@@ -45,6 +52,21 @@ def is_method_missing(exception):
     return False
 
 
+def is_link_error(exception):
+    """Tells if exception is about the connection to the COMAR daemon,
+    e.g. the daemon is restarted, rather than a script"""
+    name = exception._dbus_error_name or ""
+    return name.startswith("org.freedesktop.DBus.Error.")
+
+
+def script_error(exception):
+    """Return the Error to raise for a failed COMAR call. The links are
+    dropped if the connection is broken."""
+    if is_link_error(exception):
+        reset_link()
+    return Error(_("Script error: %s") % exception)
+
+
 def safe_script_name(package):
     """Generates DBus-safe object name for package script names."""
     object = package
@@ -56,9 +78,243 @@ def safe_script_name(package):
     return object
 
 
-def get_link():
-    """Connect to the COMAR daemon and return the link."""
+# maximum number of independent COMAR calls in flight, see dispatch
+max_concurrent_calls = 4
+
+# Every thread talks to COMAR through its own link, as one D-Bus
+# connection must not be used by several threads at once. Links of
+# finished threads are kept for reuse; reset_link drops all of them by
+# starting a new generation.
+_links = threading.local()
+_idle_links = []
+_link_generation = 0
+_link_lock = threading.Lock()
+
+# batched versions of the package handler methods, which take lists of
+# metadata.xml and files.xml paths
+batch_methods = {"setupPackage": "setupPackages",
+                 "cleanupPackage": "cleanupPackages",
+                 "postCleanupPackage": "postCleanupPackages"}
+
+# order of the batched calls of a handler
+batch_order = ("cleanupPackages", "postCleanupPackages", "setupPackages")
+
+# method of the package handlers which accept batched calls, it only
+# returns True
+batch_capability = "acceptsBatchCalls"
+
+
+class TriggerQueue:
+    """Package handler calls deferred to the end of a transaction.
+
+    Handlers like ldconfig or the icon and mime cache updaters only need
+    to run once after all packages of a transaction are installed or
+    removed. A handler declares that it accepts batched calls by
+    returning True from acceptsBatchCalls, and implements the ones of
+    setupPackages, cleanupPackages and postCleanupPackages it needs.
+    Their calls are queued and made once by flush(). Handlers which do
+    not declare it are called for every package as before."""
+
+    def __init__(self):
+        self.accepted = {}
+        # handler -> {batch method -> [(metapath, filepath)]}
+        self.calls = {}
+        self.handlers = []
+        self.spool = None
+        self.copies = {}
+        # packages may be configured concurrently, see pisi.operations.configure
+        self.lock = threading.Lock()
+
+    def accepts(self, link, handler):
+        """Tell if handler accepts batched calls, asking it once."""
+        if not self.accepted.has_key(handler):
+            try:
+                accepted = getattr(link.System.PackageHandler[handler], batch_capability)(
+                        timeout=ctx.dbus_timeout)
+            except dbus.DBusException, exception:
+                if is_link_error(exception):
+                    raise script_error(exception)
+                if not is_method_missing(exception):
+                    ctx.ui.debug(_("Package handler %s does not accept batched calls: %s")
+                                 % (handler, exception))
+                accepted = False
+            self.accepted[handler] = bool(accepted)
+        return self.accepted[handler]
+
+    def copy(self, path):
+        """Return a copy of path which lives until the queue is flushed.
+        Removed packages' files are deleted before that."""
+        if not self.copies.has_key(path):
+            if self.spool is None:
+                pisi.util.ensure_dirs(ctx.config.tmp_dir())
+                self.spool = tempfile.mkdtemp(prefix="comar-", dir=ctx.config.tmp_dir())
+            copy = os.path.join(self.spool, "%d-%s" % (len(self.copies), os.path.basename(path)))
+            shutil.copy(path, copy)
+            self.copies[path] = copy
+        return self.copies[path]
+
+    def add(self, handler, method, metapath, filepath, removed=False):
+        self.lock.acquire()
+        try:
+            if removed:
+                metapath = self.copy(metapath)
+                filepath = self.copy(filepath)
+            if not self.calls.has_key(handler):
+                self.handlers.append(handler)
+            calls = self.calls.setdefault(handler, {})
+            calls.setdefault(batch_methods[method], []).append((metapath, filepath))
+        finally:
+            self.lock.release()
+
+    def flush(self):
+        """Make the queued calls. Errors are reported as warnings, the
+        packages are already installed or removed at this point."""
+        try:
+            if not self.calls:
+                return
+
+            link = get_link()
+            # handlers of removed packages are gone
+            registered = set(link.System.PackageHandler)
+            for handler in self.handlers:
+                if handler not in registered:
+                    continue
+                calls = self.calls[handler]
+                for method in batch_order:
+                    if not calls.has_key(method):
+                        continue
+                    ctx.ui.debug(_("Calling %s of package handler %s for %d packages")
+                                 % (method, handler, len(calls[method])))
+                    metapaths = [x[0] for x in calls[method]]
+                    filepaths = [x[1] for x in calls[method]]
+                    try:
+                        getattr(link.System.PackageHandler[handler], method)(
+                                metapaths, filepaths, timeout=ctx.dbus_timeout)
+                    except dbus.DBusException, exception:
+                        if is_link_error(exception):
+                            reset_link()
+                        # handlers implement only the batch methods they need
+                        if not is_method_missing(exception):
+                            ctx.ui.warning(_("Package handler %s failed: %s") % (handler, exception))
+        finally:
+            self.calls = {}
+            self.handlers = []
+            self.copies = {}
+            if self.spool:
+                pisi.util.clean_dir(self.spool)
+                self.spool = None
+
+
+def trigger_queue():
+    """Return the queue of the running transaction or None if handler
+    calls are not batched."""
+    if not ctx.comar_transaction or not ctx.config.values.general.batch_package_handlers:
+        return None
+    if ctx.comar_triggers is None:
+        ctx.comar_triggers = TriggerQueue()
+    return ctx.comar_triggers
+
+
+def flush_triggers():
+    """Make the package handler calls deferred by the transaction."""
+    queue, ctx.comar_triggers = ctx.comar_triggers, None
+    if queue:
+        queue.flush()
+
+
+def call_package_handlers(link, method, metapath, filepath, removed=False):
+    """Call method of every package handler, or queue the call for the
+    handlers accepting batched calls."""
+    queue = trigger_queue()
+    for handler in list(link.System.PackageHandler):
+        if queue and queue.accepts(link, handler):
+            queue.add(handler, method, metapath, filepath, removed)
+            continue
+
+        try:
+            getattr(link.System.PackageHandler[handler], method)(
+                    metapath, filepath, timeout=ctx.dbus_timeout)
+        except dbus.DBusException, exception:
+            # Do nothing if the method is not defined in package script
+            if not is_method_missing(exception):
+                raise script_error(exception)
+
+
+def dispatch(calls, concurrency=None):
+    """Run independent calls (functions without arguments) keeping at
+    most concurrency of them in flight, so their D-Bus round trips
+    overlap. The first error is raised after all calls are finished."""
+    if concurrency is None:
+        concurrency = max_concurrent_calls
+
+    if len(calls) < 2 or concurrency < 2:
+        for call in calls:
+            call()
+        return
 
+    pending = list(calls)
+    errors = []
+    lock = threading.Lock()
+
+    def worker():
+        try:
+            while True:
+                lock.acquire()
+                try:
+                    if not pending:
+                        return
+                    call = pending.pop(0)
+                finally:
+                    lock.release()
+                try:
+                    call()
+                except Exception:
+                    errors.append(sys.exc_info())
+        finally:
+            release_link()
+
+    threads = [threading.Thread(target=worker)
+               for i in range(min(concurrency, len(calls)))]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    if errors:
+        raise errors[0][0], errors[0][1], errors[0][2]
+
+
+def reset_link():
+    """Forget the links of all threads, they reconnect on next use."""
+    global _link_generation
+    _link_lock.acquire()
+    try:
+        _link_generation += 1
+        del _idle_links[:]
+    finally:
+        _link_lock.release()
+    _links.link = None
+
+
+def release_link():
+    """Give the link of the calling thread, which is about to exit, to
+    the other threads."""
+    link = getattr(_links, "link", None)
+    if link is None:
+        return
+    _links.link = None
+    _link_lock.acquire()
+    try:
+        if _links.generation == _link_generation:
+            _idle_links.append((_links.key, link))
+    finally:
+        _link_lock.release()
+
+
+def get_link():
+    """Connect to the COMAR daemon and return the link of the calling
+    thread. The link is reused until the socket or ctx.comar_updated
+    changes or reset_link is called."""
     sockname = "/var/run/dbus/system_bus_socket"
     # YALI starts comar chrooted in the install target, but uses PiSi
     # outside of the chroot environment, so Pisi needs to use a different
@@ -74,6 +330,22 @@ def get_link():
     if ctx.comar_updated:
         alternate = True
 
+    key = (sockname, alternate)
+    if getattr(_links, "link", None) is not None and _links.key == key \
+            and _links.generation == _link_generation:
+        return _links.link
+
+    _link_lock.acquire()
+    try:
+        generation = _link_generation
+        for idle in _idle_links:
+            if idle[0] == key:
+                _idle_links.remove(idle)
+                _links.link, _links.key, _links.generation = idle[1], key, generation
+                return _links.link
+    finally:
+        _link_lock.release()
+
     # This function is sometimes called when comar has recently started
     # or restarting after an update. So we give comar a chance to become
     # active in a reasonable time.
@@ -83,6 +355,7 @@ def get_link():
         try:
             link = comar.Link(socket=sockname, alternate=alternate)
             link.setLocale()
+            _links.link, _links.key, _links.generation = link, key, generation
             return link
         except dbus.DBusException, e:
             exceptions.append(str(e))
@@ -94,6 +367,7 @@ def get_link():
                 % "\n  ".join(exceptions))
 
 
+@pisi.profiler.profiled("comar.post_install")
 def post_install(package_name, provided_scripts,
                  scriptpath, metapath, filepath,
                  fromVersion, fromRelease, toVersion, toRelease):
@@ -111,35 +385,29 @@ def post_install(package_name, provided_scripts,
 
     link = get_link()
 
-    for script in provided_scripts:
-        ctx.ui.debug(_("Registering %s comar script") % script.om)
+    # registrations run in the threads of dispatch, each with its link
+    def register(script):
         script_name = safe_script_name(script.name) \
                 if script.name else package_name
-        if script.om == "System.Package":
-            self_post = True
         try:
-            link.register(script_name, script.om,
-                          os.path.join(scriptpath, script.script))
+            get_link().register(script_name, script.om,
+                                os.path.join(scriptpath, script.script))
         except dbus.DBusException, exception:
-            raise Error(_("Script error: %s") % exception)
+            raise script_error(exception)
         if script.om == "System.Service":
             try:
-                link.System.Service[script_name].registerState()
+                get_link().System.Service[script_name].registerState()
             except dbus.DBusException, exception:
-                raise Error(_("Script error: %s") % exception)
+                raise script_error(exception)
+
+    for script in provided_scripts:
+        ctx.ui.debug(_("Registering %s comar script") % script.om)
+        if script.om == "System.Package":
+            self_post = True
+    dispatch([functools.partial(register, script) for script in provided_scripts])
 
     ctx.ui.debug(_("Calling post install handlers"))
-    for handler in link.System.PackageHandler:
-        try:
-            link.System.PackageHandler[handler].setupPackage(
-                    metapath,
-                    filepath,
-                    timeout=ctx.dbus_timeout)
-        except dbus.DBusException, exception:
-            # Do nothing if setupPackage method is not defined
-            # in package script
-            if not is_method_missing(exception):
-                raise Error(_("Script error: %s") % exception)
+    call_package_handlers(link, "setupPackage", metapath, filepath)
 
     if self_post:
         if not fromVersion:
@@ -155,9 +423,10 @@ def post_install(package_name, provided_scripts,
         except dbus.DBusException, exception:
             # Do nothing if postInstall method is not defined in package script
             if not is_method_missing(exception):
-                raise Error(_("Script error: %s") % exception)
+                raise script_error(exception)
 
 
+@pisi.profiler.profiled("comar.pre_remove")
 def pre_remove(package_name, metapath, filepath):
     """Do package's pre removal operations"""
 
@@ -174,20 +443,13 @@ def pre_remove(package_name, metapath, filepath):
         except dbus.DBusException, exception:
             # Do nothing if preRemove method is not defined in package script
             if not is_method_missing(exception):
-                raise Error(_("Script error: %s") % exception)
+                raise script_error(exception)
 
     ctx.ui.debug(_("Calling pre remove handlers"))
-    for handler in list(link.System.PackageHandler):
-        try:
-            link.System.PackageHandler[handler].cleanupPackage(
-                    metapath, filepath, timeout=ctx.dbus_timeout)
-        except dbus.DBusException, exception:
-            # Do nothing if cleanupPackage method is not defined
-            # in package script
-            if not is_method_missing(exception):
-                raise Error(_("Script error: %s") % exception)
+    call_package_handlers(link, "cleanupPackage", metapath, filepath, removed=True)
 
 
+@pisi.profiler.profiled("comar.post_remove")
 def post_remove(package_name, metapath, filepath, provided_scripts=[]):
     """Do package's post removal operations"""
 
@@ -206,22 +468,16 @@ def post_remove(package_name, metapath, filepath, provided_scripts=[]):
         except dbus.DBusException, exception:
             # Do nothing if postRemove method is not defined in package script
             if not is_method_missing(exception):
-                raise Error(_("Script error: %s") % exception)
+                raise script_error(exception)
 
     ctx.ui.debug(_("Calling post remove handlers"))
-    for handler in list(link.System.PackageHandler):
+    call_package_handlers(link, "postCleanupPackage", metapath, filepath, removed=True)
+
+    def unregister(script):
         try:
-            link.System.PackageHandler[handler].postCleanupPackage(
-                    metapath, filepath, timeout=ctx.dbus_timeout)
+            get_link().remove(script, timeout=ctx.dbus_timeout)
         except dbus.DBusException, exception:
-            # Do nothing if postCleanupPackage method is not defined
-            # in package script
-            if not is_method_missing(exception):
-                raise Error(_("Script error: %s") % exception)
+            raise script_error(exception)
 
     ctx.ui.debug(_("Unregistering comar scripts"))
-    for scr in scripts:
-        try:
-            link.remove(scr, timeout=ctx.dbus_timeout)
-        except dbus.DBusException, exception:
-            raise Error(_("Script error: %s") % exception)
+    dispatch([functools.partial(unregister, scr) for scr in scripts])
@@ -138,6 +138,12 @@ class Config(object):
     def index_dir(self):
         return self.subdir(self.values.dirs.index_dir)
 
+    def peer_cache_dir(self):
+        return self.subdir(self.values.dirs.peer_cache_dir)
+
+    def trusted_certs_dir(self):
+        return self.subdir(self.values.dirs.trusted_certs_dir)
+
     def tmp_dir(self):
         sysdir = self.subdir(self.values.dirs.tmp_dir)
         if os.environ.has_key('USER'):
@@ -21,6 +21,12 @@
 #destinationdirectory = /
 #autoclean = False
 #bandwidth_limit = 0
+#batch_package_handlers = True
+#configure_jobs = 4
+#fetch_segment_threshold = 8192
+#fetch_segments = 4
+#peer_cache = http://cache.example.org:8630
+#verify_signatures = False
 #
 #[build]
 #host = i686-pc-linux-gnu
@@ -33,6 +39,9 @@
 #buildhelper = None / ccache / icecream
 #compressionlevel = 1
 #fallback = "ftp://ftp.pardus.org.tr/pub/source/2009"
+#build_cache = /var/cache/pisi/builds
+#emerge_jobs = 1
+#emerge_min_free_memory = 1024
 #
 #[directories]
 #lib_dir = /var/lib/pisi
@@ -43,7 +52,9 @@
 #compiled_packages_dir = "/var/cache/pisi/packages"
 #index_dir = /var/cache/pisi/index
 #packages_dir = /var/cache/pisi/package
+#peer_cache_dir = /var/cache/pisi/peer
 #tmp_dir = /var/pisi
+#trusted_certs_dir = /etc/pisi/trusted-certs
 #kde_dir = /usr/kde/4
 #qt_dir = /usr/qt/4
 
@@ -74,9 +85,15 @@ class GeneralDefaults:
     ftp_proxy = os.getenv("FTP_PROXY") or None
     package_cache = False
     package_cache_limit = 0
+    peer_cache = None
     bandwidth_limit = 0
+    fetch_segments = 4
+    fetch_segment_threshold = 8192
     ignore_safety = False
     ignore_delta = False
+    verify_signatures = False
+    batch_package_handlers = True
+    configure_jobs = 4
 
 class BuildDefaults:
     """Default values for [build] section"""
@@ -92,6 +109,9 @@ class BuildDefaults:
     compressionlevel = 1
     fallback = "ftp://ftp.pardus.org.tr/pub/source/2009"
     ignored_build_types = ""
+    build_cache = None
+    emerge_jobs = 1
+    emerge_min_free_memory = 1024
 
 class DirectoriesDefaults:
     "Default values for [directories] section"
@@ -106,9 +126,11 @@ class DirectoriesDefaults:
     debug_packages_dir = "/var/cache/pisi/packages-debug"
     old_paths_cache_dir = "/var/cache/pisi/old-paths"
     packages_dir = "/var/lib/pisi/package"
+    peer_cache_dir = "/var/cache/pisi/peer"
     lock_dir = "/var/lock/subsys"
     index_dir = "/var/lib/pisi/index"
     tmp_dir =  "/var/pisi"
+    trusted_certs_dir = "/etc/pisi/trusted-certs"
     kde_dir = "/usr/kde/4"
     qt_dir = "/usr/qt/4"
 
@@ -105,6 +105,9 @@ class Constants:
         self.__c.devels_component = "programming.devel"
         self.__c.docs_component = "programming.docs"
         self.__c.installed_extra = "installedextra"
+        self.__c.hash_cache_file = ".sha1sums"
+        self.__c.history_index_file = "index"
+        self.__c.snapshot_stamps_file = "snapshot.stamps"
 
         #file/directory permissions
         self.__c.umask = 0022
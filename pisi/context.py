@@ -15,6 +15,7 @@
 import signal
 
 import pisi.constants
+import pisi.profiler
 import pisi.signalhandler
 import pisi.ui
 
@@ -42,6 +43,12 @@ stderr = None
 
 comar = True
 comar_updated = False
+
+# package handler calls deferred to the end of the running transaction,
+# see pisi.comariface.TriggerQueue
+comar_transaction = 0
+comar_triggers = None
+
 dbus_sockname = None
 dbus_timeout = 60 * 60 # in seconds
 
@@ -64,3 +71,6 @@ def keyboard_interrupt_pending():
     return sig and sig.signal_pending(signal.SIGINT)
 
 filesdb = None
+
+# timed spans and counters, see pisi.api.set_profiler
+profiler = pisi.profiler.NullProfiler()
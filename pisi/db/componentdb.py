@@ -20,6 +20,7 @@ import pisi.db.repodb
 import pisi.db.itembyrepo
 import pisi.component
 import pisi.db.lazydb as lazydb
+import pisi.db.objectcache as objectcache
 
 class ComponentDB(lazydb.LazyDB):
 
@@ -86,6 +87,10 @@ class ComponentDB(lazydb.LazyDB):
         if not self.has_component(component_name, repo):
             raise Exception(_('Component %s not found') % component_name)
 
+        return objectcache.cache.get(("component", self.generation, repo, component_name),
+                                     self.__decode_component, component_name, repo)
+
+    def __decode_component(self, component_name, repo):
         component = pisi.component.Component()
         component.parse(self.cdb.get_item(component_name, repo))
 
@@ -103,11 +108,15 @@ class ComponentDB(lazydb.LazyDB):
 
     # Returns the component with combined packages and sources from all repos that contain this component
     def get_union_component(self, component_name):
+        repos = tuple(pisi.db.repodb.RepoDB().list_repos())
+        return objectcache.cache.get(("union_component", self.generation, repos, component_name),
+                                     self.__decode_union_component, component_name, repos)
 
+    def __decode_union_component(self, component_name, repos):
         component = pisi.component.Component()
         component.parse(self.cdb.get_item(component_name))
-        
-        for repo in pisi.db.repodb.RepoDB().list_repos():
+
+        for repo in repos:
             try:
                 component.packages.extend(self.cpdb.get_item(component_name, repo))
             except Exception: #FIXME: what exception could we catch here, replace with that.
@@ -21,6 +21,7 @@ _ = __trans.ugettext
 
 import pisi
 import pisi.context as ctx
+import pisi.profiler
 
 class FilesLDB ():
     def __init__(self):
@@ -46,6 +47,11 @@ class FilesLDB ():
     def get_file(self, path):
         return self.filesdb.get(hashlib.md5(path).digest()), path
 
+    def get_owners(self, paths):
+        """Return a dict mapping each of paths to its owner package or None."""
+        get = self.filesdb.get
+        return dict((path, get(hashlib.md5(path).digest())) for path in paths)
+
     def search_file(self, term):
         pkg, path = self.get_file(term)
         if pkg:
@@ -60,11 +66,25 @@ class FilesLDB ():
                 found.append((pkg, paths))
         return found
 
+    @pisi.profiler.profiled("filesdb.add_files")
     def add_files(self, pkg, files):
+        ctx.profiler.count("filesdb.put", len(files.list))
         for f in files.list:
             self.filesdb.put(hashlib.md5(f.path).digest(), pkg)
 
+    @pisi.profiler.profiled("filesdb.add_files")
+    def add_packages_files(self, packages):
+        """Add the files of (package name, Files) pairs in one batch."""
+        batch = self.filesdb.write_batch()
+        for pkg, files in packages:
+            ctx.profiler.count("filesdb.put", len(files.list))
+            for f in files.list:
+                batch.put(hashlib.md5(f.path).digest(), pkg)
+        batch.write()
+
+    @pisi.profiler.profiled("filesdb.remove_files")
     def remove_files(self, files):
+        ctx.profiler.count("filesdb.delete", len(files))
         for f in files:
             self.filesdb.delete(hashlib.md5(f.path).digest())
 
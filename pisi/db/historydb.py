@@ -15,12 +15,15 @@ import os
 import pisi.context as ctx
 import pisi.db.lazydb as lazydb
 import pisi.history
+import pisi.historyindex
 
 class HistoryDB(lazydb.LazyDB):
 
     def init(self):
         self.__logs = self.__generate_history()
         self.history = pisi.history.History()
+        self.index = pisi.historyindex.HistoryIndex.get(ctx.config.history_dir())
+        self.index.sync(self.__logs)
 
     def __generate_history(self):
         logs = filter(lambda x:x.endswith(".xml"), os.listdir(ctx.config.history_dir()))
@@ -61,12 +64,7 @@ class HistoryDB(lazydb.LazyDB):
         self.history.update()
 
     def get_operation(self, operation):
-        for log in self.__logs:
-            if log.startswith("%03d_" % operation):
-                hist = pisi.history.History(os.path.join(ctx.config.history_dir(), log))
-                hist.operation.no = int(log.split("_")[0])
-                return hist.operation
-        return None
+        return self.index.get_operation(operation)
 
     def get_package_config_files(self, operation, package):
         package_path = os.path.join(ctx.config.history_dir(), "%03d/%s" % (operation, package))
@@ -93,26 +91,24 @@ class HistoryDB(lazydb.LazyDB):
         return allconfigs
 
     def get_till_operation(self, operation):
-        if not filter(lambda x:x.startswith("%03d_" % operation), self.__logs):
+        if not self.index.has_operation(operation):
             return
 
-        for log in self.__logs:
-            if log.startswith("%03d_" % operation):
+        for no in self.index.list_operations():
+            if no == operation:
                 return
 
-            hist = pisi.history.History(os.path.join(ctx.config.history_dir(), log))
-            hist.operation.no = int(log.split("_")[0])
-            yield hist.operation
+            yield self.index.get_operation(no)
 
     def get_last(self, count=0):
-        count = count or len(self.__logs)
-        for log in self.__logs[:count]:
-            hist = pisi.history.History(os.path.join(ctx.config.history_dir(), log))
-            hist.operation.no = int(log.split("_")[0])
-            yield hist.operation
+        operations = self.index.list_operations()
+        count = count or len(operations)
+        for no in operations[:count]:
+            yield self.index.get_operation(no)
 
     def get_last_repo_update(self, last=1):
-        repoupdates = filter(lambda l:l.endswith("repoupdate.xml"), self.__logs)
+        repoupdates = filter(lambda no:self.index.get_type(no) == "repoupdate",
+                             self.index.list_operations())
         repoupdates.reverse()
         if not len(repoupdates) >= 2:
             return None
@@ -120,5 +116,4 @@ class HistoryDB(lazydb.LazyDB):
         if last != 1 and len(repoupdates) <= last:
             return None
 
-        hist = pisi.history.History(os.path.join(ctx.config.history_dir(), repoupdates[-last]))
-        return hist.operation.date
+        return self.index.get_date(repoupdates[-last])
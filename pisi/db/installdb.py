@@ -66,7 +66,10 @@ class InstallDB(lazydb.LazyDB):
 
     def init(self):
         self.installed_db = self.__generate_installed_pkgs()
-        self.rev_deps_db = self.__generate_revdeps()
+        self.deps_db = {}
+        self.rev_deps_db = {}
+        self.distro_db = {}
+        self.__generate_deps()
         self.installed_extra = self.__generate_installed_extra() 
 
     def __generate_installed_extra(self):
@@ -90,7 +93,7 @@ class InstallDB(lazydb.LazyDB):
             return open(info_path, "r").read().split()
         return []
 
-    def __add_to_revdeps(self, package, revdeps):
+    def __read_metadata(self, package):
         metadata_xml = os.path.join(self.package_path(package), ctx.const.metadata_xml)
         try:
             meta_doc = piksemel.parse(metadata_xml)
@@ -103,27 +106,79 @@ class InstallDB(lazydb.LazyDB):
             ctx.ui.warning(_("Installation info for package '%s' is broken. "
                              "Reinstall it to fix this problem.") % package)
             del self.installed_db[package]
-            return
-
-        deps = pkg.getTag('RuntimeDependencies')
-        if deps:
-            for dep in deps.tags("Dependency"):
-                revdep = revdeps.setdefault(dep.firstChild().data(), {})
-                revdep[package] = dep.toString()
-            for anydep in deps.tags("AnyDependency"):
+            return None
+
+        self.distro_db[package] = (pkg.getTagData("Distribution"),
+                                   pkg.getTagData("DistributionRelease"),
+                                   pkg.getTagData("InstallTarHash"))
+
+        deps = []
+        runtime_deps = pkg.getTag('RuntimeDependencies')
+        if runtime_deps:
+            for dep in runtime_deps.tags("Dependency"):
+                deps.append(self.__make_dependency(dep))
+            for anydep in runtime_deps.tags("AnyDependency"):
+                anydependency = pisi.specfile.AnyDependency()
                 for dep in anydep.tags("Dependency"):
-                    revdep = revdeps.setdefault(dep.firstChild().data(), {})
-                    revdep[package] = anydep.toString()
+                    anydependency.dependencies.append(self.__make_dependency(dep))
+                deps.append(anydependency)
+        return deps
+
+    def __add_deps(self, package, deps):
+        # deps_db maps a package to the names it depends on, rev_deps_db
+        # maps a name to {package: Dependency or AnyDependency}. Both are
+        # kept in sync so that adding or removing a package only touches
+        # its own edges.
+        names = []
+        for dep in deps:
+            if isinstance(dep, pisi.specfile.AnyDependency):
+                dep_names = [x.package for x in dep.dependencies]
+            else:
+                dep_names = [dep.package]
+            for name in dep_names:
+                self.rev_deps_db.setdefault(name, {})[package] = dep
+                names.append(name)
+        self.deps_db[package] = names
+
+    def __remove_deps(self, package):
+        for name in self.deps_db.pop(package, []):
+            revdeps = self.rev_deps_db.get(name)
+            if revdeps is None:
+                continue
+            revdeps.pop(package, None)
+            if not revdeps:
+                del self.rev_deps_db[name]
 
-    def __generate_revdeps(self):
-        revdeps = {}
+    def __generate_deps(self):
         for package in self.list_installed():
-            self.__add_to_revdeps(package, revdeps)
-        return revdeps
+            deps = self.__read_metadata(package)
+            if deps is not None:
+                self.__add_deps(package, deps)
 
     def list_installed(self):
         return self.installed_db.keys()
 
+    def get_upgrade_table(self):
+        """
+        get sorted list of (name, release, distribution, distribution
+        release, install tar hash) tuples of the installed packages.
+        """
+        table = []
+        for name, version in self.installed_db.iteritems():
+            distro, distro_release, hash = self.distro_db.get(name, (None, None, None))
+            table.append((name, version.rsplit("-", 1)[1], distro, distro_release, hash))
+        table.sort()
+        return table
+
+    def get_upgrade_info(self, name):
+        """
+        get (name, release, distribution, distribution release, install
+        tar hash) tuple of an installed package.
+        """
+        version = self.installed_db[name]
+        distro, distro_release, hash = self.distro_db.get(name, (None, None, None))
+        return (name, version.rsplit("-", 1)[1], distro, distro_release, hash)
+
     def has_package(self, package):
         return self.installed_db.has_key(package)
 
@@ -239,8 +294,7 @@ class InstallDB(lazydb.LazyDB):
                            ctime)
         return info
 
-    def __make_dependency(self, depStr):
-        node = piksemel.parseString(depStr)
+    def __make_dependency(self, node):
         dependency = pisi.dependency.Dependency()
         dependency.package = node.firstChild().data()
         if node.attributes():
@@ -248,38 +302,29 @@ class InstallDB(lazydb.LazyDB):
             dependency.__dict__[attr] = node.getAttribute(attr)
         return dependency
 
-    def __create_dependency(self, depStr):
-        if "<AnyDependency>" in depStr:
-            anydependency = pisi.specfile.AnyDependency()
-            for dep in re.compile('(<Dependency .*?>.*?</Dependency>)').findall(depStr):
-                anydependency.dependencies.append(self.__make_dependency(dep))
-            return anydependency
-        else:
-            return self.__make_dependency(depStr)
-
     def get_rev_deps(self, name):
-        rev_deps = []
-
-        package_revdeps = self.rev_deps_db.get(name)
-        if package_revdeps:
-            for pkg, dep in package_revdeps.items():
-                dependency = self.__create_dependency(dep)
-                rev_deps.append((pkg, dependency))
+        """
+        get list of (package, dependency) tuples of installed packages
+        depending on name. Dependency objects are shared with the index
+        and must not be modified.
+        """
+        return self.rev_deps_db.get(name, {}).items()
 
-        return rev_deps
+    def has_rev_deps(self, name):
+        return name in self.rev_deps_db
 
     def get_orphaned(self):
         """
         get list of packages installed as extra dependency,
         but without reverse dependencies now.
         """
-        return [x for x in self.installed_extra if not self.get_rev_deps(x)]
+        return [x for x in self.installed_extra if not self.has_rev_deps(x)]
 
     def get_no_rev_deps(self):
         """
         get installed packages list which haven't reverse dependencies.
         """
-        return [x for x in self.installed_db if not self.get_rev_deps(x)]
+        return [x for x in self.installed_db if not self.has_rev_deps(x)]
 
     def pkg_dir(self, pkg, version, release):
         return pisi.util.join_path(ctx.config.packages_dir(), pkg + '-' + version + '-' + release)
@@ -291,14 +336,20 @@ class InstallDB(lazydb.LazyDB):
         return metadata.package
 
     def __mark_package(self, _type, package):
+        self.__mark_packages(_type, [package])
+
+    def __mark_packages(self, _type, new_packages):
         packages = self.__get_marked_packages(_type)
-        if package not in packages:
-            packages.append(package)
-            self.__write_marked_packages(_type, packages)
+        new_packages = [p for p in new_packages if p not in packages]
+        if new_packages:
+            self.__write_marked_packages(_type, packages + new_packages)
 
     def mark_pending(self, package):
         self.__mark_package(ctx.const.config_pending, package)
 
+    def mark_pending_packages(self, packages):
+        self.__mark_packages(ctx.const.config_pending, packages)
+
     def mark_needs_restart(self, package):
         self.__mark_package(ctx.const.needs_restart, package)
 
@@ -307,21 +358,23 @@ class InstallDB(lazydb.LazyDB):
 
     def add_package(self, pkginfo):
         # Cleanup old revdep info
-        for revdep_info in self.rev_deps_db.values():
-            if pkginfo.name in revdep_info:
-                del revdep_info[pkginfo.name]
+        self.__remove_deps(pkginfo.name)
 
         self.installed_db[pkginfo.name] = "%s-%s" % (pkginfo.version, pkginfo.release)
-        self.__add_to_revdeps(pkginfo.name, self.rev_deps_db)
+        self.distro_db[pkginfo.name] = (pkginfo.distribution,
+                                        pkginfo.distributionRelease,
+                                        pkginfo.installTarHash)
+        self.__add_deps(pkginfo.name, pkginfo.packageDependencies +
+                                      pkginfo.packageAnyDependencies)
 
     def remove_package(self, package_name):
         if self.installed_db.has_key(package_name):
             del self.installed_db[package_name]
 
+        self.distro_db.pop(package_name, None)
+
         # Cleanup revdep info
-        for revdep_info in self.rev_deps_db.values():
-            if package_name in revdep_info:
-                del revdep_info[package_name]
+        self.__remove_deps(package_name)
 
         self.clear_pending(package_name)
 
@@ -39,16 +39,22 @@ class ItemByRepo:
 
         raise Exception(_("%s not found in any repository.") % str(item))
 
-    def get_item_repo(self, item, repo=None):
+    def item_repo(self, item, repo=None):
+        """Return the repository of item, searching the repositories in
+        order if repo is None, without reading the item."""
         for r in self.item_repos(repo):
             if self.dbobj.has_key(r) and self.dbobj[r].has_key(item):
-                if self.compressed:
-                    return gzip.zlib.decompress(self.dbobj[r][item]), r
-                else:
-                    return self.dbobj[r][item], r
+                return r
 
         raise Exception(_("Repo item %s not found") % str(item))
 
+    def get_item_repo(self, item, repo=None):
+        r = self.item_repo(item, repo)
+        if self.compressed:
+            return gzip.zlib.decompress(self.dbobj[r][item]), r
+        else:
+            return self.dbobj[r][item], r
+
     def get_item(self, item, repo=None):
         item, repo = self.get_item_repo(item, repo)
         return item
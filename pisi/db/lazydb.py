@@ -13,6 +13,7 @@
 import os
 import cPickle
 import time
+import itertools
 import pisi.context as ctx
 import pisi.util as util
 
@@ -36,7 +37,10 @@ class Singleton(object):
 
 class LazyDB(Singleton):
 
-    cache_version = "2.7.1"
+    cache_version = "2.7.3"
+
+    # numbers the loaded databases, see pisi.db.objectcache
+    generations = itertools.count(1)
 
     def __init__(self, cacheable=False, cachedir=None):
         if not self.__dict__.has_key("initialized"):
@@ -105,8 +109,13 @@ class LazyDB(Singleton):
             pass
 
     def __init(self):
-        if not self.cache_load():
-            self.init()
+        name = self.__class__.__name__
+        with ctx.profiler.span("db.cache_load", db=name):
+            loaded = self.cache_load()
+        if not loaded:
+            with ctx.profiler.span("db.init", db=name):
+                self.init()
+        self.generation = LazyDB.generations.next()
 
     def __getattr__(self, attr):
         if not attr == "__setstate__" and not self.initialized:
@@ -0,0 +1,90 @@
+# -*- coding: utf-8 -*-
+#
+# Copyright (C) 2011, TUBITAK/UEKAE
+#
+# This program is free software; you can redistribute it and/or modify it under
+# the terms of the GNU General Public License as published by the Free
+# Software Foundation; either version 2 of the License, or (at your option)
+# any later version.
+#
+# Please read the COPYING file.
+#
+
+"""Decoded objects of the repository databases.
+
+Decoding a package, spec or component from the index XML is expensive
+and the planners ask for the same ones many times in a command. The
+most recently used decoded objects are kept pickled: every lookup
+unpickles a private copy, so a caller changing the object it gets can't
+affect the others, and the size of the pickles bounds the memory used.
+
+Keys include the generation of the database (see LazyDB), so objects
+of a reloaded database are never mixed with the old ones."""
+
+import cPickle
+import threading
+import collections
+
+import pisi.context as ctx
+
+
+class ObjectCache:
+    """LRU cache of objects, limited in count and in pickled size."""
+
+    def __init__(self, max_items=4096, max_bytes=32 * 1024 * 1024):
+        self.max_items = max_items
+        self.max_bytes = max_bytes
+        self.entries = collections.OrderedDict()
+        self.bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.lock = threading.Lock()
+
+    def get(self, key, decode, *args):
+        """Return a copy of the object of key, calling decode(*args) to
+        make it if it is not cached."""
+        self.lock.acquire()
+        try:
+            data = self.entries.pop(key, None)
+            if data is not None:
+                # most recently used ones are at the end
+                self.entries[key] = data
+                self.hits += 1
+        finally:
+            self.lock.release()
+
+        if data is not None:
+            ctx.profiler.count("objectcache.hit")
+            return cPickle.loads(data)
+
+        ctx.profiler.count("objectcache.miss")
+        obj = decode(*args)
+        try:
+            data = cPickle.dumps(obj, cPickle.HIGHEST_PROTOCOL)
+        except (cPickle.PicklingError, TypeError):
+            data = None
+
+        self.lock.acquire()
+        try:
+            self.misses += 1
+            if data is not None and len(data) <= self.max_bytes \
+                    and not self.entries.has_key(key):
+                self.entries[key] = data
+                self.bytes += len(data)
+                while len(self.entries) > self.max_items or self.bytes > self.max_bytes:
+                    old_key, old_data = self.entries.popitem(last=False)
+                    self.bytes -= len(old_data)
+        finally:
+            self.lock.release()
+
+        return obj
+
+    def clear(self):
+        self.lock.acquire()
+        try:
+            self.entries.clear()
+            self.bytes = 0
+        finally:
+            self.lock.release()
+
+cache = ObjectCache()
@@ -23,8 +23,10 @@ import piksemel
 import pisi.db
 import pisi.metadata
 import pisi.dependency
+import pisi.profiler
 import pisi.db.itembyrepo
 import pisi.db.lazydb as lazydb
+import pisi.db.objectcache as objectcache
 
 class PackageDB(lazydb.LazyDB):
 
@@ -36,6 +38,7 @@ class PackageDB(lazydb.LazyDB):
         self.__revdeps = {}       # Reverse dependencies
         self.__obsoletes = {}     # Obsoletes
         self.__replaces = {}      # Replaces
+        self.__upgrade_info = {}  # Versions for upgrade checks
 
         repodb = pisi.db.repodb.RepoDB()
 
@@ -45,11 +48,13 @@ class PackageDB(lazydb.LazyDB):
             self.__revdeps[repo] = self.__generate_revdeps(doc)
             self.__obsoletes[repo] = self.__generate_obsoletes(doc)
             self.__replaces[repo] = self.__generate_replaces(doc)
+            self.__upgrade_info[repo] = self.__generate_upgrade_info(doc)
 
         self.pdb = pisi.db.itembyrepo.ItemByRepo(self.__package_nodes, compressed=True)
         self.rvdb = pisi.db.itembyrepo.ItemByRepo(self.__revdeps)
         self.odb = pisi.db.itembyrepo.ItemByRepo(self.__obsoletes)
         self.rpdb = pisi.db.itembyrepo.ItemByRepo(self.__replaces)
+        self.uidb = pisi.db.itembyrepo.ItemByRepo(self.__upgrade_info)
 
     def __generate_replaces(self, doc):
         return [x.getTagData("Name") for x in doc.tags("Package") if x.getTagData("Replaces")]
@@ -67,6 +72,17 @@ class PackageDB(lazydb.LazyDB):
     def __generate_packages(self, doc):
         return dict(map(lambda x: (x.getTagData("Name"), gzip.zlib.compress(x.toString())), doc.tags("Package")))
 
+    def __generate_upgrade_info(self, doc):
+        info = {}
+        for node in doc.tags("Package"):
+            name = node.getTagData("Name")
+            release = node.getTag("History").getTag("Update").getAttribute("release")
+            info[name] = (name, release,
+                          node.getTagData("Distribution"),
+                          node.getTagData("DistributionRelease"),
+                          node.getTagData("InstallTarHash"))
+        return info
+
     def __generate_revdeps(self, doc):
         revdeps = {}
         for node in doc.tags("Package"):
@@ -153,12 +169,35 @@ class PackageDB(lazydb.LazyDB):
         pkg_doc = piksemel.parseString(self.pdb.get_item(name, repo))
         return self.__get_version(pkg_doc)
 
+    @pisi.profiler.profiled("packagedb.get_package")
     def get_package_repo(self, name, repo=None):
-        pkg, repo = self.pdb.get_item_repo(name, repo)
-        package = pisi.metadata.Package()
-        package.parse(pkg)
+        repo = self.pdb.item_repo(name, repo)
+        package = objectcache.cache.get(("package", self.generation, repo, name),
+                                        self.__decode_package, name, repo)
         return package, repo
 
+    def __decode_package(self, name, repo):
+        package = pisi.metadata.Package()
+        package.parse(self.pdb.get_item(name, repo))
+        return package
+
+    def get_upgrade_table(self):
+        """
+        get sorted list of (name, release, distribution, distribution
+        release, install tar hash) tuples of the packages in the
+        repositories. The first repository providing a package wins.
+        """
+        table = {}
+        repos = pisi.db.repodb.RepoDB().list_repos()
+        repos.reverse()
+        for repo in repos:
+            if self.uidb.has_repo(repo):
+                table.update(self.uidb.dbobj[repo])
+        return sorted(table.values())
+
+    def get_upgrade_info(self, name, repo=None):
+        return self.uidb.get_item(name, repo)
+
     def which_repo(self, name):
         return self.pdb.which_repo(name)
 
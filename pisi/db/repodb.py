@@ -169,7 +169,8 @@ class RepoDB(lazydb.LazyDB):
             return piksemel.newDocument("PISI")
 
         try:
-            return piksemel.parse(index_path)
+            with ctx.profiler.span("repo.parse_index", repo=repo_name):
+                return piksemel.parse(index_path)
         except Exception, e:
             raise RepoError(_("Error parsing repository index information. Index file does not exist or is malformed."))
 
@@ -18,6 +18,7 @@ import piksemel
 import pisi
 import pisi.specfile
 import pisi.db.lazydb as lazydb
+import pisi.db.objectcache as objectcache
 
 class SourceDB(lazydb.LazyDB):
 
@@ -107,11 +108,16 @@ class SourceDB(lazydb.LazyDB):
         return found
 
     def get_spec_repo(self, name, repo=None):
-        src, repo = self.sdb.get_item_repo(name, repo)
-        spec = pisi.specfile.SpecFile()
-        spec.parse(src)
+        repo = self.sdb.item_repo(name, repo)
+        spec = objectcache.cache.get(("spec", self.generation, repo, name),
+                                     self.__decode_spec, name, repo)
         return spec, repo
 
+    def __decode_spec(self, name, repo):
+        spec = pisi.specfile.SpecFile()
+        spec.parse(self.sdb.get_item(name, repo))
+        return spec
+
     def pkgtosrc(self, name, repo=None):
         return self.psdb.get_item(name, repo)
 
@@ -20,6 +20,11 @@ import os
 import time
 import base64
 import shutil
+import socket
+import httplib
+import hashlib
+import urlparse
+import threading
 
 import gettext
 __trans = gettext.translation('pisi', fallback=True)
@@ -36,8 +41,76 @@ class FetchError(pisi.Error):
     pass
 
 
+blocksize = 256 * 1024
+
+
+class StreamHasher:
+    """Calculates the SHA1 of a file while it is being downloaded.
+
+    The downloaded bytes are hashed as soon as they reach the partial
+    file, so the final hash is ready when the transfer ends and the
+    fetched file doesn't need to be read again. The blocks are also
+    passed to the write method of sink, if given, e.g. to decompress
+    the file in the same pass."""
+
+    # don't bother reading the partial file for less than this
+    chunk_size = 1024 * 1024
+
+    def __init__(self, filename, sink=None):
+        self.filename = filename
+        self.sink = sink
+        self.sha1 = hashlib.sha1()
+        self.offset = 0
+        self.file = None
+        self.broken = False
+
+    def update(self, size=None):
+        """Hash the file up to size bytes, or up to its end."""
+        if self.broken:
+            return
+
+        if size is not None and size - self.offset < self.chunk_size:
+            return
+
+        try:
+            if self.file is None:
+                self.file = open(self.filename, "rb")
+
+            if os.fstat(self.file.fileno()).st_size < self.offset:
+                # file was truncated behind our back, give up
+                self.broken = True
+                return
+
+            while size is None or self.offset < size:
+                length = 256 * 1024
+                if size is not None:
+                    length = min(length, size - self.offset)
+                block = self.file.read(length)
+                if not block:
+                    break
+                self.sha1.update(block)
+                if self.sink:
+                    self.sink.write(block)
+                self.offset += len(block)
+        except IOError:
+            self.broken = True
+
+    def finish(self):
+        """Hash the remaining tail and return the hex digest, or None if
+        the file couldn't be followed."""
+        self.update()
+        if self.file is not None:
+            self.file.close()
+            self.file = None
+
+        if self.broken or self.offset != os.path.getsize(self.filename):
+            return None
+
+        return self.sha1.hexdigest()
+
+
 class UIHandler:
-    def __init__(self, progress):
+    def __init__(self, progress, hasher=None):
         self.filename        = None
         self.url             = None
         self.basename        = None
@@ -49,6 +122,7 @@ class UIHandler:
         self.symbol          = '--/-'
         self.last_updated    = 0
         self.exist_size      = 0
+        self.hasher          = hasher
 
     def start(self, archive, url, basename, size, text):
         if os.path.exists(archive):
@@ -66,6 +140,9 @@ class UIHandler:
 
     def update(self, size):
 
+        if self.hasher:
+            self.hasher.update(size)
+
         if self.size == size:
             return
 
@@ -102,6 +179,174 @@ class UIHandler:
         self.last_updated = self.now()
 
 
+class ConnectionPool:
+    """Idle persistent HTTP connections, kept per scheme and host.
+
+    A connection is taken out of the pool for a request and given back
+    once its response is read to the end, so the downloads from a mirror
+    share one TCP (and TLS) connection instead of opening one per file."""
+
+    def __init__(self, max_idle=4, timeout=30):
+        self.max_idle = max_idle
+        self.timeout = timeout
+        self.idle = {}
+        self.opened = 0
+        self.lock = threading.Lock()
+
+    def get(self, key):
+        """Return (connection, reused) for key, a (scheme, host) tuple."""
+        self.lock.acquire()
+        try:
+            if self.idle.get(key):
+                return self.idle[key].pop(), True
+            self.opened += 1
+        finally:
+            self.lock.release()
+
+        scheme, host = key
+        if scheme == "https":
+            connection = httplib.HTTPSConnection(host, timeout=self.timeout)
+        else:
+            connection = httplib.HTTPConnection(host, timeout=self.timeout)
+        return connection, False
+
+    def put(self, key, connection):
+        self.lock.acquire()
+        try:
+            idle = self.idle.setdefault(key, [])
+            if len(idle) < self.max_idle:
+                idle.append(connection)
+                return
+        finally:
+            self.lock.release()
+        connection.close()
+
+    def close(self):
+        """Close all idle connections."""
+        self.lock.acquire()
+        try:
+            for connections in self.idle.values():
+                for connection in connections:
+                    connection.close()
+            self.idle = {}
+        finally:
+            self.lock.release()
+
+pool = ConnectionPool()
+
+
+class HTTPResponse:
+    """Response of http_request. release() gives the connection back to
+    the pool, or closes it if the server is going to."""
+
+    def __init__(self, key, connection, response, uri):
+        self.key = key
+        self.connection = connection
+        self.response = response
+        self.uri = uri
+        self.status = response.status
+        self.reason = response.reason
+
+    def getheader(self, name, default=None):
+        return self.response.getheader(name, default)
+
+    def read(self, size=None):
+        return self.response.read(size)
+
+    def release(self):
+        if self.response.will_close:
+            self.connection.close()
+        else:
+            self.response.read()
+            pool.put(self.key, self.connection)
+
+    def close(self):
+        self.connection.close()
+
+def http_request(method, uri, headers={}, timeout=None, redirects=5):
+    """Send an HTTP request over a pooled connection and return its
+    HTTPResponse. A stale kept-alive connection is replaced silently,
+    redirections are followed. Raises httplib.HTTPException or
+    socket.error."""
+    for i in range(redirects + 1):
+        parts = urlparse.urlsplit(uri)
+        host = parts.hostname
+        if parts.port:
+            host = "%s:%d" % (host, parts.port)
+        key = (parts.scheme, host)
+        path = parts.path or "/"
+        if parts.query:
+            path += "?" + parts.query
+
+        while True:
+            connection, reused = pool.get(key)
+            connection.timeout = timeout or pool.timeout
+            if connection.sock:
+                connection.sock.settimeout(connection.timeout)
+            try:
+                connection.request(method, path, headers=headers)
+                response = connection.getresponse()
+                break
+            except (httplib.HTTPException, socket.error):
+                connection.close()
+                # the server closed an idle connection, open a new one
+                if not reused:
+                    raise
+
+        response = HTTPResponse(key, connection, response, uri)
+        location = response.getheader("location")
+        if response.status not in (301, 302, 303, 307) or not location:
+            return response
+
+        response.release()
+        uri = urlparse.urljoin(uri, location)
+        if response.status == 303:
+            method = "GET"
+
+    raise httplib.HTTPException(_("Too many redirections"))
+
+
+class Segment:
+    """Byte range [start, end) of a segmented download, downloaded up
+    to pos."""
+
+    def __init__(self, start, end, pos=None):
+        self.start = start
+        self.end = end
+        self.pos = pos
+        if pos is None:
+            self.pos = start
+        self.error = None
+
+def plan_segments(start, end, count):
+    """Split the byte range [start, end) into count segments."""
+    size = (end - start) / count
+    segments = []
+    for i in range(count):
+        segments.append(Segment(start + i * size, start + (i + 1) * size))
+    segments[-1].end = end
+    return segments
+
+def downloaded_prefix(segments):
+    """Return the size of the data downloaded without gaps from the
+    start of the file."""
+    prefix = 0
+    for segment in segments:
+        prefix = segment.pos
+        if segment.pos < segment.end:
+            break
+    return prefix
+
+def content_range_total(response):
+    """Return the total size of the file from the Content-Range header
+    of a partial response."""
+    content_range = response.getheader("content-range") or ""
+    try:
+        return int(content_range.split("/")[1])
+    except (IndexError, ValueError):
+        return None
+
+
 class Fetcher:
     """Fetcher can fetch a file from various sources using various
     protocols."""
@@ -116,13 +361,28 @@ class Fetcher:
         self.destdir = destdir
         self.destfile = destfile
         self.progress = None
+        self.record_hash = False
+        self.sha1sum = None
+        self.expected_sha1sum = None
+        self.sink = None
+        self.mirrors = []
 
         self.archive_file = os.path.join(destdir, destfile or url.filename())
         self.partial_file = os.path.join(self.destdir, self.url.filename()) + ctx.const.partial_suffix
+        self.segments_file = self.partial_file + ".segments"
 
         util.ensure_dirs(self.destdir)
 
     def test(self, timeout=3):
+        if self._use_http(self._get_proxies()):
+            try:
+                response = http_request("HEAD", self.url.get_uri(),
+                                        self._get_request_headers(), timeout)
+                response.release()
+            except (httplib.HTTPException, socket.error):
+                return False
+            return response.status < 400
+
         import urlgrabber
 
         try:
@@ -140,12 +400,6 @@ class Fetcher:
     def fetch (self):
         """Return value: Fetched file's full path.."""
 
-        # import urlgrabber module
-        try:
-            import urlgrabber
-        except ImportError:
-            raise FetchError(_('Urlgrabber needs to be installed to run this command'))
-
         if not self.url.filename():
             raise FetchError(_('Filename error'))
 
@@ -155,27 +409,343 @@ class Fetcher:
         if os.path.exists(self.archive_file) and not os.access(self.archive_file, os.W_OK):
             raise FetchError(_('Access denied to destination file: "%s"') % (self.archive_file))
 
+        proxies = self._get_proxies()
+        with ctx.profiler.span("fetch", url=self.url.get_uri()):
+            if self._use_http(proxies):
+                hasher = self._fetch_http()
+            else:
+                hasher = self._fetch_urlgrabber(proxies)
+
+        if os.stat(self.partial_file).st_size == 0:
+            os.remove(self.partial_file)
+            raise FetchError(_('A problem occurred. Please check the archive address and/or permissions again.'))
+
+        if hasher:
+            self.sha1sum = hasher.finish()
+
+        if self.expected_sha1sum:
+            if not self.sha1sum:
+                self.sha1sum = util.sha1_file(self.partial_file)
+            if self.sha1sum != self.expected_sha1sum:
+                os.remove(self.partial_file)
+                if self.sink:
+                    self.sink.abort()
+                raise FetchError(_("File integrity of %s compromised.") % self.url.get_uri())
+
+        if self.sink:
+            if self.sha1sum:
+                self.sink.close()
+            else:
+                self.sink.abort()
+
+        shutil.move(self.partial_file, self.archive_file)
+
+        if self.record_hash:
+            import pisi.hashcache
+            if self.sha1sum:
+                pisi.hashcache.record(self.archive_file, self.sha1sum)
+            else:
+                self.sha1sum = pisi.hashcache.sha1_file(self.archive_file)
+
+        return self.archive_file
+
+    def _use_http(self, proxies):
+        """Plain HTTP(S) downloads go through the connection pool,
+        urlgrabber handles the rest and the proxies."""
+        return self.url.scheme() in ("http", "https") and not proxies
+
+    def _fetch_urlgrabber(self, proxies):
+        # import urlgrabber module
+        try:
+            import urlgrabber
+        except ImportError:
+            raise FetchError(_('Urlgrabber needs to be installed to run this command'))
+
+        reget = self._test_range_support()
+
+        # Hash the data while it is written unless we resume a partial
+        # download, whose head may be overwritten by the server. The
+        # sink gets the data only if sha1sum is set after the fetch.
+        hasher = None
+        if not reget:
+            hasher = StreamHasher(self.partial_file, self.sink)
+
         try:
             urlgrabber.urlgrab(self.url.get_uri(),
                            self.partial_file,
-                           progress_obj = UIHandler(self.progress),
+                           progress_obj = UIHandler(self.progress, hasher),
                            http_headers = self._get_http_headers(),
                            ftp_headers  = self._get_ftp_headers(),
-                           proxies      = self._get_proxies(),
+                           proxies      = proxies,
                            throttle     = self._get_bandwith_limit(),
-                           reget        = self._test_range_support(),
+                           reget        = reget,
                            copy_local   = 1,
                            user_agent   = 'PiSi Fetcher/' + pisi.__version__)
         except urlgrabber.grabber.URLGrabError, e:
             raise FetchError(_('Could not fetch destination file "%s": %s') % (self.url.get_uri(), e))
 
-        if os.stat(self.partial_file).st_size == 0:
-            os.remove(self.partial_file)
-            raise FetchError(_('A problem occurred. Please check the archive address and/or permissions again.'))
-
-        shutil.move(self.partial_file, self.archive_file)
-
-        return self.archive_file
+        return hasher
+
+    def _fetch_http(self):
+        """Download the file over a pooled connection. A partial file is
+        resumed with a Range request on the same connection; the server
+        answers with the whole file if it can't resume. Big files are
+        downloaded in segments, see _fetch_segments."""
+        uri = self.url.get_uri()
+        headers = self._get_request_headers()
+        throttle = self._get_bandwith_limit()
+
+        exist_size = 0
+        if os.path.exists(self.partial_file):
+            exist_size = os.path.getsize(self.partial_file)
+
+        state = self._read_segments()
+        first = None
+        if state:
+            total_size, segments = state
+            pending = [x for x in segments if x.pos < x.end]
+            if not pending:
+                return self._fetch_segments(total_size, segments)
+            first = pending[0]
+            headers["Range"] = "bytes=%d-%d" % (first.pos, first.end - 1)
+        elif exist_size:
+            headers["Range"] = "bytes=%d-" % exist_size
+
+        response = None
+        try:
+            response = http_request("GET", uri, headers)
+            if state:
+                if response.status == 206 and content_range_total(response) == total_size:
+                    response, first_response = None, response
+                    return self._fetch_segments(total_size, segments, first, first_response)
+                ctx.ui.debug(_("Remote file has changed. Previously downloaded parts of the file will be removed."))
+                response.close()
+                self._remove_partial()
+                exist_size = 0
+                del headers["Range"]
+                response = http_request("GET", uri, headers)
+
+            if response.status == 416 and exist_size:
+                ctx.ui.debug(_("Previously downloaded part of the file can not be resumed and will be removed."))
+                response.release()
+                os.remove(self.partial_file)
+                exist_size = 0
+                del headers["Range"]
+                response = http_request("GET", uri, headers)
+
+            if response.status == 206 and exist_size:
+                mode = "ab"
+            elif response.status == 200:
+                if exist_size:
+                    ctx.ui.debug(_("Server doesn't support partial downloads. Previously downloaded part of the file will be over-written."))
+                mode = "wb"
+                exist_size = 0
+            else:
+                status, reason = response.status, response.reason
+                response.release()
+                response = None
+                raise FetchError(_('Could not fetch destination file "%s": HTTP Error %d: %s')
+                                 % (uri, status, reason))
+
+            length = response.getheader("content-length")
+            total_size = None
+            if length is not None:
+                total_size = exist_size + int(length)
+
+            count = self._segment_count(response, exist_size, total_size, throttle)
+            if count > 1:
+                if mode == "wb":
+                    open(self.partial_file, "wb").close()
+                segments = plan_segments(exist_size, total_size, count)
+                if exist_size:
+                    segments.insert(0, Segment(0, exist_size, exist_size))
+                response, first_response = None, response
+                return self._fetch_segments(total_size, segments,
+                                            segments[exist_size and 1 or 0], first_response)
+
+            hasher = StreamHasher(self.partial_file, self.sink)
+            handler = UIHandler(self.progress, hasher)
+            handler.start(self.partial_file, uri, os.path.basename(self.partial_file),
+                          total_size, None)
+
+            size = exist_size
+            start = time.time()
+            partial = open(self.partial_file, mode)
+            try:
+                while True:
+                    block = response.read(blocksize)
+                    if not block:
+                        break
+                    partial.write(block)
+                    partial.flush()
+                    size += len(block)
+                    handler.update(size)
+                    if throttle:
+                        delay = (size - exist_size) / float(throttle) - (time.time() - start)
+                        if delay > 0:
+                            time.sleep(delay)
+            finally:
+                partial.close()
+            handler.end(size)
+
+            if total_size is not None and size != total_size:
+                raise FetchError(_('Could not fetch destination file "%s": %s')
+                                 % (uri, _("Connection closed after %d of %d bytes") % (size, total_size)))
+
+            response.release()
+            response = None
+        except (httplib.HTTPException, socket.error, ValueError), e:
+            raise FetchError(_('Could not fetch destination file "%s": %s') % (uri, e))
+        finally:
+            if response is not None:
+                response.close()
+
+        return hasher
+
+    def _segment_count(self, response, exist_size, total_size, throttle):
+        """Return the number of connections to download the rest of the
+        file with. Limited bandwidth is not worth more connections."""
+        segments = int(ctx.config.values.general.fetch_segments or 1)
+        threshold = 1024 * int(ctx.config.values.general.fetch_segment_threshold)
+        if segments < 2 or throttle or total_size is None:
+            return 1
+        if total_size - exist_size < max(threshold, segments):
+            return 1
+        if response.status != 206 and response.getheader("accept-ranges") != "bytes":
+            return 1
+        return segments
+
+    def _fetch_segments(self, total_size, segments, first=None, response=None):
+        """Download the missing data of segments concurrently, each one
+        from the URL or a mirror of it in turn. response, if given, is
+        an open response streaming the data of segment first.
+
+        The segments are written to their places in the partial file.
+        The state of the download is saved next to it, so an
+        interrupted download resumes with the missing parts only. The
+        data is hashed (and passed to the sink) as soon as it is
+        contiguous from the start of the file."""
+        uris = [self.url.get_uri()] + [str(x) for x in self.mirrors]
+        if not os.path.exists(self.partial_file):
+            open(self.partial_file, "wb").close()
+        self._write_segments(total_size, segments)
+
+        hasher = StreamHasher(self.partial_file, self.sink)
+        handler = UIHandler(self.progress)
+        handler.start(self.partial_file, uris[0], os.path.basename(self.partial_file),
+                      total_size, None)
+
+        stop = threading.Event()
+        threads = []
+        for index, segment in enumerate(segments):
+            if segment.pos >= segment.end:
+                continue
+            order = uris[index % len(uris):] + uris[:index % len(uris)]
+            thread = threading.Thread(target=self._fetch_segment,
+                                      args=(segment, order, total_size, stop,
+                                            segment is first and response or None))
+            thread.setDaemon(True)
+            thread.start()
+            threads.append(thread)
+        ctx.ui.debug(_("Fetching %s in %d segments") % (uris[0], len(threads)))
+
+        saved = time.time()
+        try:
+            for thread in threads:
+                while thread.isAlive():
+                    thread.join(0.2)
+                    handler.update(sum([x.pos for x in segments]) - sum([x.start for x in segments]))
+                    hasher.update(downloaded_prefix(segments))
+                    if time.time() - saved >= 1:
+                        self._write_segments(total_size, segments)
+                        saved = time.time()
+        finally:
+            stop.set()
+            self._write_segments(total_size, segments)
+        handler.end(total_size)
+
+        unfinished = [x for x in segments if x.pos < x.end]
+        if unfinished:
+            raise FetchError(_('Could not fetch destination file "%s": %s')
+                             % (uris[0], unfinished[0].error or _("Download interrupted")))
+
+        os.remove(self.segments_file)
+        return hasher
+
+    def _fetch_segment(self, segment, uris, total_size, stop, response=None):
+        """Thread body downloading the rest of segment from the first of
+        uris which can serve it."""
+        for uri in uris:
+            if stop.isSet():
+                return
+            try:
+                if response is None:
+                    headers = self._get_request_headers(uri)
+                    headers["Range"] = "bytes=%d-%d" % (segment.pos, segment.end - 1)
+                    response = http_request("GET", uri, headers)
+                    if response.status != 206 or content_range_total(response) != total_size:
+                        raise FetchError(_("%s can not serve bytes %d-%d of the file")
+                                         % (uri, segment.pos, segment.end - 1))
+                    complete = True
+                else:
+                    # the response streams the rest of the file
+                    complete = False
+
+                partial = open(self.partial_file, "r+b")
+                try:
+                    partial.seek(segment.pos)
+                    while segment.pos < segment.end and not stop.isSet():
+                        block = response.read(min(blocksize, segment.end - segment.pos))
+                        if not block:
+                            raise FetchError(_("Connection closed after %d of %d bytes")
+                                             % (segment.pos, total_size))
+                        partial.write(block)
+                        partial.flush()
+                        segment.pos += len(block)
+                finally:
+                    partial.close()
+
+                if complete and segment.pos == segment.end:
+                    response.release()
+                    response = None
+                return
+            except (pisi.Error, httplib.HTTPException, socket.error, IOError, ValueError), e:
+                segment.error = e
+            finally:
+                if response is not None:
+                    response.close()
+                    response = None
+
+    def _read_segments(self):
+        """Return (total size, segments) of an interrupted segmented
+        download, or None."""
+        if not os.path.exists(self.partial_file):
+            return None
+        try:
+            lines = open(self.segments_file).read().splitlines()
+            total_size = int(lines[0])
+            segments = [Segment(*map(int, x.split())) for x in lines[1:]]
+        except (IOError, IndexError, ValueError, TypeError):
+            return None
+        return total_size, segments
+
+    def _write_segments(self, total_size, segments):
+        lines = ["%d" % total_size]
+        for segment in segments:
+            lines.append("%d %d %d" % (segment.start, segment.end, segment.pos))
+        open(self.segments_file, "w").write("\n".join(lines) + "\n")
+
+    def _remove_partial(self):
+        for path in (self.partial_file, self.segments_file):
+            if os.path.exists(path):
+                os.remove(path)
+
+    def _get_request_headers(self, uri=None):
+        headers = {"User-Agent": 'PiSi Fetcher/' + pisi.__version__}
+        if uri is None or uri == self.url.get_uri():
+            for name, value in self._get_http_headers():
+                headers[name] = value.strip().replace("\n", "")
+        return headers
 
     def _get_http_headers(self):
         headers = []
@@ -239,7 +809,21 @@ class Fetcher:
 
 
 # helper function
-def fetch_url(url, destdir, progress=None, destfile=None):
+def fetch_url(url, destdir, progress=None, destfile=None, record_hash=False,
+              sink=None, sha1sum=None, mirrors=[]):
     fetch = Fetcher(url, destdir, destfile)
     fetch.progress = progress
+    fetch.record_hash = record_hash
+    fetch.sink = sink
+    fetch.expected_sha1sum = sha1sum
+    fetch.mirrors = mirrors
     fetch.fetch()
+    return fetch
+
+def fetch_urls(urls, destdir, progress=None, record_hash=False):
+    """Fetch urls to destdir one after another and return their
+    Fetchers. Downloads from the same HTTP server share a connection."""
+    fetchers = []
+    for url in urls:
+        fetchers.append(fetch_url(url, destdir, progress, record_hash=record_hash))
+    return fetchers
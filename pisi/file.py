@@ -19,6 +19,7 @@ like all pisi classes, it has been programmed in a non-restrictive way
 
 import os
 import shutil
+import hashlib
 
 import gettext
 __trans = gettext.translation('pisi', fallback=True)
@@ -28,6 +29,7 @@ import pisi
 import pisi.uri
 import pisi.util
 import pisi.fetcher
+import pisi.hashcache
 import pisi.context as ctx
 
 class AlreadyHaveException(pisi.Exception):
@@ -50,6 +52,75 @@ class InvalidSignature(pisi.Error):
         pisi.Exception.__init__(self, _(" invalid for %s") % url)
         self.url = url
 
+class Decompressor:
+    """Writes the decompressed data of a file given block by block.
+
+    Used as the sink of a download, so the file is decompressed while it
+    is fetched and hashed. The data is written to a temporary file which
+    replaces path on commit, after the download is verified. Errors are
+    not raised while writing, the output is dropped instead and complete
+    stays False; the caller then decompresses the file the usual way and
+    gets the error there."""
+
+    def __init__(self, method, path):
+        self.method = method
+        self.path = path
+        self.tmp_path = path + ctx.const.temporary_suffix
+        self.start()
+
+    def start(self):
+        if self.method == File.COMPRESSION_TYPE_XZ:
+            import lzma
+            self.decompressor = lzma.LZMADecompressor()
+        else:
+            import bz2
+            self.decompressor = bz2.BZ2Decompressor()
+        self.file = open(self.tmp_path, "wb")
+        self.complete = False
+
+    def write(self, data):
+        if self.file is None:
+            return
+        try:
+            self.file.write(self.decompressor.decompress(data))
+        except EOFError:
+            # trailing data after the end of the stream
+            pass
+        except Exception, e:
+            ctx.ui.debug(_("Could not decompress %s while fetching: %s") % (self.path, e))
+            self.abort()
+
+    def close(self):
+        if self.file is None:
+            return
+        try:
+            if hasattr(self.decompressor, "flush"):
+                self.file.write(self.decompressor.flush())
+            self.file.close()
+        except Exception, e:
+            ctx.ui.debug(_("Could not decompress %s while fetching: %s") % (self.path, e))
+            self.abort()
+            return
+        self.file = None
+        self.complete = True
+
+    def commit(self):
+        os.rename(self.tmp_path, self.path)
+
+    def abort(self):
+        self.complete = False
+        if self.file is not None:
+            self.file.close()
+            self.file = None
+        if os.path.exists(self.tmp_path):
+            os.unlink(self.tmp_path)
+
+    def reset(self):
+        """Drop the data written so far, e.g. to fetch the file again."""
+        self.abort()
+        self.start()
+
+
 class File:
 
     # Compression types
@@ -88,21 +159,91 @@ class File:
         return filename.endswith(tuple(File.__compressed_file_extensions))
 
     @staticmethod
-    def decompress(localfile, compress):
+    def decompressed_name(localfile, compress):
+        """Return the method and the name of the decompressed file, or
+        (None, localfile) if localfile is not to be decompressed."""
         compress = File.choose_method(localfile, compress)
+        if compress == File.COMPRESSION_TYPE_XZ:
+            return compress, localfile[:-3]
+        elif compress == File.COMPRESSION_TYPE_BZ2:
+            return compress, localfile[:-4]
+        return None, localfile
+
+    @staticmethod
+    def decompress(localfile, compress):
+        compress, target = File.decompressed_name(localfile, compress)
         if compress == File.COMPRESSION_TYPE_XZ:
             import lzma
-            open(localfile[:-3], "w").write(lzma.LZMAFile(localfile).read())
-            localfile = localfile[:-3]
+            source = lzma.LZMAFile(localfile)
         elif compress == File.COMPRESSION_TYPE_BZ2:
             import bz2
-            open(localfile[:-4], "w").write(bz2.BZ2File(localfile).read())
-            localfile = localfile[:-4]
-        return localfile
+            source = bz2.BZ2File(localfile)
+        else:
+            return localfile
+
+        output = open(target, "w")
+        while True:
+            block = source.read(256 * 1024)
+            if not block:
+                break
+            output.write(block)
+        output.close()
+        source.close()
+        return target
+
+    @staticmethod
+    def copy(source, dest, sink=None):
+        """Copy source to dest, passing the data to the sink if given,
+        and return its SHA1."""
+        sha1 = hashlib.sha1()
+        input = open(source, "rb")
+        output = open(dest, "wb")
+        try:
+            while True:
+                block = input.read(256 * 1024)
+                if not block:
+                    break
+                output.write(block)
+                sha1.update(block)
+                if sink:
+                    sink.write(block)
+        finally:
+            input.close()
+            output.close()
+        shutil.copymode(source, dest)
+        return sha1.hexdigest()
+
+    @staticmethod
+    def fetch(uri, transfer_dir, destfile=None, sink=None, peer=True):
+        """Fetch the remote uri into transfer_dir, from the peer cache
+        first if one is configured and peer is set (see pisi.peercache)."""
+        import pisi.peercache
+
+        peer = peer and pisi.peercache.peer_uri(uri)
+        if peer:
+            try:
+                return pisi.fetcher.fetch_url(peer, transfer_dir, ctx.ui.Progress,
+                                              destfile, sink=sink)
+            except pisi.fetcher.FetchError, e:
+                ctx.ui.warning(_("Could not fetch %s from the peer cache: %s") % (uri, e))
+                if sink:
+                    sink.reset()
+
+        return pisi.fetcher.fetch_url(uri, transfer_dir, ctx.ui.Progress,
+                                      destfile, sink=sink)
 
     @staticmethod
     def download(uri, transfer_dir = "/tmp", sha1sum = False,
-                 compress = None, sign = None, copylocal = False):
+                 compress = None, sign = None, copylocal = False, peer = True):
+        """Fetch uri into transfer_dir and return the local file name.
+
+        A fetched or copied file is hashed and, if compress is given,
+        decompressed in the same pass over the data. Verified hashes
+        are remembered (see pisi.hashcache), so checking whether the
+        file is changed doesn't read the previous one again. The peer
+        cache is used if peer is set; a file from there which doesn't
+        match its .sha1sum is fetched from the repository again."""
+        import pisi.peercache
 
         assert isinstance(uri, pisi.uri.URI)
 
@@ -114,31 +255,44 @@ class File:
         origfile = pisi.util.join_path(transfer_dir, uri.filename())
 
         if sha1sum:
-            sha1filename = File.download(pisi.uri.URI(uri.get_uri() + '.sha1sum'), transfer_dir)
+            sha1filename = File.download(pisi.uri.URI(uri.get_uri() + '.sha1sum'), transfer_dir,
+                                         peer=peer)
             sha1f = file(sha1filename)
             newsha1 = sha1f.read().split("\n")[0]
 
+        # hash of localfile, if known
+        localsha1 = None
+        sink = None
+
         if uri.is_remote_file() or copylocal:
             tmpfile = check_integrity and uri.filename() + ctx.const.temporary_suffix
             localfile = pisi.util.join_path(transfer_dir, tmpfile or uri.filename())
 
-            # TODO: code to use old .sha1sum file, is this a necessary optimization?
-            #oldsha1fn = localfile + '.sha1sum'
-            #if os.exists(oldsha1fn):
-                #oldsha1 = file(oldsha1fn).readlines()[0]
             if sha1sum and os.path.exists(origfile):
-                oldsha1 = pisi.util.sha1_file(origfile)
+                oldsha1 = pisi.hashcache.sha1_file(origfile)
                 if (newsha1 == oldsha1):
                     # early terminate, we already got it ;)
                     raise AlreadyHaveException(uri, origfile)
 
-            if uri.is_remote_file():
-                ctx.ui.info(_("Fetching %s") % uri.get_uri(), verbose=True)
-                pisi.fetcher.fetch_url(uri, transfer_dir, ctx.ui.Progress, tmpfile)
-            else:
-                # copy to transfer dir
-                ctx.ui.info(_("Copying %s to transfer dir") % uri.get_uri(), verbose=True)
-                shutil.copy(uri.get_uri(), localfile)
+            method, target = File.decompressed_name(origfile, compress)
+            if method is not None:
+                sink = Decompressor(method, target)
+
+            try:
+                if uri.is_remote_file():
+                    ctx.ui.info(_("Fetching %s") % uri.get_uri(), verbose=True)
+                    fetch = File.fetch(uri, transfer_dir, tmpfile, sink, peer)
+                    localsha1 = fetch.sha1sum
+                else:
+                    # copy to transfer dir
+                    ctx.ui.info(_("Copying %s to transfer dir") % uri.get_uri(), verbose=True)
+                    localsha1 = File.copy(uri.get_uri(), localfile, sink)
+                    if sink:
+                        sink.close()
+            except:
+                if sink:
+                    sink.abort()
+                raise
         else:
             localfile = uri.get_uri() #TODO: use a special function here?
             if not os.path.exists(localfile):
@@ -154,6 +308,8 @@ class File:
                 temp_files.append(sha1filename)
             if check_integrity:
                 temp_files.append(localfile)
+            if sink:
+                sink.abort()
             for filename in temp_files:
                 try:
                     os.unlink(filename)
@@ -161,15 +317,32 @@ class File:
                     pass
 
         if sha1sum:
-            if (pisi.util.sha1_file(localfile) != newsha1):
+            if (localsha1 or pisi.util.sha1_file(localfile)) != newsha1:
                 clean_temporary()
+                if peer and uri.is_remote_file() and pisi.peercache.peer_uri(uri):
+                    ctx.ui.warning(_("%s from the peer cache is not valid, "
+                                     "fetching it from the repository") % uri)
+                    return File.download(uri, transfer_dir, sha1sum, compress,
+                                         sign, copylocal, peer=False)
                 raise Error(_("File integrity of %s compromised.") % uri)
 
         if check_integrity:
             shutil.move(localfile, origfile)
             localfile = origfile
 
-        localfile = File.decompress(localfile, compress)
+        if sha1sum:
+            # the next update compares the new .sha1sum with this
+            pisi.hashcache.record(localfile, newsha1)
+        elif localsha1:
+            # checking the file against the repository hash later
+            # doesn't need to read it again
+            pisi.hashcache.record(localfile, localsha1)
+
+        if sink and sink.complete:
+            sink.commit()
+            localfile = sink.path
+        else:
+            localfile = File.decompress(localfile, compress)
 
         return localfile
 
@@ -19,8 +19,10 @@ __trans = gettext.translation('pisi', fallback=True)
 _ = __trans.ugettext
 
 class CycleException(pisi.Exception):
-    def __init__(self, cycle):
+    def __init__(self, cycle, components=None):
         self.cycle = cycle
+        # all strongly connected components containing a cycle, if known
+        self.components = components or [cycle]
 
     def __str__(self):
         return _('Encountered cycle %s') % self.cycle
@@ -103,25 +105,37 @@ class Digraph(object):
                 self.dfs_visit(u, finish_hook)
 
     def dfs_visit(self, u, finish_hook):
+        # Iterative version of the textbook recursive visit, deep
+        # dependency chains would exceed python's recursion limit.
+        # The stack holds the current path with the unexplored children
+        # of every vertex on it.
         self.color[u] = 'g'             # mark green (discovered)
         self.d[u] = self.time = self.time + 1
-        for v in self.adj(u):
-            if self.color[v] == 'w':    # explore unexplored vertices
-                self.p[v] = u
-                self.dfs_visit(v, finish_hook)
-            elif self.color[v] == 'g':  # cycle detected
-                cycle = [u]
-                while self.p[u]:
-                    u = self.p[u]
-                    cycle.append(u)
-                    if self.has_edge(cycle[0], u):
-                        break
-                cycle.reverse()
-                raise CycleException(cycle)
-        self.color[u] = 'b'             # mark black (completed)
-        if finish_hook:
-            finish_hook(u)
-        self.f[u] = self.time = self.time + 1
+        stack = [(u, iter(self.adj(u)))]
+        position = {u: 0}
+
+        while stack:
+            u, children = stack[-1]
+            for v in children:
+                if self.color[v] == 'w':    # explore unexplored vertices
+                    self.p[v] = u
+                    self.color[v] = 'g'
+                    self.d[v] = self.time = self.time + 1
+                    position[v] = len(stack)
+                    stack.append((v, iter(self.adj(v))))
+                    break
+                elif self.color[v] == 'g':  # cycle detected
+                    # v is on the current path, the cycle is the path
+                    # from v to u
+                    cycle = [x for x, c in stack[position[v]:]]
+                    raise CycleException(cycle)
+            else:
+                stack.pop()
+                del position[u]
+                self.color[u] = 'b'             # mark black (completed)
+                if finish_hook:
+                    finish_hook(u)
+                self.f[u] = self.time = self.time + 1
 
     def cycle_free(self):
         try:
@@ -136,6 +150,95 @@ class Digraph(object):
         list.reverse()
         return list
 
+    def strongly_connected_components(self):
+        """Return the strongly connected components of the graph as lists
+        of vertices (iterative Tarjan). A component comes after all the
+        components it has edges to."""
+        index = {}
+        lowlink = {}
+        stack = []
+        on_stack = set()
+        components = []
+        counter = 0
+
+        for root in self.__v:
+            if root in index:
+                continue
+
+            index[root] = lowlink[root] = counter
+            counter += 1
+            stack.append(root)
+            on_stack.add(root)
+            work = [(root, iter(self.__adj[root]))]
+
+            while work:
+                u, children = work[-1]
+                for v in children:
+                    if v not in index:
+                        index[v] = lowlink[v] = counter
+                        counter += 1
+                        stack.append(v)
+                        on_stack.add(v)
+                        work.append((v, iter(self.__adj[v])))
+                        break
+                    elif v in on_stack:
+                        lowlink[u] = min(lowlink[u], index[v])
+                else:
+                    work.pop()
+                    if work:
+                        parent = work[-1][0]
+                        lowlink[parent] = min(lowlink[parent], lowlink[u])
+
+                    if lowlink[u] == index[u]:
+                        component = []
+                        while True:
+                            w = stack.pop()
+                            on_stack.discard(w)
+                            component.append(w)
+                            if w == u:
+                                break
+                        components.append(component)
+
+        return components
+
+    def cycles(self):
+        """Return the strongly connected components which contain a
+        cycle."""
+        return [c for c in self.strongly_connected_components()
+                    if len(c) > 1 or self.has_edge(c[0], c[0])]
+
+    def topological_levels(self):
+        """Return (order, levels) where order is a topological order of the
+        vertices and levels is a list of vertex lists. Vertices in the same
+        level have no edges between them and all edges go from a level to
+        a later one, so a level can be processed in parallel once the
+        previous ones are done. Raises CycleException reporting every
+        cyclic component if the graph is not a DAG."""
+        indegree = dict.fromkeys(self.__v, 0)
+        for u in self.__v:
+            for v in self.__adj[u]:
+                indegree[v] += 1
+
+        order = []
+        levels = []
+        level = [u for u in self.__v if indegree[u] == 0]
+        while level:
+            levels.append(level)
+            order.extend(level)
+            next_level = []
+            for u in level:
+                for v in self.__adj[u]:
+                    indegree[v] -= 1
+                    if indegree[v] == 0:
+                        next_level.append(v)
+            level = next_level
+
+        if len(order) != len(self.__v):
+            components = self.cycles()
+            raise CycleException(components[0], components)
+
+        return order, levels
+
     def id_str(self, u):
         # Graph format only accepts underscores as key values
         # Sanitize the values. This is 2x faster than the old method.
@@ -0,0 +1,177 @@
+# -*- coding: utf-8 -*-
+#
+# Copyright (C) 2011, TUBITAK/UEKAE
+#
+# This program is free software; you can redistribute it and/or modify it under
+# the terms of the GNU General Public License as published by the Free
+# Software Foundation; either version 2 of the License, or (at your option)
+# any later version.
+#
+# Please read the COPYING file.
+#
+
+"""Verified hash memo for files in cache directories.
+
+Hashing a multi-GB source archive or package is expensive, and the same
+file is usually checked several times (is_cached, unpack, install). A
+HashCache remembers the SHA1 of every file it has verified in a small
+manifest stored in the directory itself, together with the (size, mtime,
+inode) signature of the file. As long as the signature is unchanged the
+remembered hash is used and the file is not read again."""
+
+import os
+
+import gettext
+__trans = gettext.translation('pisi', fallback=True)
+_ = __trans.ugettext
+
+import pisi
+import pisi.context as ctx
+import pisi.util as util
+
+
+def stat_signature(path):
+    """Return (size, mtime, inode) of path or None if it can't be stat'ed."""
+    try:
+        st = os.stat(path)
+    except OSError:
+        return None
+    return (st.st_size, repr(st.st_mtime), st.st_ino)
+
+
+class HashCache:
+    """SHA1 memo of the files found in a single directory."""
+
+    _instances = {}
+
+    def __init__(self, directory):
+        self.directory = os.path.realpath(directory)
+        self.manifest = util.join_path(directory, ctx.const.hash_cache_file)
+        self.entries = {}
+        self.manifest_signature = None
+        self._load()
+
+    @classmethod
+    def get(cls, directory):
+        """Return the shared HashCache for the given directory."""
+        directory = os.path.realpath(directory)
+        cache = cls._instances.get(directory)
+        if cache is None:
+            cache = cls._instances[directory] = cls(directory)
+        else:
+            cache._reload_if_changed()
+        return cache
+
+    def _load(self):
+        self.entries = {}
+        self.manifest_signature = stat_signature(self.manifest)
+        if self.manifest_signature is None:
+            return
+
+        try:
+            for line in open(self.manifest):
+                fields = line.rstrip("\n").split("\t")
+                if len(fields) != 5:
+                    continue
+                name, sha1sum, size, mtime, inode = fields
+                try:
+                    self.entries[name] = (sha1sum, (long(size), mtime, long(inode)))
+                except ValueError:
+                    continue
+        except IOError:
+            self.entries = {}
+
+    def _reload_if_changed(self):
+        # another pisi process (or a build on a shared cache) may have
+        # updated the manifest meanwhile
+        if stat_signature(self.manifest) != self.manifest_signature:
+            self._load()
+
+    def _save(self):
+        if not os.access(self.directory, os.W_OK):
+            return
+
+        tmp = "%s.%d%s" % (self.manifest, os.getpid(), ctx.const.temporary_suffix)
+        try:
+            f = open(tmp, "w")
+            for name, (sha1sum, (size, mtime, inode)) in sorted(self.entries.items()):
+                f.write("%s\t%s\t%d\t%s\t%d\n" % (name, sha1sum, size, mtime, inode))
+            f.close()
+            os.rename(tmp, self.manifest)
+        except (IOError, OSError), e:
+            ctx.ui.debug(_("Could not write hash cache %s: %s") % (self.manifest, e))
+            if os.path.exists(tmp):
+                os.unlink(tmp)
+            return
+
+        self.manifest_signature = stat_signature(self.manifest)
+
+    def _name(self, path):
+        if os.path.realpath(os.path.dirname(path)) != self.directory:
+            return None
+        return os.path.basename(path)
+
+    def lookup(self, path):
+        """Return the remembered hash of path if its signature is unchanged."""
+        name = self._name(path)
+        if name is None or not self.entries.has_key(name):
+            return None
+
+        sha1sum, signature = self.entries[name]
+        if stat_signature(path) != signature:
+            return None
+
+        return sha1sum
+
+    def record(self, path, sha1sum):
+        """Remember sha1sum as the verified hash of path."""
+        name = self._name(path)
+        signature = stat_signature(path)
+        if name is None or signature is None:
+            return
+
+        self._reload_if_changed()
+        if self.entries.get(name) == (sha1sum, signature):
+            return
+
+        self.entries[name] = (sha1sum, signature)
+        self._save()
+
+    def forget(self, path):
+        name = self._name(path)
+        if name is None or not self.entries.has_key(name):
+            return
+
+        self._reload_if_changed()
+        self.entries.pop(name, None)
+        self._save()
+
+    def sha1_file(self, path):
+        """Return SHA1 of path, hashing it only when the memo is stale."""
+        sha1sum = self.lookup(path)
+        if sha1sum is None:
+            sha1sum = util.sha1_file(path)
+            self.record(path, sha1sum)
+        return sha1sum
+
+    def check_file_hash(self, path, sha1sum):
+        """Check the file's integrity with a given hash."""
+        return self.sha1_file(path) == sha1sum
+
+
+def sha1_file(path):
+    """Calculate the SHA1 of path using the memo of its directory."""
+    return HashCache.get(os.path.dirname(os.path.abspath(path))).sha1_file(path)
+
+def check_file_hash(path, sha1sum):
+    """Check the file's integrity with a given hash using the memo of its
+    directory."""
+    return sha1_file(path) == sha1sum
+
+def record(path, sha1sum):
+    """Remember sha1sum as the verified hash of path."""
+    HashCache.get(os.path.dirname(os.path.abspath(path))).record(path, sha1sum)
+
+def forget(path):
+    """Drop the remembered hash of path, e.g. when it is removed."""
+    HashCache.get(os.path.dirname(os.path.abspath(path))).forget(path)
@@ -19,6 +19,7 @@ _ = __trans.ugettext
 import pisi.pxml.autoxml as autoxml
 import pisi.pxml.xmlfile as xmlfile
 import pisi.context as ctx
+import pisi.historyindex
 
 __metaclass__ = autoxml.autoxml
 
@@ -83,6 +84,8 @@ class Operation:
     a_type = [autoxml.String, autoxml.mandatory]
     a_date = [autoxml.String, autoxml.mandatory]
     a_time = [autoxml.String, autoxml.mandatory]
+    # previous snapshot of an incremental snapshot
+    a_base = [autoxml.String, autoxml.optional]
 
     t_Packages = [ [Package], autoxml.optional, "Package"]
     t_Repos = [ [Repo], autoxml.optional, "Repository"]
@@ -145,6 +148,8 @@ class History(xmlfile.XmlFile):
 
     def update(self):
         self.write(os.path.join("%s/%s", ctx.config.history_dir(), self.histfile))
+        index = pisi.historyindex.HistoryIndex.get(ctx.config.history_dir())
+        index.update(self, self.histfile)
 
     def _get_latest(self):
 
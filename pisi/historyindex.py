@@ -0,0 +1,226 @@
+# -*- coding: utf-8 -*-
+#
+# Copyright (C) 2011, TUBITAK/UEKAE
+#
+# This program is free software; you can redistribute it and/or modify it under
+# the terms of the GNU General Public License as published by the Free
+# Software Foundation; either version 2 of the License, or (at your option)
+# any later version.
+#
+# Please read the COPYING file.
+#
+
+"""Append-only index of the operation history.
+
+Every history operation is stored in its own XML file. Reading the
+history (pisi history, takeback planning, list-newest) used to parse all
+of them. The index keeps a compact line based record of each operation,
+of the packages it touched and of the repositories it updated, so these
+queries are answered without parsing any XML. Records are appended by
+History.update; operations missing from the index (e.g. written by an
+older pisi) are indexed from their XML files once."""
+
+import os
+
+import gettext
+__trans = gettext.translation('pisi', fallback=True)
+_ = __trans.ugettext
+
+import pisi.context as ctx
+import pisi.util as util
+import pisi.history
+
+# record types
+OPERATION = "O"
+PACKAGE = "P"
+REPO = "R"
+
+def encode(value):
+    if value is None:
+        return ""
+    if isinstance(value, unicode):
+        value = value.encode("utf-8")
+    return str(value)
+
+def decode(value):
+    if not value:
+        return None
+    return value.decode("utf-8")
+
+def log_number(log):
+    return int(log.split("_")[0])
+
+
+class HistoryIndex:
+    """Index of the history operations found in a history directory."""
+
+    _instances = {}
+
+    def __init__(self, directory):
+        self.directory = directory
+        self.path = util.join_path(directory, ctx.const.history_index_file)
+        # no -> (type, date, time, log file name, base snapshot)
+        self.operations = {}
+        # no -> list of (operation, type, name, before, after) where
+        # before and after are (version, release) tuples or None
+        self.packages = {}
+        # no -> list of (operation, name, uri)
+        self.repos = {}
+        self._load()
+
+    @classmethod
+    def get(cls, directory):
+        """Return the shared HistoryIndex for the given directory."""
+        directory = os.path.realpath(directory)
+        index = cls._instances.get(directory)
+        if index is None:
+            index = cls._instances[directory] = cls(directory)
+        return index
+
+    def _load(self):
+        if not os.path.exists(self.path):
+            return
+
+        try:
+            for line in open(self.path):
+                fields = line.rstrip("\n").split("\t")
+                try:
+                    self._add_record(fields)
+                except (ValueError, IndexError):
+                    # skip a partially written record
+                    continue
+        except IOError:
+            pass
+
+    def _add_record(self, fields):
+        kind, no = fields[0], int(fields[1])
+        if kind == OPERATION:
+            otype, date, otime, log = fields[2:6]
+            base = None
+            if len(fields) > 6 and fields[6]:
+                base = int(fields[6])
+            self.operations[no] = (otype, date, otime, log, base)
+        elif kind == PACKAGE:
+            operation, ptype, name = fields[2:5]
+            before = after = None
+            if fields[5]:
+                before = (decode(fields[5]), decode(fields[6]))
+            if fields[7]:
+                after = (decode(fields[7]), decode(fields[8]))
+            self.packages.setdefault(no, []).append((operation, decode(ptype),
+                                                     decode(name), before, after))
+        elif kind == REPO:
+            operation, name, uri = fields[2:5]
+            self.repos.setdefault(no, []).append((decode(operation),
+                                                  decode(name), decode(uri)))
+
+    def _append(self, records):
+        for fields in records:
+            self._add_record(fields)
+
+        if not os.access(self.directory, os.W_OK):
+            return
+
+        lines = ["%s\n" % "\t".join(map(encode, fields)) for fields in records]
+        try:
+            f = open(self.path, "a")
+            f.write("".join(lines))
+            f.close()
+        except IOError, e:
+            ctx.ui.debug(_("Could not write history index %s: %s") % (self.path, e))
+
+    def update(self, history, log):
+        """Append the records of history which are not indexed yet."""
+        operation = history.operation
+        no = int(operation.no)
+
+        records = []
+        if not self.operations.has_key(no):
+            records.append((OPERATION, no, operation.type, operation.date,
+                            operation.time, log, operation.base))
+
+        for package in operation.packages[len(self.packages.get(no, [])):]:
+            fields = [PACKAGE, no, package.operation, package.type, package.name]
+            for info in (package.before, package.after):
+                if info:
+                    fields.extend([info.version, info.release])
+                else:
+                    fields.extend([None, None])
+            records.append(fields)
+
+        for repo in operation.repos[len(self.repos.get(no, [])):]:
+            records.append((REPO, no, repo.operation, repo.name, repo.uri))
+
+        if records:
+            self._append(records)
+
+    def sync(self, logs):
+        """Index the operations of the given log files which are missing
+        from the index and forget the ones without a log file."""
+        numbers = set()
+        for log in logs:
+            no = log_number(log)
+            numbers.add(no)
+            if self.operations.has_key(no):
+                continue
+
+            history = pisi.history.History(util.join_path(self.directory, log))
+            history.operation.no = no
+            self.update(history, log)
+
+        for no in set(self.operations) - numbers:
+            del self.operations[no]
+            self.packages.pop(no, None)
+            self.repos.pop(no, None)
+
+    def list_operations(self):
+        """Return operation numbers, the latest first."""
+        return sorted(self.operations, reverse=True)
+
+    def has_operation(self, no):
+        return self.operations.has_key(no)
+
+    def get_type(self, no):
+        return self.operations[no][0]
+
+    def get_date(self, no):
+        return self.operations[no][1]
+
+    def get_base(self, no):
+        return self.operations[no][4]
+
+    def get_operation(self, no):
+        """Return the pisi.history.Operation object of the operation no."""
+        if not self.operations.has_key(no):
+            return None
+
+        otype, date, otime, log, base = self.operations[no]
+        operation = pisi.history.Operation()
+        operation.type = otype
+        operation.date = date
+        operation.time = otime
+        operation.no = no
+        if base is not None:
+            operation.base = str(base)
+
+        for optype, ptype, name, before, after in self.packages.get(no, []):
+            package = pisi.history.Package()
+            package.operation = optype
+            package.type = ptype
+            package.name = name
+            package.before = package.after = None
+            for attr, info in (("before", before), ("after", after)):
+                if info:
+                    pkginfo = pisi.history.PackageInfo()
+                    pkginfo.version, pkginfo.release = info
+                    setattr(package, attr, pkginfo)
+            operation.packages.append(package)
+
+        for roperation, name, uri in self.repos.get(no, []):
+            repo = pisi.history.Repo()
+            repo.operation = roperation
+            repo.name = name
+            repo.uri = uri
+            operation.repos.append(repo)
+
+        return operation
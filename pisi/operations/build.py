@@ -18,7 +18,7 @@ import glob
 import stat
 import pwd
 import grp
-import fnmatch
+import multiprocessing
 
 import gettext
 __trans = gettext.translation('pisi', fallback=True)
@@ -41,6 +41,8 @@ import pisi.component as component
 import pisi.archive as archive
 import pisi.actionsapi.variables
 import pisi.db
+import pisi.pathmatcher
+import pisi.operations.buildcache
 
 
 class Error(pisi.Error):
@@ -57,62 +59,65 @@ class ExcludedArchitectureException(Error):
 
 
 # Helper Functions
-def get_file_type(path, pinfo_list):
+def get_file_type(path, pinfo_list, matcher=None):
     """Return the file type of a path according to the given PathInfo
-    list"""
+    list. A PathMatcher compiled from the list can be given to avoid
+    compiling it on every call."""
 
     path = "/%s" % re.sub("/+", "/", path)
-    info = None
-    glob_match = parent_match = None
 
-    for pinfo in pinfo_list:
-        if path == pinfo.path:
-            info = pinfo
-            break
+    if matcher is None:
+        matcher = pisi.pathmatcher.PathMatcher([p.path for p in pinfo_list])
 
-        elif fnmatch.fnmatch(path, pinfo.path):
-            glob_match = pinfo
-
-        elif fnmatch.fnmatch(path, util.join_path(pinfo.path, "*")):
-            if parent_match is None or parent_match.path < pinfo.path:
-                parent_match = pinfo
-
-    else:
-        info = glob_match or parent_match
+    info = pinfo_list[matcher.match(path)]
 
     return info.fileType, info.permanent
 
-def check_path_collision(package, pkgList):
-    """This function will check for collision of paths in a package with
-    the paths of packages in pkgList. The return value will be the
-    list containing the paths that collide."""
+def index_package_paths(pkgList):
+    """Return a dict mapping every path prefix (as a tuple of path
+    components) of the paths in pkgList to the (package, path) tuples
+    below it, for check_path_collision."""
     create_static = ctx.get_option("create_static")
     create_debug = ctx.config.values.build.generatedebug
     ar_suffix = ctx.const.ar_file_suffix
     debug_suffix = ctx.const.debug_file_suffix
 
+    index = {}
+    for pkg in pkgList:
+        for path in pkg.files:
+            if (create_static and path.path.endswith(ar_suffix)) or \
+                    (create_debug and path.path.endswith(debug_suffix)):
+                # don't throw collision error for these files.
+                # we'll handle this in gen_files_xml..
+                continue
+
+            comps = tuple(util.splitpath(path.path))
+            for i in range(len(comps) + 1):
+                index.setdefault(comps[:i], []).append((pkg, path))
+
+    return index
+
+def check_path_collision(package, pkgList, index=None):
+    """This function will check for collision of paths in a package with
+    the paths of packages in pkgList. The return value will be the
+    list containing the paths that collide."""
+    if index is None:
+        index = index_package_paths(pkgList)
+
     collisions = []
     for pinfo in package.files:
-        for pkg in pkgList:
+        # if pinfo.path is a subpath of path.path like
+        # the example below. path.path is marked as a
+        # collide. Exp:
+        # pinfo.path: /usr/share
+        # path.path: /usr/share/doc
+        for pkg, path in index.get(tuple(util.splitpath(pinfo.path)), ()):
             if pkg is package:
                 continue
-            for path in pkg.files:
-                # if pinfo.path is a subpath of path.path like
-                # the example below. path.path is marked as a
-                # collide. Exp:
-                # pinfo.path: /usr/share
-                # path.path: /usr/share/doc
-
-                if (create_static and path.path.endswith(ar_suffix)) or \
-                        (create_debug and path.path.endswith(debug_suffix)):
-                    # don't throw collision error for these files.
-                    # we'll handle this in gen_files_xml..
-                    continue
 
-                if util.subpath(pinfo.path, path.path):
-                    collisions.append(path.path.rstrip("/"))
-                    ctx.ui.debug(_('Path %s belongs in multiple packages') %
-                                 path.path)
+            collisions.append(path.path.rstrip("/"))
+            ctx.ui.debug(_('Path %s belongs in multiple packages') %
+                         path.path)
     return collisions
 
 def exclude_special_files(filepath, fileinfo, ag):
@@ -166,10 +171,49 @@ def strip_debug_action(filepath, fileinfo, install_dir, ag):
     if util.strip_file(filepath, fileinfo, outputpath):
         ctx.ui.debug("%s [%s]" % (path, "stripped"))
 
+# libmagic handle of a file_actions worker process
+magic_handle = None
+
+def init_file_action_worker():
+    global magic_handle
+    import magic
+    magic_handle = magic.open(magic.MAGIC_NONE)
+    magic_handle.load()
+
+def classify_file(filepath):
+    """Return (filepath, libmagic description) using the handle of the
+    current worker process."""
+    try:
+        return filepath, magic_handle.file(filepath)
+    except KeyboardInterrupt:
+        # Multiprocessing hack, see pisi.index.add_package for explanation
+        raise Exception
+
+def strip_file_job(params):
+    try:
+        filepath, fileinfo, install_dir, ag = params
+        strip_debug_action(filepath, fileinfo, install_dir, ag)
+    except KeyboardInterrupt:
+        raise Exception
+
+# below this many files, file actions are not worth a process pool
+pool_file_actions = 32
+
+def file_action_jobs():
+    """Return the number of worker processes used for file actions."""
+    jobs = re.search("-j\s*(\d+)", ctx.config.values.build.jobs or "")
+    if jobs and int(jobs.group(1)) > 0:
+        return int(jobs.group(1))
+
+    return multiprocessing.cpu_count()
+
 class Builder:
     """Provides the package build and creation routines"""
     #FIXME: this class and every other class must use URLs as paths!
 
+    # unsatisfied build dependencies fail the build unless set
+    install_build_deps = True
+
     @staticmethod
     def from_name(name):
         repodb = pisi.db.repodb.RepoDB()
@@ -245,6 +289,9 @@ class Builder:
 
         self.delta_map = {}
 
+        # path prefix index of the packages for check_path_collision
+        self.path_index = None
+
         self.has_ccache = False
         self.has_icecream = False
 
@@ -257,6 +304,14 @@ class Builder:
         spec.read(self.specuri, ctx.config.tmp_dir())
         self.spec = spec
 
+        # hash the text just parsed for the build cache; the downloaded
+        # copy of a remote spec is overwritten by the next one
+        if self.specuri.is_remote_file():
+            path = util.join_path(ctx.config.tmp_dir(), self.specuri.filename())
+        else:
+            path = self.specuri.get_uri()
+        self.spec_sha1sum = util.sha1_file(path)
+
     def read_translations(self, specdir):
         self.spec.read_translations(util.join_path(specdir,
                                     ctx.const.translations_file))
@@ -334,6 +389,17 @@ class Builder:
 
         self.check_build_dependencies()
         self.fetch_component()
+
+        build_cache = None
+        if pisi.operations.buildcache.cache_dir():
+            build_cache = pisi.operations.buildcache.BuildCache(
+                                pisi.operations.buildcache.cache_dir())
+            build_key = build_cache.key(self)
+            if build_cache.restore(build_key, self):
+                ctx.ui.info(_("Build results of %s found in build cache.")
+                            % self.spec.source.name)
+                return
+
         self.fetch_source_archives()
 
         for build_type in self.build_types:
@@ -355,6 +421,9 @@ class Builder:
         # after all, we are ready to build/prepare the packages
         self.build_packages()
 
+        if build_cache:
+            build_cache.store(build_key, self)
+
     def get_build_types(self):
         ignored_build_types = \
                 ctx.config.values.build.ignored_build_types.split(",")
@@ -574,39 +643,29 @@ class Builder:
                 path = util.join_path(install_dir, path.path)
                 all_paths_in_packages.append(path)
 
-        def is_included(path1, path2):
-            "Return True if path2 includes path1"
-            return path1 == path2 \
-                    or fnmatch.fnmatch(path1, path2) \
-                    or (not os.path.isfile(path2) and fnmatch.fnmatch(path1, util.join_path(path2, "*")))
+        # A path includes another one if they are equal, if it matches
+        # it as a glob or if it is a directory above it. Paths which are
+        # regular files can only include themselves.
+        matcher = pisi.pathmatcher.PathMatcher(
+                    all_paths_in_packages,
+                    directory_rule=lambda x: not os.path.isfile(x))
+        paths_in_packages = set(all_paths_in_packages)
 
         for root, dirs, files in os.walk(install_dir):
             if not dirs and not files:
-                for _path in all_paths_in_packages:
-                    if is_included(root, _path):
-                        break
-                else:
+                if not matcher.matches(root):
                     abandoned_files.append(root)
 
-            if root in all_paths_in_packages: 
+            if root in paths_in_packages:
                 skip_paths.append(root)
                 continue
 
-            skip = False 
-            for skip_path in skip_paths:
-                if root.startswith(skip_path):
-                    skip = True
-                    break
-            if skip: continue
+            if root.startswith(tuple(skip_paths)):
+                continue
 
             for file_ in files:
                 fpath = util.join_path(root, file_)
-                for _path in all_paths_in_packages:
-                    if is_included(fpath, _path):
-                        if os.path.isfile(_path):
-                            all_paths_in_packages.pop(all_paths_in_packages.index(_path))
-                        break
-                else:
+                if not matcher.matches(fpath):
                     abandoned_files.append(fpath)
 
         len_install_dir = len(install_dir)
@@ -833,7 +892,7 @@ class Builder:
                 for dep in dep_unsatis:
                     if not dep.satisfied_by_repo():
                         raise Error(_('Build dependency %s cannot be satisfied') % str(dep))
-                if ctx.ui.confirm(
+                if self.install_build_deps and ctx.ui.confirm(
                 _('Do you want to install the unsatisfied build dependencies')):
                     ctx.ui.info(_('Installing build dependencies.'))
                     if not pisi.api.install([dep.package for dep in dep_unsatis], reinstall=True):
@@ -960,13 +1019,18 @@ class Builder:
 
         # we'll exclude collisions in get_file_hashes. Having a
         # collisions list is not wrong, we must just handle it :).
-        collisions = check_path_collision(package, self.spec.packages)
+        if self.path_index is None:
+            self.path_index = index_package_paths(self.spec.packages)
+        collisions = check_path_collision(package, self.spec.packages,
+                                          self.path_index)
         # FIXME: material collisions after expanding globs could be
         # reported as errors
 
         # Use a dict to avoid duplicate entries in files.xml.
         d = {}
 
+        matcher = pisi.pathmatcher.PathMatcher([p.path for p in package.files])
+
         def add_path(path):
             # add the files under material path
             for fpath, fhash in util.get_file_hashes(path, collisions, install_dir):
@@ -978,7 +1042,7 @@ class Builder:
                     # don't include this file into the package.
                     continue
                 frpath = util.removepathprefix(install_dir, fpath)  # relative path
-                ftype, permanent = get_file_type(frpath, package.files)
+                ftype, permanent = get_file_type(frpath, package.files, matcher)
                 fsize = long(util.dir_size(fpath))
                 if not os.path.islink(fpath):
                     st = os.stat(fpath)
@@ -1008,18 +1072,47 @@ class Builder:
     def file_actions(self):
         install_dir = self.pkg_install_dir()
 
-        import magic
-        ms = magic.open(magic.MAGIC_NONE)
-        ms.load()
-
+        filepaths = []
         for root, dirs, files in os.walk(install_dir):
             for fn in files:
-                filepath = util.join_path(root, fn)
-                fileinfo = ms.file(filepath)
-                strip_debug_action(filepath, fileinfo, install_dir, self.actionGlobals)
-                exclude_special_files(filepath, fileinfo, self.actionGlobals)
+                filepaths.append(util.join_path(root, fn))
 
-        ms.close()
+        if not filepaths:
+            return
+
+        # actionGlobals contains modules and functions which can't
+        # be pickled, strip only needs the NoStrip list
+        ag = {"NoStrip": self.actionGlobals.get("NoStrip", [])}
+
+        jobs = file_action_jobs()
+        if jobs == 1 or len(filepaths) < pool_file_actions:
+            init_file_action_worker()
+            fileinfos = [(filepath, magic_handle.file(filepath))
+                         for filepath in filepaths]
+            for filepath, fileinfo in fileinfos:
+                strip_debug_action(filepath, fileinfo, install_dir, ag)
+        else:
+            # Classify the files and strip the binaries using a process
+            # pool. Every worker has its own libmagic handle. Files are
+            # classified before any of them is modified, so the result is
+            # the same as handling them one by one.
+            pool = multiprocessing.Pool(jobs, init_file_action_worker)
+            try:
+                fileinfos = pool.map(classify_file, filepaths)
+                pool.map(strip_file_job,
+                         [(filepath, fileinfo, install_dir, ag)
+                            for filepath, fileinfo in fileinfos])
+            except:
+                pool.terminate()
+                pool.join()
+                raise
+
+            pool.close()
+            pool.join()
+
+        # Removing special files touches directories, do it in order
+        for filepath, fileinfo in fileinfos:
+            exclude_special_files(filepath, fileinfo, self.actionGlobals)
 
     def build_packages(self):
         """Build each package defined in PSPEC file. After this process there
@@ -1090,6 +1183,8 @@ class Builder:
 
             raise AbandonedFilesException
 
+        self.path_index = index_package_paths(self.spec.packages)
+
         for package in self.spec.packages:
             # removing "farce" in specfile.py:SpecFile.override_tags
             # this block of code came here... SpecFile should never
@@ -1212,7 +1307,9 @@ class Builder:
         elif max_count > 0:
             self.delta_history_search_paths.append((search_paths, max_count))
 
-    def build_delta_packages(self, package):
+    def find_old_packages(self, package_info):
+        """Return the old packages of package_info found in the delta
+        search paths."""
 
         def find_old_package(filename, search_paths):
             for package_dir in search_paths:
@@ -1240,7 +1337,7 @@ class Builder:
             else:
                 continue
 
-            filename = self.package_filename(package.metadata.package, update)
+            filename = self.package_filename(package_info, update)
             old_package = find_old_package(filename, search_paths)
             if old_package:
                 old_packages[old_release] = old_package
@@ -1254,8 +1351,7 @@ class Builder:
                 if update.release in old_packages:
                     continue
 
-                filename = self.package_filename(package.metadata.package,
-                                                 update)
+                filename = self.package_filename(package_info, update)
                 old_package = find_old_package(filename, search_paths)
                 if old_package:
                     found_old_packages[update.release] = old_package
@@ -1265,10 +1361,32 @@ class Builder:
 
             old_packages.update(found_old_packages)
 
+        return old_packages.values()
+
+    def build_delta_packages(self, package):
         from pisi.operations.delta import create_delta_packages_from_obj
-        return create_delta_packages_from_obj(old_packages.values(),
-                                              package,
-                                              self.specdir)
+        return create_delta_packages_from_obj(
+                    self.find_old_packages(package.metadata.package),
+                    package,
+                    self.specdir)
+
+    def rebuild_delta_packages(self, filename):
+        """Build the delta packages of the package file filename, which
+        is restored from the build cache."""
+        pkg = pisi.package.Package(filename)
+        package_info = pkg.metadata.package
+        pkg.close()
+
+        for package in self.spec.packages:
+            if package.name == package_info.name and "noDelta" in package.buildFlags:
+                return []
+
+        old_packages = self.find_old_packages(package_info)
+        if not old_packages:
+            return []
+
+        from pisi.operations.delta import create_delta_packages
+        return create_delta_packages(old_packages, filename)
 
 
 # build functions...
@@ -0,0 +1,195 @@
+# -*- coding: utf-8 -*-
+#
+# Copyright (C) 2011, TUBITAK/UEKAE
+#
+# This program is free software; you can redistribute it and/or modify it under
+# the terms of the GNU General Public License as published by the Free
+# Software Foundation; either version 2 of the License, or (at your option)
+# any later version.
+#
+# Please read the COPYING file.
+#
+
+"""Content addressed cache of build results.
+
+A build is identified by the hash of everything that can change its
+output: pspec.xml, actions.py, translations, patches, additional and
+COMAR files, the installed versions of the build dependencies and the
+build related configuration. The packages produced by a build are stored
+under that key, so an identical rebuild returns them without running the
+actions at all. The cache directory may be shared between machines (NFS
+and the like); entries are published with an atomic rename.
+
+Delta packages are not cached, they depend on the old packages found in
+the delta search paths. They are built again from the restored
+packages."""
+
+import os
+import shutil
+import hashlib
+
+import gettext
+__trans = gettext.translation('pisi', fallback=True)
+_ = __trans.ugettext
+
+import pisi
+import pisi.context as ctx
+import pisi.util as util
+
+# build related pisi.conf values which affect the produced packages
+config_keys = {"general": ("distribution", "distribution_release",
+                           "distribution_id", "architecture"),
+               "build": ("host", "cflags", "cxxflags", "ldflags",
+                         "generatedebug", "compressionlevel",
+                         "ignored_build_types")}
+
+# command line options which affect the produced packages
+option_keys = ("create_static", "package_format")
+
+# file listing the packages of an entry
+manifest_file = "packages"
+
+
+def cache_dir():
+    """Return the build cache directory or None if it is disabled."""
+    if ctx.get_option("ignore_build_cache"):
+        return None
+    return ctx.config.values.build.build_cache or None
+
+
+class BuildCache:
+    def __init__(self, directory):
+        self.directory = directory
+
+    def key(self, builder):
+        """Calculate the cache key of the build done by builder. Build
+        dependencies must be installed before calling this."""
+        sha1 = hashlib.sha1()
+
+        def add(*items):
+            for item in items:
+                if isinstance(item, unicode):
+                    item = item.encode("utf-8")
+                sha1.update("%s\0" % item)
+
+        def add_file(path):
+            path = util.join_path(builder.specdir, path)
+            if os.path.exists(path):
+                add(path[len(builder.specdir):], util.sha1_file(path))
+            else:
+                add(path[len(builder.specdir):], None)
+
+        add("pisi", pisi.__version__)
+
+        # spec files
+        add(ctx.const.pspec_file, builder.spec_sha1sum)
+        add_file(ctx.const.actions_file)
+        add_file(ctx.const.translations_file)
+
+        spec = builder.spec
+        for patch in spec.source.patches:
+            add_file(util.join_path(ctx.const.files_dir, patch.filename))
+
+        for afile in spec.source.additionalFiles:
+            add_file(util.join_path(ctx.const.files_dir, afile.filename))
+
+        build_deps = set([dep.package for dep in spec.source.buildDependencies])
+        for package in spec.packages:
+            for afile in package.additionalFiles:
+                add_file(util.join_path(ctx.const.files_dir, afile.filename))
+            for pcomar in package.providesComar:
+                add_file(util.join_path(ctx.const.comar_dir, pcomar.script))
+            build_deps.update([dep.package for dep in package.buildDependencies])
+
+        # installed versions of the build dependencies
+        for name in sorted(build_deps):
+            if builder.installdb.has_package(name):
+                add(name, "%s-%s" % builder.installdb.get_version(name)[:2])
+            else:
+                add(name, None)
+
+        for section, keys in sorted(config_keys.items()):
+            values = getattr(ctx.config.values, section)
+            for key in keys:
+                add(section, key, values[key])
+
+        for option in option_keys:
+            add(option, ctx.get_option(option))
+
+        return sha1.hexdigest()
+
+    def entry_dir(self, key):
+        return util.join_path(self.directory, key[:2], key)
+
+    def restore(self, key, builder):
+        """Copy the packages of the entry to the output directory, build
+        their delta packages and fill the package lists of builder.
+        Return False on a miss."""
+        entry = self.entry_dir(key)
+        try:
+            lines = open(util.join_path(entry, manifest_file)).readlines()
+        except IOError:
+            return False
+
+        outdir = ctx.get_option("output_dir")
+        files = []
+        for line in lines:
+            kind, filename, sha1sum = line.split()
+            src = util.join_path(entry, filename)
+            if not util.check_file_hash(src, sha1sum):
+                ctx.ui.warning(_("Build cache entry %s is corrupted, ignoring it.") % key)
+                return False
+
+            dest = util.join_path(outdir, filename) if outdir else filename
+            files.append((kind, src, os.path.normpath(dest)))
+
+        builder.new_packages = []
+        builder.new_debug_packages = []
+        builder.delta_map = {}
+        for kind, src, dest in files:
+            ctx.ui.info(_("Restoring %s from build cache...") % dest)
+            if os.path.exists(dest):
+                os.unlink(dest)
+            try:
+                # entries are never modified, sharing them is safe
+                os.link(src, dest)
+            except OSError:
+                util.copy_file(src, dest)
+            if kind == "package":
+                builder.new_packages.append(dest)
+            else:
+                builder.new_debug_packages.append(dest)
+            builder.delta_map[dest] = builder.rebuild_delta_packages(dest)
+
+        return True
+
+    def store(self, key, builder):
+        """Store the packages produced by builder under key."""
+        entry = self.entry_dir(key)
+        if os.path.exists(entry):
+            return
+
+        # publish the entry in one step, other builders may be working
+        # on the same directory
+        tmp = "%s.%s.%d%s" % (entry, os.uname()[1], os.getpid(),
+                              ctx.const.temporary_suffix)
+        try:
+            util.ensure_dirs(tmp)
+            manifest = []
+
+            def add(kind, path):
+                filename = os.path.basename(path)
+                shutil.copy2(path, util.join_path(tmp, filename))
+                manifest.append("%s %s %s\n" % (kind, filename,
+                                                util.sha1_file(path)))
+
+            for package in builder.new_packages:
+                add("package", package)
+            for package in builder.new_debug_packages:
+                add("debug", package)
+
+            open(util.join_path(tmp, manifest_file), "w").writelines(manifest)
+            os.rename(tmp, entry)
+        except (IOError, OSError), e:
+            ctx.ui.warning(_("Could not store build results in build cache: %s") % e)
+            util.clean_dir(tmp)
@@ -0,0 +1,199 @@
+# -*- coding: utf-8 -*-
+#
+# Copyright (C) 2011, TUBITAK/UEKAE
+#
+# This program is free software; you can redistribute it and/or modify it under
+# the terms of the GNU General Public License as published by the Free
+# Software Foundation; either version 2 of the License, or (at your option)
+# any later version.
+#
+# Please read the COPYING file.
+#
+
+import os
+import threading
+import functools
+
+import gettext
+__trans = gettext.translation('pisi', fallback=True)
+_ = __trans.ugettext
+
+import pisi
+import pisi.context as ctx
+import pisi.util as util
+import pisi.ui as ui
+import pisi.metadata
+import pisi.pgraph as pgraph
+import pisi.profiler
+import pisi.db.componentdb
+
+
+class MetadataStore:
+    """Parsed metadata.xml files of installed packages.
+
+    Every metadata.xml is read once and shared by the dependency graph
+    and the configuration of the package. get_package returns the
+    package info like the package databases do, so the store can back a
+    PGraph."""
+
+    def __init__(self, installdb, packages=()):
+        self.installdb = installdb
+        self.metadata = {}
+        for name in packages:
+            self.get_metadata(name)
+
+    def get_metadata(self, name):
+        if not self.metadata.has_key(name):
+            metadata = pisi.metadata.MetaData()
+            metadata.read(os.path.join(self.installdb.package_path(name),
+                                       ctx.const.metadata_xml))
+            self.metadata[name] = metadata
+        return self.metadata[name]
+
+    def get_package(self, name):
+        return self.get_metadata(name).package
+
+
+class SerializedUI(object):
+    """Passes the calls of the configure threads to ui one at a time,
+    user interfaces are not thread safe."""
+
+    def __init__(self, ui):
+        self.__dict__["ui"] = ui
+        self.__dict__["lock"] = threading.RLock()
+
+    def __getattr__(self, name):
+        attr = getattr(self.ui, name)
+        if not callable(attr):
+            return attr
+
+        def call(*args, **kwargs):
+            self.lock.acquire()
+            try:
+                return attr(*args, **kwargs)
+            finally:
+                self.lock.release()
+        return call
+
+    def __setattr__(self, name, value):
+        setattr(self.ui, name, value)
+
+
+def configure_jobs():
+    """Return the number of packages which may be configured at once."""
+    jobs = ctx.get_option('jobs') or ctx.config.values.general.configure_jobs
+    try:
+        return max(1, int(jobs))
+    except ValueError:
+        raise Exception(_('Invalid number of configure jobs: %s') % jobs)
+
+@pisi.profiler.profiled("plan.configure")
+def plan_configure(packages, store):
+    """Return the dependency graph of the pending packages and the
+    levels to configure them in. Packages of a level do not depend on
+    each other and only depend on packages of earlier levels."""
+    G_f = pgraph.PGraph(store)
+    for x in packages:
+        G_f.add_package(x)
+    for x in packages:
+        for dep in store.get_package(x).runtimeDependencies():
+            if dep.package in G_f.vertices():
+                G_f.add_dep(x, dep)
+    if ctx.get_option('debug'):
+        import sys
+        G_f.write_graphviz(sys.stdout)
+
+    order, levels = G_f.topological_levels()
+    # edges go from a package to its dependencies
+    levels.reverse()
+
+    # system.base packages must be configured first (Bug 4211) and COMAR
+    # alone, as the following configurations go through the new daemon
+    systembase = set()
+    componentdb = pisi.db.componentdb.ComponentDB()
+    if componentdb.has_component('system.base'):
+        systembase = set(componentdb.get_union_component('system.base').packages)
+
+    base_levels = []
+    nonbase_levels = []
+    for level in levels:
+        base_levels.append([x for x in level if x in systembase])
+        nonbase_levels.append([x for x in level if x not in systembase])
+
+    planned = []
+    for level in base_levels + nonbase_levels:
+        if "comar" in level:
+            level.remove("comar")
+            planned.append(["comar"])
+        if level:
+            planned.append(level)
+
+    return G_f, planned
+
+def configure_package(name, store, installdb):
+    import pisi.comariface
+
+    metadata = store.get_metadata(name)
+    pkginfo = metadata.package
+    pkg_path = installdb.package_path(name)
+
+    ctx.ui.notify(ui.configuring, package = pkginfo, files = None)
+    pisi.comariface.post_install(
+        name,
+        pkginfo.providesComar,
+        util.join_path(pkg_path, ctx.const.comar_dir),
+        util.join_path(pkg_path, ctx.const.metadata_xml),
+        util.join_path(pkg_path, ctx.const.files_xml),
+        None,
+        None,
+        pkginfo.version,
+        pkginfo.release
+    )
+    ctx.ui.notify(ui.configured, package = pkginfo, files = None)
+
+def configure_levels(G_f, levels, store, installdb, jobs):
+    """Configure the packages level by level, running up to jobs
+    post_install calls of a level at once. A failed package does not
+    stop the others of its level; the packages depending on it are
+    skipped and stay pending. Returns {package: error} of the packages
+    which are not configured."""
+    import pisi.comariface
+
+    failed = {}
+
+    def configure(name):
+        try:
+            configure_package(name, store, installdb)
+        except Exception, e:
+            failed[name] = unicode(e)
+
+    # the packages of a level share the user interface
+    user_interface = ctx.ui
+    if jobs > 1:
+        ctx.ui = SerializedUI(user_interface)
+
+    try:
+        for level in levels:
+            ready = []
+            for x in level:
+                blocked = [dep for dep in G_f.adj(x) if failed.has_key(dep)]
+                if blocked:
+                    failed[x] = _("Dependency %s is not configured") % blocked[0]
+                    ctx.ui.warning(_("Skipping configuration of %s: %s") % (x, failed[x]))
+                else:
+                    ready.append(x)
+
+            ctx.ui.debug(_("Configuring %d package(s) at once: %s")
+                         % (len(ready), util.strlist(ready)))
+            pisi.comariface.dispatch([functools.partial(configure, x) for x in ready],
+                                     jobs)
+
+            for x in ready:
+                if failed.has_key(x):
+                    ctx.ui.error(_("Configuration of %s failed: %s") % (x, failed[x]))
+                else:
+                    installdb.clear_pending(x)
+    finally:
+        ctx.ui = user_interface
+
+    return failed
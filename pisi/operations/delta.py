@@ -10,6 +10,8 @@
 # Please read the COPYING file.
 
 import os
+import tempfile
+import multiprocessing
 
 import gettext
 __trans = gettext.translation("pisi", fallback=True)
@@ -30,11 +32,16 @@ def create_delta_packages_from_obj(old_packages, new_package_obj, specdir):
     name, new_version, new_release, new_distro_id, new_arch = \
             util.split_package_filename(new_pkg_name)
 
-    cwd = os.getcwd()
     out_dir = ctx.get_option("output_dir")
     target_format = ctx.get_option("package_format")
-    delta_packages = []
 
+    # the new package is indexed once for all of the old packages
+    new_index = index_files(new_pkg_files)
+
+    comar_files = [util.join_path(ctx.const.comar_dir, pcomar.script)
+                   for pcomar in new_pkg_info.providesComar]
+
+    jobs = []
     for old_package in old_packages:
         old_pkg = pisi.package.Package(old_package)
         old_pkg_info = old_pkg.metadata.package
@@ -56,14 +63,12 @@ def create_delta_packages_from_obj(old_packages, new_package_obj, specdir):
                                new_distro_id,
                                new_arch)) + ctx.const.delta_package_suffix
 
-        ctx.ui.info(_("Creating %s...") % delta_name)
-
         if out_dir:
             delta_name = util.join_path(out_dir, delta_name)
 
         old_pkg_files = old_pkg.get_files()
 
-        files_delta = find_delta(old_pkg_files, new_pkg_files)
+        files_delta = find_delta(old_pkg_files, new_pkg_files, new_index)
 
         if len(files_delta) == len(new_pkg_files.list):
             ctx.ui.warning(_("All files in the package '%s' are different "
@@ -71,22 +76,9 @@ def create_delta_packages_from_obj(old_packages, new_package_obj, specdir):
                              "it...") % old_package)
             continue
 
-        delta_pkg = pisi.package.Package(delta_name, "w", format=target_format)
-
-        # add comar files to package
-        os.chdir(specdir)
-        for pcomar in new_pkg_info.providesComar:
-            fname = util.join_path(ctx.const.comar_dir, pcomar.script)
-            delta_pkg.add_to_package(fname)
-
-        # add xmls and files
-        os.chdir(new_pkg_path)
-
-        delta_pkg.add_metadata_xml(ctx.const.metadata_xml)
-        delta_pkg.add_files_xml(ctx.const.files_xml)
-
         # only metadata information may change in a package,
         # so no install archive added to delta package
+        install_files = []
         if files_delta:
             # Sort the files in-place according to their path for an ordered
             # tarfile layout which dramatically improves the compression
@@ -98,15 +90,69 @@ def create_delta_packages_from_obj(old_packages, new_package_obj, specdir):
                 orgname = util.join_path("install", finfo.path)
                 if new_pkg_info.debug_package:
                     orgname = util.join_path("debug", finfo.path)
-                delta_pkg.add_to_install(orgname, finfo.path)
+                install_files.append((orgname, finfo.path))
+
+        jobs.append((delta_name, target_format, specdir, new_pkg_path,
+                     comar_files, install_files))
+
+    for job in jobs:
+        ctx.ui.info(_("Creating %s...") % os.path.basename(job[0]))
+
+    # Compressing the install archives is the expensive part, so the
+    # delta packages are written concurrently.
+    if len(jobs) > 1:
+        pool = multiprocessing.Pool(min(len(jobs), multiprocessing.cpu_count()))
+        try:
+            delta_packages = pool.map(write_delta_package, jobs, 1)
+        except:
+            pool.terminate()
+            pool.join()
+            raise
+        pool.close()
+        pool.join()
+    else:
+        delta_packages = map(write_delta_package, jobs)
+
+    # Return delta package names
+    return delta_packages
+
+def write_delta_package(job):
+    """Write a delta package, run in the worker processes of
+    create_delta_packages_from_obj."""
+    delta_name, target_format, specdir, new_pkg_path, comar_files, \
+            install_files = job
+
+    # every delta package needs its own install archive
+    util.ensure_dirs(ctx.config.tmp_dir())
+    tmp_dir = tempfile.mkdtemp(prefix="delta-", dir=ctx.config.tmp_dir())
+
+    cwd = os.getcwd()
+    try:
+        delta_pkg = pisi.package.Package(delta_name, "w", format=target_format,
+                                         tmp_dir=tmp_dir)
+
+        # add comar files to package
+        os.chdir(specdir)
+        for fname in comar_files:
+            delta_pkg.add_to_package(fname)
+
+        # add xmls and files
+        os.chdir(new_pkg_path)
+
+        delta_pkg.add_metadata_xml(ctx.const.metadata_xml)
+        delta_pkg.add_files_xml(ctx.const.files_xml)
+
+        for orgname, path in install_files:
+            delta_pkg.add_to_install(orgname, path)
 
         os.chdir(cwd)
 
         delta_pkg.close()
-        delta_packages.append(delta_name)
+    finally:
+        os.chdir(cwd)
+        util.clean_dir(tmp_dir)
 
-    # Return delta package names
-    return delta_packages
+    return delta_name
 
 def create_delta_packages(old_packages, new_package):
     if new_package in old_packages:
@@ -149,13 +195,20 @@ def create_delta_package(old_package, new_package):
 #  Hash equal but path different ones   (these are the relocations)
 #  Hash and also path equal ones        (do nothing)
 
-def find_delta(old_files, new_files):
-
+def index_files(files):
+    """Return a dictionary of the files by their hashes."""
     hashto_files = {}
-    for f in new_files.list:
+    for f in files.list:
         hashto_files.setdefault(f.hash, []).append(f)
+    return hashto_files
+
+def find_delta(old_files, new_files, new_index=None):
+
+    if new_index is None:
+        new_index = index_files(new_files)
+    hashto_files = new_index
 
-    new_hashes = set([f.hash for f in new_files.list])
+    new_hashes = set(hashto_files)
     old_hashes = set([f.hash for f in old_files.list])
     hashes_delta = new_hashes - old_hashes
 
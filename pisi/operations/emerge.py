@@ -10,7 +10,10 @@
 # Please read the COPYING file.
 #
 
+import os
 import sys
+import time
+import multiprocessing
 
 import gettext
 __trans = gettext.translation('pisi', fallback=True)
@@ -22,6 +25,7 @@ import pisi.context as ctx
 import pisi.util as util
 import pisi.atomicoperations as atomicoperations
 import pisi.ui as ui
+import pisi.profiler
 import pisi.db
 
 def emerge(A):
@@ -68,17 +72,22 @@ installed in the respective order to satisfy dependencies:
 
     #ctx.ui.notify(ui.packagestogo, order = order_build)
 
-    for x in order_build:
-        package_names = atomicoperations.build(x).new_packages
-        pisi.operations.install.install_pkg_files(package_names, reinstall=True) # handle inter-package deps here
-        # reset counts between builds
-        ctx.ui.errors = ctx.ui.warnings = 0
+    jobs = emerge_jobs()
+    if jobs > 1 and len(order_build) > 1:
+        EmergeScheduler(order_build, G_f, jobs).run()
+    else:
+        for x in order_build:
+            package_names = atomicoperations.build(x).new_packages
+            pisi.operations.install.install_pkg_files(package_names, reinstall=True) # handle inter-package deps here
+            # reset counts between builds
+            ctx.ui.errors = ctx.ui.warnings = 0
 
     # FIXME: take a look at the fixme above :(, we have to be sure
     # that order_build is a known type...
     U = set(order_build)
     U.update(order_inst)
 
+@pisi.profiler.profiled("plan.emerge")
 def plan_emerge(A):
 
     sourcedb = pisi.db.sourcedb.SourceDB()
@@ -145,3 +154,206 @@ def plan_emerge(A):
     G_f2, order_inst = pisi.operations.install.plan_install_pkg_names(install_list)
 
     return G_f, order_inst, order_build
+
+def emerge_jobs():
+    """Return the number of source packages which may be built at once."""
+    jobs = ctx.get_option('jobs') or ctx.config.values.build.emerge_jobs
+    try:
+        return max(1, int(jobs))
+    except ValueError:
+        raise Exception(_('Invalid number of emerge jobs: %s') % jobs)
+
+def available_memory():
+    """Return available memory in MB or None if it is unknown."""
+    try:
+        for line in open("/proc/meminfo"):
+            if line.startswith("MemAvailable:"):
+                return int(line.split()[1]) / 1024
+    except (IOError, ValueError):
+        pass
+    return None
+
+def run_build(pb, log_path, conn):
+    """Build pb in a child process, writing the output to log_path and
+    sending the list of new packages (or the error message) to conn."""
+    log = os.open(log_path, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0644)
+    os.dup2(log, sys.stdout.fileno())
+    os.dup2(log, sys.stderr.fileno())
+    os.dup2(os.open(os.devnull, os.O_RDONLY), sys.stdin.fileno())
+
+    # build dependencies are installed by the emerge process, a
+    # background build must not install anything
+    pb.install_build_deps = False
+
+    try:
+        try:
+            pb.build()
+        finally:
+            if ctx.ui.errors or ctx.ui.warnings:
+                ctx.ui.warning(_("*** %d error(s), %d warning(s)") \
+                                % (ctx.ui.errors, ctx.ui.warnings))
+            sys.stdout.flush()
+            sys.stderr.flush()
+    except KeyboardInterrupt:
+        conn.send((False, _("Interrupted")))
+    except Exception, e:
+        import traceback
+        traceback.print_exc()
+        sys.stderr.flush()
+        conn.send((False, unicode(e)))
+    else:
+        conn.send((True, pb.new_packages))
+
+class EmergeScheduler:
+    """Builds independent source packages concurrently.
+
+    Every build runs in its own process and work dir with its output
+    written to a log file. A source is started only after all of its
+    build dependencies in the emerge graph are built and installed.
+    Installation of the built packages is done by this process, one
+    build at a time. When a build fails no new builds are started unless
+    the keep_going option is set; in that case only the sources which
+    depend on the failed one are skipped."""
+
+    poll_interval = 0.2
+
+    def __init__(self, order_build, G_f, jobs):
+        self.order = list(order_build)
+        self.jobs = jobs
+        self.min_free_memory = int(ctx.config.values.build.emerge_min_free_memory or 0)
+
+        self.deps = {}
+        for x in self.order:
+            if G_f and G_f.has_vertex(x):
+                self.deps[x] = set(G_f.adj(x)) & set(self.order)
+            else:
+                self.deps[x] = set()
+
+        self.log_dir = util.join_path(ctx.config.tmp_dir(), "emerge-logs")
+        util.ensure_dirs(self.log_dir)
+
+        self.pending = list(self.order)
+        self.running = {}
+        self.done = set()
+        self.failed = {}
+
+    def can_start(self):
+        if not self.running:
+            return True
+
+        if len(self.running) >= self.jobs:
+            return False
+
+        # leave some room for the builds already running
+        if os.getloadavg()[0] >= multiprocessing.cpu_count():
+            return False
+
+        free = available_memory()
+        if free is not None and free < self.min_free_memory:
+            return False
+
+        return True
+
+    def ready(self):
+        return [x for x in self.pending if self.deps[x] <= self.done]
+
+    def blocked(self):
+        """Return the pending sources which depend on a failed build,
+        directly or through other pending sources."""
+        blocked = set(self.failed)
+        # pending keeps the build order, dependencies come first
+        for x in self.pending:
+            if self.deps[x] & blocked:
+                blocked.add(x)
+        return [x for x in self.pending if x in blocked]
+
+    def builder(self, name):
+        import pisi.operations.build
+        return pisi.operations.build.Builder.from_name(name)
+
+    def install(self, packages):
+        pisi.operations.install.install_pkg_files(packages, reinstall=True)
+
+    def start(self, name):
+        self.pending.remove(name)
+
+        # Builder reads the spec, fetches the files and sets up the
+        # environment; do that here so concurrent builds don't race on
+        # the shared transfer dir
+        environ = dict(os.environ)
+        pb = self.builder(name)
+        os.environ.clear()
+        os.environ.update(environ)
+
+        # the build dependencies are installed here, not while other
+        # builds install their packages
+        pb.check_build_dependencies()
+
+        log_path = util.join_path(self.log_dir, "%s.log" % name)
+        parent_conn, child_conn = multiprocessing.Pipe(False)
+        process = multiprocessing.Process(target=run_build,
+                                          args=(pb, log_path, child_conn))
+        process.start()
+        child_conn.close()
+
+        self.running[name] = (process, parent_conn, log_path)
+        ctx.ui.info(_("Building %s (log: %s)") % (name, log_path))
+
+    def finished(self):
+        """Wait until one of the running builds ends and return its name
+        with the result sent by the build process."""
+        while True:
+            for name, (process, conn, log_path) in self.running.items():
+                result = None
+                if conn.poll():
+                    try:
+                        result = conn.recv()
+                    except EOFError:
+                        result = (False, _("Build process exited unexpectedly"))
+                elif not process.is_alive():
+                    result = (False, _("Build process exited unexpectedly"))
+
+                if result:
+                    process.join()
+                    conn.close()
+                    del self.running[name]
+                    return name, log_path, result
+
+            time.sleep(self.poll_interval)
+
+    def run(self):
+        keep_going = ctx.get_option('keep_going')
+        try:
+            while self.pending or self.running:
+                stop = self.failed and not keep_going
+                if not stop:
+                    for name in self.ready():
+                        if not self.can_start():
+                            break
+                        self.start(name)
+
+                if not self.running:
+                    break
+
+                name, log_path, (success, result) = self.finished()
+                if success:
+                    ctx.ui.info(_("Build of %s finished, installing its packages.") % name)
+                    self.install(result)
+                    self.done.add(name)
+                else:
+                    ctx.ui.error(_("Build of %s failed: %s") % (name, result))
+                    ctx.ui.error(_("See %s for details.") % log_path)
+                    self.failed[name] = log_path
+        except:
+            for process, conn, log_path in self.running.values():
+                process.terminate()
+                process.join()
+            raise
+
+        if self.failed:
+            skipped = self.blocked() if keep_going else self.pending
+            if skipped:
+                ctx.ui.warning(_("Following source packages are not built: %s")
+                               % util.strlist(skipped))
+            raise Exception(_("Following source packages could not be built: %s")
+                            % util.strlist(self.failed.keys()))
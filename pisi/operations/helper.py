@@ -21,6 +21,7 @@ import pisi.context as ctx
 import pisi.util as util
 import pisi.ui as ui
 import pisi.conflict
+import pisi.hashcache
 import pisi.db
 
 def reorder_base_packages(order):
@@ -108,8 +109,9 @@ def calculate_download_sizes(order):
 
         if cached_packages_dir:
             path = util.join_path(cached_packages_dir, fn)
-            # check the file and sha1sum to be sure it _is_ the cached package
-            if os.path.exists(path) and util.sha1_file(path) == pkg_hash:
+            # check the file and sha1sum to be sure it _is_ the cached
+            # package, hashing it only if it changed since it was verified
+            if os.path.exists(path) and pisi.hashcache.check_file_hash(path, pkg_hash):
                 cached_size += pkg_size
             elif os.path.exists("%s.part" % path):
                 cached_size += os.stat("%s.part" % path).st_size
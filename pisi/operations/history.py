@@ -19,6 +19,7 @@ import pisi.context as ctx
 import pisi.util
 import pisi.db
 import pisi.fetcher
+import pisi.hashcache
 
 class PackageNotFound(pisi.Error):
     pass
@@ -97,16 +98,38 @@ def fetch_remote_file(package, errors):
         ctx.ui.info(_('%s [cached]') % uri.filename())
     return True
 
+def get_snapshot_state(operation):
+    """Return {package: (pkginfo, operation no)} for the packages recorded
+    by a snapshot. An incremental snapshot only records the changes since
+    its base snapshot, so it is composed with the chain of its bases."""
+    historydb = pisi.db.historydb.HistoryDB()
+
+    chain = []
+    while operation is not None:
+        chain.append(operation)
+        if not operation.base:
+            break
+        operation = historydb.get_operation(int(operation.base))
+
+    state = {}
+    for operation in reversed(chain):
+        for pkg in operation.packages:
+            if pkg.operation == "remove":
+                state.pop(pkg.name, None)
+            else:
+                state[pkg.name] = (pkg.before, operation.no)
+
+    return state
+
 def get_snapshot_actions(operation):
     actions = {}
-    snapshot_pkgs = set()
     installdb = pisi.db.installdb.InstallDB()
 
-    for pkg in operation.packages:
-        snapshot_pkgs.add(pkg.name)
-        actions[pkg.name] = ("install", pkg.before, operation.no)
+    state = get_snapshot_state(operation)
+    for name, (pkginfo, no) in state.items():
+        actions[name] = ("install", pkginfo, no)
 
-    for pkg in set(installdb.list_installed()) - snapshot_pkgs:
+    for pkg in set(installdb.list_installed()) - set(state):
         actions[pkg] = ("remove", None, None)
 
     return actions
@@ -116,8 +139,10 @@ def get_takeback_actions(operation):
     historydb = pisi.db.historydb.HistoryDB()
 
     for operation in historydb.get_till_operation(operation):
+        # snapshots do not change the system, incremental ones record
+        # packages removed since their base snapshot
         if operation.type == "snapshot":
-            pass
+            continue
 
         for pkg in operation.packages:
             if pkg.operation in ["upgrade", "downgrade", "remove"]:
@@ -172,3 +197,141 @@ def takeback(operation):
 
     for pkg, operation in configs:
         historydb.load_config(operation, pkg)
+
+class SnapshotPackage:
+    """Package info recorded for a package which is removed since the
+    base snapshot."""
+
+    def __init__(self, name, version, release):
+        self.name = name
+        self.version = version
+        self.release = release
+
+def __stamps_file():
+    return pisi.util.join_path(ctx.config.history_dir(), ctx.const.snapshot_stamps_file)
+
+def read_snapshot_stamps():
+    """Return (snapshot no, {package: (version-release, configs)}) saved by
+    the last snapshot, configs being a list of (path, signature) of the
+    config files of the package. Return None if there are no stamps."""
+    try:
+        lines = open(__stamps_file()).read().splitlines()
+    except IOError:
+        return None
+
+    if not lines or not lines[0].startswith("S\t"):
+        return None
+
+    packages = {}
+    try:
+        no = int(lines[0].split("\t")[1])
+        for line in lines[1:]:
+            fields = line.split("\t")
+            if fields[0] == "P":
+                packages[fields[1]] = (fields[2], [])
+            elif fields[0] == "C":
+                name, path, size, mtime, inode = fields[1:6]
+                signature = None
+                if size:
+                    signature = (long(size), mtime, long(inode))
+                packages[name][1].append((path.decode("utf-8"), signature))
+    except (ValueError, IndexError, KeyError):
+        return None
+
+    return no, packages
+
+def write_snapshot_stamps(no, packages):
+    stamps_file = __stamps_file()
+    tmp = stamps_file + ctx.const.temporary_suffix
+    try:
+        f = open(tmp, "w")
+        f.write("S\t%d\n" % int(no))
+        for name, (version, configs) in sorted(packages.items()):
+            f.write("P\t%s\t%s\n" % (name, version))
+            for path, signature in configs:
+                size, mtime, inode = signature or ("", "", "")
+                f.write("C\t%s\t%s\t%s\t%s\t%s\n" % (name, path.encode("utf-8"),
+                                                       size, mtime, inode))
+        f.close()
+        os.rename(tmp, stamps_file)
+    except (IOError, OSError), e:
+        ctx.ui.warning(_("Could not save snapshot stamps: %s") % e)
+
+def snapshot_package(name, historydb):
+    """Record package name in the current snapshot, save its changed
+    config files and return the stamps of its config files."""
+    installdb = pisi.db.installdb.InstallDB()
+    package = installdb.get_package(name)
+    historydb.add_package(pkgBefore=package, operation="snapshot")
+
+    configs = []
+    # Save changed config files of the package in snapshot
+    for f in installdb.get_files(name).list:
+        if f.type == "config":
+            fpath = pisi.util.join_path(ctx.config.dest_dir(), f.path)
+            if pisi.util.config_changed(f):
+                historydb.save_config(name, fpath)
+            configs.append((f.path, pisi.hashcache.stat_signature(fpath)))
+
+    return configs
+
+def configs_unchanged(configs):
+    for path, signature in configs:
+        fpath = pisi.util.join_path(ctx.config.dest_dir(), path)
+        if pisi.hashcache.stat_signature(fpath) != signature:
+            return False
+    return True
+
+def snapshot(incremental=False):
+    installdb = pisi.db.installdb.InstallDB()
+    historydb = pisi.db.historydb.HistoryDB()
+
+    base = None
+    stamps = {}
+    if incremental:
+        saved = read_snapshot_stamps()
+        snapshots = filter(lambda no: historydb.index.get_type(no) == "snapshot",
+                           historydb.index.list_operations())
+        if saved and snapshots and saved[0] == snapshots[0]:
+            base, stamps = saved
+        else:
+            ctx.ui.info(_("No base snapshot found, taking a full snapshot."))
+
+    historydb.create_history("snapshot")
+
+    if base is None:
+        state = {}
+    else:
+        historydb.history.operation.base = str(base)
+        state = get_snapshot_state(historydb.get_operation(base))
+
+    li = installdb.list_installed()
+    progress = ctx.ui.Progress(len(li))
+
+    new_stamps = {}
+    processed = 0
+    for name in li:
+        version = installdb.installed_db[name]
+        pkginfo = state.get(name, (None, None))[0]
+
+        saved = stamps.get(name)
+        if pkginfo and "%s-%s" % (pkginfo.version, pkginfo.release) == version \
+                and saved and saved[0] == version and configs_unchanged(saved[1]):
+            # neither the package nor its config files changed since
+            # the base snapshot
+            new_stamps[name] = saved
+        else:
+            new_stamps[name] = (version, snapshot_package(name, historydb))
+
+        processed += 1
+        ctx.ui.display_progress(operation = "snapshot",
+                                percent = progress.update(processed),
+                                info = _("Taking snapshot of the system"))
+
+    for name in set(state) - set(li):
+        pkginfo = state[name][0]
+        historydb.add_package(pkgBefore=SnapshotPackage(name, pkginfo.version, pkginfo.release),
+                              operation="remove")
+
+    historydb.update_history()
+    write_snapshot_stamps(historydb.history.operation.no, new_stamps)
@@ -13,6 +13,7 @@
 import os
 import sys
 import zipfile
+import multiprocessing
 
 import gettext
 __trans = gettext.translation('pisi', fallback=True)
@@ -25,6 +26,8 @@ import pisi.atomicoperations as atomicoperations
 import pisi.operations as operations
 import pisi.pgraph as pgraph
 import pisi.ui as ui
+import pisi.profiler
+import pisi.signature
 import pisi.db
 
 def install_pkg_names(A, reinstall = False, extra = False):
@@ -53,6 +56,11 @@ def install_pkg_names(A, reinstall = False, extra = False):
         ctx.ui.info(_('No packages to install.'))
         return True
 
+    image = ctx.get_option('image')
+    if image and installdb.list_installed():
+        raise Exception(_('Image mode needs an empty destination root, '
+                          'there are packages installed in %s.') % ctx.config.dest_dir())
+
     A |= operations.upgrade.upgrade_base(A)
 
     if not ctx.config.get_option('ignore_dependency'):
@@ -93,10 +101,16 @@ def install_pkg_names(A, reinstall = False, extra = False):
 
     paths = []
     extra_paths = {}
+    install_ops = []
     for x in order:
         ctx.ui.info(util.colorize(_("Downloading %d / %d") % (order.index(x)+1, len(order)), "yellow"))
         install_op = atomicoperations.Install.from_name(x)
         paths.append(install_op.package_fname)
+        if image:
+            # only the package information is used, keeping thousands
+            # of packages open would run out of file descriptors
+            install_op.package.close()
+            install_ops.append(install_op)
         if x in extra_packages or (extra and x in A):
             extra_paths[install_op.package_fname] = x
         elif reinstall and  x in installdb.installed_extra:
@@ -112,6 +126,10 @@ def install_pkg_names(A, reinstall = False, extra = False):
     if conflicts:
         operations.remove.remove_conflicting_packages(conflicts)
 
+    if image:
+        install_image(install_ops, extra_paths)
+        return True
+
     for path in paths:
         ctx.ui.info(util.colorize(_("Installing %d / %d") % (paths.index(path)+1, len(paths)), "yellow"))
         install_op = atomicoperations.Install(path)
@@ -125,9 +143,121 @@ def install_pkg_names(A, reinstall = False, extra = False):
 
     return True
 
+def extract_image_package(args):
+    """Extract the install archive and the PiSi files of a package,
+    run in the worker processes of install_image."""
+    path, pkg_dir, pisi_files = args
+    package = pisi.package.Package(path)
+    if ctx.config.values.general.verify_signatures:
+        pisi.signature.check(package.verify_signature(ctx.config.trusted_certs_dir()), path)
+    package.extract_install(ctx.config.dest_dir())
+    package.extract_files(pisi_files, pkg_dir)
+
+def install_image(install_ops, extra_paths):
+    """Install packages into an empty destination root in bulk.
+
+    Nothing is installed in the root, so there is nothing to replace,
+    upgrade or ask about and files can only conflict between the new
+    packages. Packages are extracted in parallel without syncing every
+    file, then the databases and the history are updated in one batch
+    and the filesystem of the root is synced once. COMAR is not used,
+    all packages are left to be configured with configure-pending."""
+
+    installdb = pisi.db.installdb.InstallDB()
+    historydb = pisi.db.historydb.HistoryDB()
+
+    owners = {}
+    file_conflicts = []
+    for op in install_ops:
+        op.check_versioning(op.pkginfo.version, op.pkginfo.release)
+        conflicting = set([c.package for c in op.pkginfo.conflicts])
+        for f in op.files.list:
+            # directories have no hash and may be shared
+            if f.hash is None:
+                continue
+            owner = owners.setdefault(f.path, op.pkginfo.name)
+            if owner != op.pkginfo.name and owner not in conflicting:
+                file_conflicts.append((owner, f.path))
+
+    atomicoperations.check_free_space([op.pkginfo for op in install_ops])
+
+    if file_conflicts:
+        msg = _('File conflicts:\n%s') % "".join([_("/%s from %s package\n") % (path, pkg)
+                                                   for pkg, path in file_conflicts])
+        if ctx.get_option('ignore_file_conflicts'):
+            ctx.ui.warning(msg)
+        else:
+            raise atomicoperations.Error(msg)
+
+    # A package shipping a symlink to a directory (e.g. /lib64 -> lib)
+    # must be extracted before the packages installing files under it.
+    first = set()
+    checked = set()
+    for path in set([os.path.dirname(path) for path in owners]):
+        while path and path not in checked:
+            checked.add(path)
+            if owners.has_key(path):
+                first.add(owners[path])
+            path = os.path.dirname(path)
+
+    jobs = []
+    for op in install_ops:
+        pisi_files = [ctx.const.files_xml, ctx.const.metadata_xml]
+        for pcomar in op.metadata.package.providesComar:
+            pisi_files.append(os.path.join(ctx.const.comar_dir, pcomar.script))
+        jobs.append((op.package_fname, op.package.pkg_dir(), pisi_files))
+
+    ctx.ui.info(util.colorize(_("Installing %d packages into %s") %
+                              (len(install_ops), ctx.config.dest_dir()), "yellow"))
+
+    ctx.disable_keyboard_interrupts()
+    try:
+        with ctx.profiler.span("install.image_extract"):
+            for job, op in zip(jobs, install_ops):
+                if op.pkginfo.name in first:
+                    extract_image_package(job)
+
+            jobs = [job for job, op in zip(jobs, install_ops) if op.pkginfo.name not in first]
+            if len(jobs) > 1:
+                pool = multiprocessing.Pool()
+                try:
+                    pool.map(extract_image_package, jobs, 1)
+                finally:
+                    pool.close()
+                    pool.join()
+            else:
+                map(extract_image_package, jobs)
+
+        with ctx.profiler.span("install.image_databases"):
+            ctx.filesdb.add_packages_files([(op.pkginfo.name, op.files) for op in install_ops])
+
+            for op in install_ops:
+                installdb.add_package(op.pkginfo)
+                historydb.add_package(pkgAfter=op.pkginfo, operation="install")
+            installdb.mark_pending_packages([op.pkginfo.name for op in install_ops])
+            historydb.update_history()
+
+            extras = [extra_paths[op.package_fname] for op in install_ops
+                      if extra_paths.has_key(op.package_fname)]
+            if extras:
+                with open(os.path.join(ctx.config.info_dir(), ctx.const.installed_extra), "a") as ie_file:
+                    ie_file.write("".join(["%s\n" % x for x in extras]))
+                installdb.installed_extra.extend(extras)
+
+        with ctx.profiler.span("install.image_sync"):
+            util.sync_filesystem(ctx.config.dest_dir())
+    finally:
+        ctx.enable_keyboard_interrupts()
+
+    for op in install_ops:
+        ctx.ui.notify(ui.installed, package=op.pkginfo, files=op.files)
+
 def install_pkg_files(package_URIs, reinstall = False):
     """install a number of pisi package files"""
 
+    if ctx.get_option('image'):
+        raise Exception(_('Image mode can only install packages from repositories.'))
+
     installdb = pisi.db.installdb.InstallDB()
     ctx.ui.debug('A = %s' % str(package_URIs))
 
@@ -268,6 +398,7 @@ def install_pkg_files(package_URIs, reinstall = False):
 
     return True
 
+@pisi.profiler.profiled("plan.install")
 def plan_install_pkg_names(A):
     # try to construct a pisi graph of packages to
     # install / reinstall
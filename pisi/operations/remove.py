@@ -23,6 +23,7 @@ import pisi.atomicoperations as atomicoperations
 import pisi.pgraph as pgraph
 import pisi.util as util
 import pisi.ui as ui
+import pisi.profiler
 import pisi.db
 
 def remove(A, ignore_dep = False, ignore_safety = False):
@@ -90,6 +91,7 @@ in the respective order to satisfy dependencies:
         else:
             ctx.ui.info(_('Package %s is not installed. Cannot remove.') % x)
 
+@pisi.profiler.profiled("plan.remove")
 def plan_remove(A):
     # try to construct a pisi graph of packages to
     # install / reinstall
@@ -25,6 +25,8 @@ import pisi.operations as operations
 import pisi.util as util
 import pisi.db
 import pisi.blacklist
+import pisi.version
+import pisi.profiler
 
 def check_update_actions(packages):
     installdb = pisi.db.installdb.InstallDB()
@@ -63,6 +65,66 @@ def check_update_actions(packages):
 
     return has_actions
 
+def compare_upgrade_info(installed, available, compare_sha1sum=False,
+                         make_version=pisi.version.make_version):
+    """Compare (name, release, distribution, distribution release, install
+    tar hash) tuples of an installed package and its repository version.
+    Return "release" if the repository has a newer release, "sha1sum" if
+    only the install tar hashes differ (and compare_sha1sum is set) or
+    None if the package is up to date."""
+    name, i_release, i_distro, i_distro_release, i_hash = installed
+    name, release, distro, distro_release, hash = available
+
+    if distro == i_distro and \
+            make_version(distro_release) > make_version(i_distro_release):
+        return "release"
+
+    if int(i_release) < int(release):
+        return "release"
+
+    if compare_sha1sum and int(i_release) == int(release) and not hash == i_hash:
+        return "sha1sum"
+
+    return None
+
+def upgrade_candidates(packages=None, compare_sha1sum=False):
+    """Compare the installed packages (or the given ones) with the
+    repositories. Return {name: (installed, available, reason)} for the
+    installed packages found in the repositories, see compare_upgrade_info
+    for the tuples and the reason."""
+    installdb = pisi.db.installdb.InstallDB()
+    packagedb = pisi.db.packagedb.PackageDB()
+
+    installed = installdb.get_upgrade_table()
+    available = packagedb.get_upgrade_table()
+    if packages is not None:
+        packages = set(packages)
+        installed = filter(lambda x: x[0] in packages, installed)
+
+    # distribution releases are shared by most of the packages
+    versions = {}
+    def make_version(distro_release):
+        if not versions.has_key(distro_release):
+            versions[distro_release] = pisi.version.make_version(distro_release)
+        return versions[distro_release]
+
+    # both tables are sorted by name, walk them together
+    candidates = {}
+    i = j = 0
+    while i < len(installed) and j < len(available):
+        i_info, info = installed[i], available[j]
+        if i_info[0] < info[0]:
+            i += 1
+        elif i_info[0] > info[0]:
+            j += 1
+        else:
+            reason = compare_upgrade_info(i_info, info, compare_sha1sum, make_version)
+            candidates[i_info[0]] = (i_info, info, reason)
+            i += 1
+            j += 1
+
+    return candidates
+
 def find_upgrades(packages, replaces):
     packagedb = pisi.db.packagedb.PackageDB()
     installdb = pisi.db.installdb.InstallDB()
@@ -71,6 +133,8 @@ def find_upgrades(packages, replaces):
     security_only = ctx.get_option('security_only')
     comparesha1sum = ctx.get_option('compare_sha1sum')
 
+    candidates = upgrade_candidates(packages, comparesha1sum)
+
     Ap = []
     ds = []
     for i_pkg in packages:
@@ -87,32 +151,23 @@ def find_upgrades(packages, replaces):
             ctx.ui.info(_('Package %s is not installed.') % i_pkg, True)
             continue
 
-        if not packagedb.has_package(i_pkg):
+        if not candidates.has_key(i_pkg):
             ctx.ui.info(_('Package %s is not available in repositories.') % i_pkg, True)
             continue
 
-        pkg = packagedb.get_package(i_pkg)
-        hash = installdb.get_install_tar_hash(i_pkg)
-        (version, release, build, distro, distro_release) = installdb.get_version_and_distro_release(i_pkg)
+        installed, available, reason = candidates[i_pkg]
+        release = installed[1]
 
-        if security_only and not pkg.has_update_type("security", release):
+        if security_only and not packagedb.get_package(i_pkg).has_update_type("security", release):
             continue
 
-        if pkg.distribution == distro and \
-                pisi.version.make_version(pkg.distributionRelease) > pisi.version.make_version(distro_release):
+        if reason:
             Ap.append(i_pkg)
-
-        else:
-            if int(release) < int(pkg.release):
-                Ap.append(i_pkg)
-            elif comparesha1sum and \
-                int(release) == int(pkg.release) and \
-                not pkg.installTarHash == hash:
-                Ap.append(i_pkg)
+            if reason == "sha1sum":
                 ds.append(i_pkg)
-            else:
-                ctx.ui.info(_('Package %s is already at the latest release %s.')
-                            % (pkg.name, pkg.release), True)
+        else:
+            ctx.ui.info(_('Package %s is already at the latest release %s.')
+                        % (i_pkg, available[1]), True)
 
     if debug and ds:
         ctx.ui.status(_('The following packages have different sha1sum:'))
@@ -220,6 +275,7 @@ def upgrade(A=[], repo=None):
         install_op = atomicoperations.Install(path, ignore_file_conflicts = True)
         install_op.install(not ctx.get_option('compare_sha1sum'))
 
+@pisi.profiler.profiled("plan.upgrade")
 def plan_upgrade(A, force_replaced=True, replaces=None):
     # FIXME: remove force_replaced
     # try to construct a pisi graph of packages to
@@ -392,19 +448,12 @@ def is_upgradable(name):
     if not installdb.has_package(name):
         return False
 
-    (i_version, i_release, i_build, i_distro, i_distro_release) = installdb.get_version_and_distro_release(name)
-
     packagedb = pisi.db.packagedb.PackageDB()
 
-    try:
-        version, release, build, distro, distro_release = packagedb.get_version_and_distro_release(name, packagedb.which_repo(name))
-    except KeyboardInterrupt:
-        raise
-    except Exception: #FIXME: what exception could we catch here, replace with that.
+    if not packagedb.has_package(name):
         return False
 
-    if distro == i_distro and \
-            pisi.version.make_version(distro_release) > pisi.version.make_version(i_distro_release):
-        return True
+    installed = installdb.get_upgrade_info(name)
+    available = packagedb.get_upgrade_info(name)
 
-    return int(i_release) < int(release)
+    return compare_upgrade_info(installed, available) == "release"
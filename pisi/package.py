@@ -26,6 +26,8 @@ import pisi.metadata
 import pisi.file
 import pisi.files
 import pisi.util as util
+import pisi.profiler
+import pisi.signature
 import fetcher
 
 
@@ -95,17 +97,24 @@ class Package:
         self.filepath = os.path.join(dest, url.filename())
 
         if not os.path.exists(self.filepath):
-            try:
-                pisi.file.File.download(url, dest)
-            except pisi.fetcher.FetchError:
-                # Bug 3465
-                if ctx.get_option('reinstall'):
-                    raise Error(_("There was a problem while fetching '%s'.\nThe package "
-                    "may have been upgraded. Please try to upgrade the package.") % url);
-                raise
+            Package.download(url)
         else:
             ctx.ui.info(_('%s [cached]') % url.filename())
 
+    @staticmethod
+    def download(url, peer=True):
+        """Download the package at url into the package cache and return
+        its path. The peer cache is not used unless peer is set."""
+        try:
+            return pisi.file.File.download(url, ctx.config.cached_packages_dir(),
+                                           peer=peer)
+        except pisi.fetcher.FetchError:
+            # Bug 3465
+            if ctx.get_option('reinstall'):
+                raise Error(_("There was a problem while fetching '%s'.\nThe package "
+                "may have been upgraded. Please try to upgrade the package.") % url);
+            raise
+
     def add_to_package(self, fn, an=None):
         """Add a file or directory to package"""
         self.impl.add_to_archive(fn, an)
@@ -174,6 +183,28 @@ class Package:
 
         return tar
 
+    def verify_signature(self, trust_dir=None):
+        """Verify the signature of the package against the certificates
+        in trust_dir, return a pisi.signature status. Every member is
+        hashed from the package file before anything is extracted, so a
+        tampered install archive never reaches the target root. If
+        metadata.xml records the install archive hash, the archive is
+        compared with it first and read only once."""
+        verifier = pisi.signature.PackageVerifier(self.impl.zip_obj, trust_dir)
+        if not verifier.signed():
+            return pisi.signature.SIGN_NO
+
+        archive_name, archive_format = \
+                self.archive_name_and_format(self.format)
+        install_tar_hash = self.metadata.package.installTarHash
+        if archive_name is None or not install_tar_hash \
+                or not self.impl.has_file(archive_name):
+            return verifier.verify()
+
+        if verifier.read_hash(archive_name) != install_tar_hash:
+            return pisi.signature.SIGN_CORRUPTED
+        return verifier.verify({archive_name: install_tar_hash})
+
     def extract(self, outdir):
         """Extract entire package contents to directory"""
         self.extract_dir('', outdir)         # means package root
@@ -202,6 +233,7 @@ class Package:
         copies the directory archiveroot/dir to outdir"""
         self.impl.unpack_dir(dir, outdir)
 
+    @pisi.profiler.profiled("package.extract_install")
     def extract_install(self, outdir):
         def callback(tarinfo, extracted):
             if not extracted:
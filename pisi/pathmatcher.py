@@ -0,0 +1,141 @@
+# -*- coding: utf-8 -*-
+#
+# Copyright (C) 2011, TUBITAK/UEKAE
+#
+# This program is free software; you can redistribute it and/or modify it under
+# the terms of the GNU General Public License as published by the Free
+# Software Foundation; either version 2 of the License, or (at your option)
+# any later version.
+#
+# Please read the COPYING file.
+#
+
+"""Compiled matcher for lists of path patterns.
+
+Path definitions of a package (<Path> tags in pspec.xml) may be exact
+paths, directories that match everything below them, or shell globs.
+Instead of trying every pattern with fnmatch for every file, PathMatcher
+uses a dict for exact paths, a dict of directory prefixes for the
+directory rules and a few combined regular expressions for true globs."""
+
+import re
+import fnmatch
+
+import pisi.util as util
+
+def is_glob(pattern):
+    """Return True if pattern contains fnmatch special characters."""
+    return re.search("[*?[]", pattern) is not None
+
+def translate(pattern):
+    regex = fnmatch.translate(pattern)
+    # python 2.x appends the flags to the expression
+    if regex.endswith("(?ms)"):
+        regex = regex[:-len("(?ms)")]
+    return regex
+
+
+class GlobSet:
+    """Combined regular expressions for a prioritized list of globs."""
+
+    # python's re module supports at most 100 named groups
+    max_groups = 90
+
+    def __init__(self, items):
+        """items is a list of (index, pattern) tuples, in priority order."""
+        self.regexes = []
+        for start in range(0, len(items), self.max_groups):
+            chunk = items[start:start + self.max_groups]
+            expr = "|".join(["(?P<g%d>%s)" % (index, translate(pattern))
+                             for index, pattern in chunk])
+            self.regexes.append(re.compile(expr, re.M | re.S))
+
+    def match(self, path):
+        """Return the index of the first glob matching path or None."""
+        for regex in self.regexes:
+            m = regex.match(path)
+            if m:
+                return int(m.lastgroup[1:])
+        return None
+
+
+class PathMatcher:
+    """Classify paths against a list of path patterns.
+
+    A path matches a pattern if it is equal to it, if it matches it as a
+    glob or if it is below it (as fnmatch(path, pattern + "/*")). The
+    best match is the first equal pattern, else the last matching glob,
+    else the longest (lexicographically greatest) directory rule.
+    directory_rule(pattern) can be given to exclude some patterns from
+    the directory rules."""
+
+    def __init__(self, patterns, directory_rule=None):
+        self.patterns = list(patterns)
+        self.exact = {}
+        self.directories = {}
+
+        globs = []
+        directory_globs = []
+        for index, pattern in enumerate(self.patterns):
+            self.exact.setdefault(pattern, index)
+
+            if is_glob(pattern):
+                globs.append((index, pattern))
+
+            if directory_rule and not directory_rule(pattern):
+                continue
+
+            parent = util.join_path(pattern, "*")
+            if parent.endswith("/*") and not is_glob(parent[:-2]):
+                # pattern + "/*" matches everything starting with pattern + "/"
+                self.directories.setdefault(parent[:-2], []).append(index)
+            else:
+                directory_globs.append((index, parent))
+
+        # the last matching glob wins
+        globs.reverse()
+        self.globs = GlobSet(globs)
+
+        # greatest directory rule wins, the first one on ties
+        directory_globs.sort(key=lambda x: (self.patterns[x[0]], -x[0]), reverse=True)
+        self.directory_globs = GlobSet(directory_globs)
+
+    def match_exact(self, path):
+        return self.exact.get(path)
+
+    def match_glob(self, path):
+        return self.globs.match(path)
+
+    def match_directory(self, path):
+        best = None
+
+        def better(index, best):
+            if best is None:
+                return True
+            return (self.patterns[index], -index) > (self.patterns[best], -best)
+
+        pos = path.find("/")
+        while pos != -1:
+            for index in self.directories.get(path[:pos], ()):
+                if better(index, best):
+                    best = index
+            pos = path.find("/", pos + 1)
+
+        index = self.directory_globs.match(path)
+        if index is not None and better(index, best):
+            best = index
+
+        return best
+
+    def match(self, path):
+        """Return the index of the best pattern for path or None."""
+        index = self.match_exact(path)
+        if index is None:
+            index = self.match_glob(path)
+        if index is None:
+            index = self.match_directory(path)
+        return index
+
+    def matches(self, path):
+        """Return True if any of the patterns matches path."""
+        return self.match(path) is not None
@@ -0,0 +1,336 @@
+# -*- coding: utf-8 -*-
+#
+# Copyright (C) 2011, TUBITAK/UEKAE
+#
+# This program is free software; you can redistribute it and/or modify it under
+# the terms of the GNU General Public License as published by the Free
+# Software Foundation; either version 2 of the License, or (at your option)
+# any later version.
+#
+# Please read the COPYING file.
+#
+
+"""Package cache shared over HTTP.
+
+A machine running "pisi serve-cache" serves the files of its
+repositories to the other machines of the network. A file is requested
+as /<scheme>/<host>/<path> of its repository URL, e.g.
+http://cache:8630/http/packages.example.org/2011/foo-1.0-1-1.pisi.
+Missing files are fetched from the repository once, even if many
+machines ask for them at the same time. Packages are checked against
+the hashes in the repository indexes of the server and kept in the
+package cache; packages unknown to the server are not served. Other
+files like the repository indexes are kept for max_age seconds. The
+.sha1sum files are fetched every time, a cached file they don't match
+is fetched again.
+
+Clients set peer_cache in the [general] section of pisi.conf to the
+URL of the server; files are fetched from the server first and from the
+repository if that fails or if they don't match their hashes."""
+
+import os
+import time
+import socket
+import posixpath
+import threading
+import BaseHTTPServer
+import SocketServer
+
+import gettext
+__trans = gettext.translation('pisi', fallback=True)
+_ = __trans.ugettext
+
+import pisi
+import pisi.context as ctx
+import pisi.util as util
+import pisi.uri
+import pisi.fetcher
+import pisi.hashcache
+
+
+class Error(pisi.Error):
+    pass
+
+
+default_port = 8630
+
+sha1sum_suffix = ".sha1sum"
+
+def peer_uri(uri):
+    """Return the URL of uri, a pisi.uri.URI, on the configured peer
+    cache or None if it is not to be fetched from there."""
+    peer = ctx.config.values.general.peer_cache
+    if not peer or uri.scheme() not in ("http", "https", "ftp"):
+        return None
+    # files of password protected repositories are not shared
+    if uri.auth_info() or ctx.config.get_option("authinfo") or "@" in uri.location():
+        return None
+    return "%s/%s/%s%s" % (peer.rstrip("/"), uri.scheme(), uri.location(), uri.path())
+
+
+class CacheHandler(BaseHTTPServer.BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    server_version = "PiSi-Cache/" + pisi.__version__
+
+    def do_GET(self):
+        self.serve(True)
+
+    def do_HEAD(self):
+        self.serve(False)
+
+    def log_message(self, format, *args):
+        ctx.ui.info("%s %s" % (self.client_address[0], format % args), verbose=True)
+
+    def serve(self, body):
+        upstream = self.server.upstream_uri(self.path)
+        if upstream is None:
+            self.send_error(404)
+            return
+
+        try:
+            path = self.server.get_file(upstream)
+        except pisi.fetcher.FetchError, e:
+            self.send_error(502, unicode(e).encode("utf-8"))
+            return
+        except Error:
+            self.send_error(404)
+            return
+
+        source = open(path, "rb")
+        try:
+            size = os.fstat(source.fileno()).st_size
+            byte_range = self.get_range(size)
+            if byte_range is None:
+                start, end = 0, size
+                self.send_response(200)
+            elif byte_range is False:
+                self.send_response(416)
+                self.send_header("Content-Range", "bytes */%d" % size)
+                self.send_header("Content-Length", "0")
+                self.end_headers()
+                return
+            else:
+                start, end = byte_range
+                self.send_response(206)
+                self.send_header("Content-Range", "bytes %d-%d/%d" % (start, end - 1, size))
+            self.send_header("Accept-Ranges", "bytes")
+            self.send_header("Content-Length", str(end - start))
+            self.send_header("Content-Type", "application/octet-stream")
+            self.end_headers()
+
+            if body:
+                source.seek(start)
+                left = end - start
+                while left:
+                    block = source.read(min(pisi.fetcher.blocksize, left))
+                    if not block:
+                        break
+                    self.wfile.write(block)
+                    left -= len(block)
+        finally:
+            source.close()
+
+    def get_range(self, size):
+        """Return the (start, end) byte range requested, None for the
+        whole file and False if the range can't be served."""
+        header = self.headers.getheader("range")
+        if not header or not header.startswith("bytes=") or "," in header:
+            return None
+        try:
+            start, end = header[len("bytes="):].split("-")
+            if start:
+                start = int(start)
+                end = end and int(end) + 1 or size
+            else:
+                # the last bytes of the file
+                start, end = max(0, size - int(end)), size
+        except ValueError:
+            return None
+        end = min(end, size)
+        if start >= end:
+            return False
+        return start, end
+
+
+class CacheServer(SocketServer.ThreadingMixIn, BaseHTTPServer.HTTPServer):
+    """Serves the files under the repository URLs given in prefixes,
+    fetching the missing ones from there."""
+
+    daemon_threads = True
+    allow_reuse_address = True
+
+    def __init__(self, address, prefixes, max_age=300, package_hashes=dict):
+        BaseHTTPServer.HTTPServer.__init__(self, address, CacheHandler)
+        self.prefixes = prefixes
+        self.max_age = max_age
+        self.package_hashes = package_hashes
+        self.hashes = {}
+        self.hashes_time = None
+        self.fetching = {}
+        self.lock = threading.Lock()
+
+    def handle_error(self, request, client_address):
+        ctx.ui.debug(_("Connection from %s is closed") % client_address[0])
+
+    def upstream_uri(self, path):
+        """Return the repository URL of the request path, or None if it
+        is not under one of the served repositories."""
+        path = path.split("?")[0]
+        parts = path.lstrip("/").split("/", 2)
+        if len(parts) < 3 or parts[0] not in ("http", "https", "ftp"):
+            return None
+        scheme, host, path = parts
+        if posixpath.normpath("/" + path) != "/" + path:
+            return None
+        uri = "%s://%s/%s" % (scheme, host, path)
+        for prefix in self.prefixes:
+            if uri.startswith(prefix):
+                return uri
+        return None
+
+    def local_path(self, uri):
+        """Return where the file of uri is kept. Packages share the
+        package cache with the local installations."""
+        if uri.endswith(ctx.const.package_suffix):
+            return util.join_path(ctx.config.cached_packages_dir(), posixpath.basename(uri))
+        return util.join_path(ctx.config.peer_cache_dir(), uri.replace("://", "/", 1))
+
+    def package_hash(self, uri):
+        """Return the repository hash of the package uri, None if it is
+        not in the served repositories. The hashes are read again at
+        most every max_age seconds, the repositories may be updated."""
+        self.lock.acquire()
+        try:
+            if not self.hashes.has_key(uri) and \
+                    (self.hashes_time is None or time.time() - self.hashes_time >= self.max_age):
+                self.hashes = self.package_hashes()
+                self.hashes_time = time.time()
+            return self.hashes.get(uri)
+        finally:
+            self.lock.release()
+
+    def is_fresh(self, path, sha1sum):
+        if not os.path.exists(path):
+            return False
+        if sha1sum is not None:
+            if pisi.hashcache.check_file_hash(path, sha1sum):
+                return True
+            os.unlink(path)
+            pisi.hashcache.forget(path)
+            return False
+        if path.endswith(sha1sum_suffix):
+            return False
+        return time.time() - os.path.getmtime(path) < self.max_age
+
+    def check_sha1sum_file(self, path):
+        """Remove the cached file described by the .sha1sum file path if
+        it doesn't match, so it is fetched again with the new one."""
+        described = path[:-len(sha1sum_suffix)]
+        if os.path.exists(described) and \
+                util.sha1_file(described) != open(path).read().split("\n")[0]:
+            os.unlink(described)
+
+    def get_file(self, uri):
+        """Return the local copy of uri, fetching it if it is missing or
+        stale. Concurrent requests of a file wait for the download
+        started by the first one instead of fetching it again. Raises
+        Error for packages which are not in the served repositories."""
+        path = self.local_path(uri)
+
+        sha1sum = None
+        if uri.endswith(ctx.const.package_suffix):
+            sha1sum = self.package_hash(uri)
+            if sha1sum is None:
+                raise Error(_("%s is not in the served repositories") % uri)
+
+        self.lock.acquire()
+        try:
+            if self.is_fresh(path, sha1sum):
+                return path
+            download = self.fetching.get(path)
+            fetch = download is None
+            if fetch:
+                download = self.fetching[path] = threading.Event()
+                download.error = None
+        finally:
+            self.lock.release()
+
+        if not fetch:
+            download.wait()
+            if download.error:
+                raise download.error
+            return path
+
+        try:
+            ctx.ui.info(_("Fetching %s") % uri)
+            # a package not matching the repository hash is not kept
+            pisi.fetcher.fetch_url(uri, os.path.dirname(path),
+                                   destfile=os.path.basename(path),
+                                   record_hash=sha1sum is not None, sha1sum=sha1sum)
+            if uri.endswith(sha1sum_suffix):
+                self.check_sha1sum_file(path)
+        except pisi.fetcher.FetchError, e:
+            download.error = e
+            raise
+        finally:
+            self.lock.acquire()
+            del self.fetching[path]
+            self.lock.release()
+            download.set()
+
+        return path
+
+
+def repository_prefixes(repodb):
+    """Return the URL directories of the active repositories."""
+    prefixes = []
+    for repo in repodb.list_repos():
+        url = repodb.get_repo_url(repo)
+        if pisi.uri.URI(url).is_remote_file():
+            prefixes.append(posixpath.dirname(url) + "/")
+    return prefixes
+
+def repository_package_hashes():
+    """Return the SHA1 sums of the packages and delta packages of the
+    active repositories by their URLs."""
+    import pisi.db.repodb
+    import pisi.db.packagedb
+
+    repodb = pisi.db.repodb.RepoDB()
+    packagedb = pisi.db.packagedb.PackageDB()
+    hashes = {}
+    for repo in repodb.list_repos():
+        base = posixpath.dirname(repodb.get_repo_url(repo))
+        for name in packagedb.list_packages(repo):
+            package = packagedb.get_package(name, repo)
+            files = [(package.packageURI, package.packageHash)]
+            files.extend([(delta.packageURI, delta.packageHash)
+                          for delta in package.deltaPackages])
+            for uri, sha1sum in files:
+                if not pisi.uri.URI(uri).is_absolute_path():
+                    uri = posixpath.join(base, str(pisi.uri.URI(uri).path()))
+                hashes[str(uri)] = sha1sum
+    return hashes
+
+def serve(address="", port=default_port, max_age=300):
+    """Serve the active repositories until interrupted."""
+    import pisi.db.repodb
+
+    prefixes = repository_prefixes(pisi.db.repodb.RepoDB())
+    if not prefixes:
+        raise Error(_("No remote repository to serve"))
+
+    try:
+        server = CacheServer((address, port), prefixes, max_age,
+                             repository_package_hashes)
+    except socket.error, e:
+        raise Error(_("Could not listen on port %d: %s") % (port, e))
+
+    ctx.ui.info(_("Serving package cache on port %d for:") % port)
+    for prefix in prefixes:
+        ctx.ui.info("  %s" % prefix)
+
+    try:
+        server.serve_forever()
+    finally:
+        server.server_close()
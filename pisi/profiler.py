@@ -0,0 +1,209 @@
+# -*- coding: utf-8 -*-
+#
+# Copyright (C) 2011, TUBITAK/UEKAE
+#
+# This program is free software; you can redistribute it and/or modify it under
+# the terms of the GNU General Public License as published by the Free
+# Software Foundation; either version 2 of the License, or (at your option)
+# any later version.
+#
+# Please read the COPYING file.
+#
+
+"""Timed spans and counters for the hot paths of PiSi.
+
+The code is instrumented with
+
+    with ctx.profiler.span("fetch", url=url):
+        ...
+    ctx.profiler.count("packagedb.get_package")
+
+or with the profiled decorator for whole functions. By default
+ctx.profiler is a NullProfiler whose span() returns a shared do nothing
+object, so instrumentation costs a method call when profiling is
+disabled. pisi.api.set_profiler installs a Profiler, which records every
+span and can write the result as a Chrome trace event file (JSON,
+readable by chrome://tracing, Perfetto and speedscope) or as folded
+stacks for flamegraph.pl."""
+
+import os
+import time
+import json
+import threading
+
+
+class NullSpan(object):
+    __slots__ = ()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        return False
+
+null_span = NullSpan()
+
+
+class NullProfiler(object):
+    """Profiler used when profiling is disabled."""
+
+    enabled = False
+
+    def span(self, name, **args):
+        return null_span
+
+    def count(self, name, value=1):
+        pass
+
+
+class Span(object):
+    __slots__ = ("profiler", "name", "args", "start", "child_time")
+
+    def __init__(self, profiler, name, args):
+        self.profiler = profiler
+        self.name = name
+        self.args = args
+
+    def __enter__(self):
+        self.child_time = 0.0
+        self.profiler._stack().append(self)
+        self.start = time.time()
+        return self
+
+    def __exit__(self, *args):
+        end = time.time()
+        self.profiler._finish(self, end)
+        return False
+
+
+class Profiler(object):
+    """Collects timed spans and counters."""
+
+    enabled = True
+
+    def __init__(self):
+        self.start = time.time()
+        self.pid = os.getpid()
+        # (name, args, thread, start, duration, self time, stack)
+        self.events = []
+        self.counters = {}
+        self.lock = threading.Lock()
+        self.local = threading.local()
+
+    def _stack(self):
+        stack = getattr(self.local, "stack", None)
+        if stack is None:
+            stack = self.local.stack = []
+        return stack
+
+    def _finish(self, span, end):
+        stack = self._stack()
+        # spans are closed in order, but be tolerant to a missed exit
+        while stack and stack[-1] is not span:
+            stack.pop()
+        if stack:
+            stack.pop()
+        path = tuple([s.name for s in stack])
+
+        duration = end - span.start
+        if stack:
+            stack[-1].child_time += duration
+
+        event = (span.name, span.args, threading.current_thread().ident,
+                 span.start, duration, duration - span.child_time, path)
+        self.lock.acquire()
+        try:
+            self.events.append(event)
+        finally:
+            self.lock.release()
+
+    def span(self, name, **args):
+        """Return a context manager timing the enclosed block as name.
+        Keyword arguments are stored with the span."""
+        return Span(self, name, args)
+
+    def count(self, name, value=1):
+        """Add value to the counter name."""
+        self.lock.acquire()
+        try:
+            self.counters[name] = self.counters.get(name, 0) + value
+        finally:
+            self.lock.release()
+
+    def summary(self):
+        """Return {name: (calls, total time, self time)} of the spans."""
+        summary = {}
+        for name, args, thread, start, duration, self_time, path in self.events:
+            calls, total, own = summary.get(name, (0, 0.0, 0.0))
+            summary[name] = (calls + 1, total + duration, own + self_time)
+        return summary
+
+    def trace(self):
+        """Return the profile in Chrome trace event format."""
+        events = []
+        for name, args, thread, start, duration, self_time, path in self.events:
+            event = {"name": name,
+                     "cat": name.split(".")[0],
+                     "ph": "X",
+                     "pid": self.pid,
+                     "tid": thread,
+                     "ts": int((start - self.start) * 1000000),
+                     "dur": int(duration * 1000000)}
+            if args:
+                event["args"] = dict([(k, unicode(v)) for k, v in args.items()])
+            events.append(event)
+
+        end = int((time.time() - self.start) * 1000000)
+        for name, value in sorted(self.counters.items()):
+            events.append({"name": name,
+                           "ph": "C",
+                           "pid": self.pid,
+                           "ts": end,
+                           "args": {"value": value}})
+
+        summary = {}
+        for name, (calls, total, own) in self.summary().items():
+            summary[name] = {"calls": calls, "total": total, "self": own}
+
+        return {"traceEvents": events,
+                "displayTimeUnit": "ms",
+                "counters": self.counters,
+                "summary": summary}
+
+    def folded(self):
+        """Return the profile as folded stacks, one "a;b;c microseconds"
+        line per distinct stack."""
+        stacks = {}
+        for name, args, thread, start, duration, self_time, path in self.events:
+            key = ";".join(path + (name,))
+            stacks[key] = stacks.get(key, 0) + self_time
+
+        return "".join(["%s %d\n" % (key, int(value * 1000000))
+                        for key, value in sorted(stacks.items())])
+
+    def write(self, path):
+        """Write the profile to path. Files ending with .folded get
+        folded stacks, any other file a JSON trace."""
+        f = open(path, "w")
+        try:
+            if path.endswith(".folded"):
+                f.write(self.folded())
+            else:
+                json.dump(self.trace(), f, indent=1, sort_keys=True)
+        finally:
+            f.close()
+
+
+def profiled(name):
+    """Decorator timing every call of the function as span name."""
+    def decorator(func):
+        def wrapper(*args, **kwargs):
+            import pisi.context as ctx
+            if not ctx.profiler.enabled:
+                return func(*args, **kwargs)
+            with ctx.profiler.span(name):
+                return func(*args, **kwargs)
+        wrapper.__name__ = func.__name__
+        wrapper.__doc__ = func.__doc__
+        return wrapper
+    return decorator
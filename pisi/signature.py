@@ -0,0 +1,274 @@
+# -*- coding: utf-8 -*-
+#
+# Copyright (C) 2011, TUBITAK/UEKAE
+#
+# This program is free software; you can redistribute it and/or modify it under
+# the terms of the GNU General Public License as published by the Free
+# Software Foundation; either version 2 of the License, or (at your option)
+# any later version.
+#
+# Please read the COPYING file.
+#
+
+"""Package signatures.
+
+A signed package carries "pisi-signed:<certificate>:<signature>" in its
+ZIP comment, both base64 encoded, as written by
+scripts/package-signing/pisign.py. The signature is an RSA-SHA1
+signature of the manifest of the package, a "name sha1sum" line for
+every member of the ZIP file in archive order.
+
+PackageVerifier computes the manifest from the ZIP file. When a
+package is installed the signature and the install archive are
+verified before anything is extracted, the compressed archive is
+hashed without being decompressed. openssl is run once per package to
+check the signature; the certificate checks are done once per
+certificate."""
+
+import os
+import base64
+import hashlib
+import binascii
+import tempfile
+import threading
+import subprocess
+
+import gettext
+__trans = gettext.translation('pisi', fallback=True)
+_ = __trans.ugettext
+
+import pisi
+
+
+class Error(pisi.Error):
+    pass
+
+
+HEADER = "pisi-signed"
+
+# signature validity
+SIGN_OK, SIGN_NO, SIGN_SELF, SIGN_UNTRUSTED, SIGN_CORRUPTED = range(5)
+
+# certificate validity
+CERT_OK, CERT_SELF, CERT_CORRUPTED = range(3)
+
+blocksize = 256 * 1024
+
+openssl_path = "/usr/bin/openssl"
+
+
+def openssl(args, input=None, stderr=False):
+    """Run openssl with args, return (exit status, output). The error
+    output is included if stderr is set."""
+    pipe = subprocess.Popen([openssl_path] + args,
+                            stdin=subprocess.PIPE,
+                            stdout=subprocess.PIPE,
+                            stderr=stderr and subprocess.STDOUT or subprocess.PIPE)
+    output, error = pipe.communicate(input)
+    return pipe.returncode, output
+
+
+def parse_comment(comment):
+    """Return (certificate, signature) of a ZIP comment, None if the
+    comment is not a signature. Raises Error if it is malformed."""
+    if not comment or not comment.startswith(HEADER):
+        return None
+    try:
+        header, cert_ascii, signature_ascii = comment.split(":")
+        if header != HEADER:
+            raise ValueError
+        return base64.b64decode(cert_ascii), base64.b64decode(signature_ascii)
+    except (ValueError, TypeError, binascii.Error):
+        raise Error(_("Malformed package signature"))
+
+
+class Certificate:
+    """A signing certificate with the results of its openssl checks."""
+
+    def __init__(self, data):
+        self.file = tempfile.NamedTemporaryFile(prefix="pisi-cert-")
+        self.file.write(data)
+        self.file.flush()
+
+        status, output = openssl(["verify", self.file.name], stderr=True)
+        self.validity = CERT_CORRUPTED
+        if status == 0:
+            self.validity = CERT_OK
+        else:
+            for line in output.split("\n"):
+                # error 18: self signed certificate
+                if line.split()[:2] == ["error", "18"]:
+                    self.validity = CERT_SELF
+
+        self.hash = certificate_hash(self.file.name)
+
+        self.public_key = tempfile.NamedTemporaryFile(prefix="pisi-pubkey-")
+        self.public_key.write(openssl(["x509", "-inform", "pem", "-in", self.file.name,
+                                       "-pubkey", "-noout"])[1])
+        self.public_key.flush()
+
+_certificates = {}
+_trusted = {}
+_lock = threading.Lock()
+
+def certificate_hash(path):
+    return openssl(["x509", "-noout", "-in", path, "-hash"])[1].strip()
+
+def get_certificate(data):
+    """Return the Certificate of data, checked once per process."""
+    key = hashlib.sha1(data).hexdigest()
+    _lock.acquire()
+    try:
+        if not _certificates.has_key(key):
+            _certificates[key] = Certificate(data)
+        return _certificates[key]
+    finally:
+        _lock.release()
+
+def trusted_hashes(trust_dir):
+    """Return the hashes of the certificates in trust_dir. The directory
+    is read again only when it changes."""
+    try:
+        mtime = os.stat(trust_dir).st_mtime
+    except OSError:
+        return set()
+
+    _lock.acquire()
+    try:
+        if _trusted.get(trust_dir, (None,))[0] != mtime:
+            hashes = set()
+            for filename in os.listdir(trust_dir):
+                path = os.path.join(trust_dir, filename)
+                if os.path.isfile(path):
+                    hashes.add(certificate_hash(path))
+            _trusted[trust_dir] = (mtime, hashes)
+        return _trusted[trust_dir][1]
+    finally:
+        _lock.release()
+
+def verify_manifest(manifest, cert_data, signature, trust_dir=None):
+    """Verify the signature of manifest, return a SIGN_* status."""
+    cert = get_certificate(cert_data)
+    if cert.validity == CERT_CORRUPTED:
+        return SIGN_CORRUPTED
+
+    if trust_dir is not None and cert.hash not in trusted_hashes(trust_dir):
+        return SIGN_UNTRUSTED
+
+    signature_file = tempfile.NamedTemporaryFile(prefix="pisi-sig-")
+    try:
+        signature_file.write(signature)
+        signature_file.flush()
+        status, output = openssl(["dgst", "-sha1",
+                                  "-verify", cert.public_key.name,
+                                  "-signature", signature_file.name],
+                                 manifest)
+    finally:
+        signature_file.close()
+
+    if status != 0:
+        return SIGN_CORRUPTED
+    if cert.validity == CERT_OK:
+        return SIGN_OK
+    return SIGN_SELF
+
+def check(status, package):
+    """Raise Error unless status is an acceptable signature status."""
+    if status == SIGN_NO:
+        raise Error(_("Package %s is not signed") % package)
+    elif status == SIGN_UNTRUSTED:
+        raise Error(_("Package %s is signed by an untrusted source") % package)
+    elif status == SIGN_CORRUPTED:
+        raise Error(_("Signature of package %s is not valid") % package)
+
+
+class HashingReader:
+    """File object wrapper hashing the data read through it."""
+
+    def __init__(self, fileobj):
+        self.fileobj = fileobj
+        self.sha1 = hashlib.sha1()
+
+    def read(self, size=-1):
+        data = self.fileobj.read(size)
+        self.sha1.update(data)
+        return data
+
+    def hexdigest(self):
+        """Read the rest of the file and return the SHA1 of all of it."""
+        while True:
+            data = self.read(blocksize)
+            if not data:
+                break
+        return self.sha1.hexdigest()
+
+    def __getattr__(self, name):
+        return getattr(self.fileobj, name)
+
+
+class PackageVerifier:
+    """Verifies the signature of a package (a zipfile.ZipFile) while it
+    is being read.
+
+    Members opened through wrap() are hashed as they are read; the rest
+    are read from the ZIP file when the manifest is built. Hashes of
+    members not read yet may be claimed, e.g. the install archive hash
+    recorded in metadata.xml, to verify the signature before extracting
+    anything; check_claims() compares them with the real hashes later."""
+
+    def __init__(self, zip_obj, trust_dir=None):
+        self.zip_obj = zip_obj
+        self.trust_dir = trust_dir
+        self.signature = parse_comment(zip_obj.comment)
+        self.readers = {}
+        self.claims = {}
+
+    def signed(self):
+        return self.signature is not None
+
+    def wrap(self, name, fileobj):
+        """Return a wrapper of fileobj, the opened member name, which
+        hashes the data read through it."""
+        reader = self.readers[name] = HashingReader(fileobj)
+        return reader
+
+    def read_hash(self, name):
+        """Return the real SHA1 of member name."""
+        if self.readers.has_key(name):
+            return self.readers[name].hexdigest()
+        sha1 = hashlib.sha1()
+        member = self.zip_obj.open(name)
+        try:
+            while True:
+                data = member.read(blocksize)
+                if not data:
+                    break
+                sha1.update(data)
+        finally:
+            member.close()
+        return sha1.hexdigest()
+
+    def member_hash(self, name):
+        if not self.readers.has_key(name) and self.claims.has_key(name):
+            return self.claims[name]
+        return self.read_hash(name)
+
+    def manifest(self):
+        return "\n".join(["%s %s" % (info.filename, self.member_hash(info.filename))
+                          for info in self.zip_obj.infolist()])
+
+    def verify(self, claims=None):
+        """Verify the signature, return a SIGN_* status."""
+        if not self.signed():
+            return SIGN_NO
+        self.claims = claims or {}
+        cert_data, signature = self.signature
+        return verify_manifest(self.manifest(), cert_data, signature, self.trust_dir)
+
+    def check_claims(self):
+        """Compare the claimed hashes with the hashes of the data read,
+        return SIGN_OK or SIGN_CORRUPTED."""
+        for name, claimed in self.claims.items():
+            if self.read_hash(name) != claimed:
+                return SIGN_CORRUPTED
+        return SIGN_OK
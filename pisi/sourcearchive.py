@@ -24,6 +24,7 @@ import pisi.archive
 import pisi.uri
 import pisi.fetcher
 import pisi.mirrors
+import pisi.hashcache
 
 class Error(pisi.Error):
     pass
@@ -63,7 +64,9 @@ class SourceArchive:
                 if self.url.get_uri().startswith("mirrors://"):
                     self.fetch_from_mirror()
                 else:
-                    pisi.fetcher.fetch_url(self.url, ctx.config.archives_dir(), self.progress, self.archive.name)
+                    pisi.fetcher.fetch_url(self.url, ctx.config.archives_dir(), self.progress,
+                                           self.archive.name, record_hash=True,
+                                           sha1sum=self.archive.sha1sum)
             except pisi.fetcher.FetchError:
                 if ctx.config.values.build.fallback:
                     self.fetch_from_fallback()
@@ -76,7 +79,8 @@ class SourceArchive:
         archive = os.path.basename(self.url.get_uri())
         src = os.path.join(ctx.config.values.build.fallback, archive)
         ctx.ui.warning(_('Trying fallback address: %s') % src)
-        pisi.fetcher.fetch_url(src, ctx.config.archives_dir(), self.progress)
+        pisi.fetcher.fetch_url(src, ctx.config.archives_dir(), self.progress, record_hash=True,
+                               sha1sum=self.archive.sha1sum)
 
     def fetch_from_mirror(self):
         uri = self.url.get_uri()
@@ -88,11 +92,14 @@ class SourceArchive:
         if not mirrors:
             raise Error(_("%s mirrors are not defined.") % name)
 
-        for mirror in mirrors:
+        # the other mirrors serve segments of big archives
+        urls = [os.path.join(mirror, archive) for mirror in mirrors]
+        for url in urls:
             try:
-                url = os.path.join(mirror, archive)
                 ctx.ui.warning(_('Fetching source from mirror: %s') % url)
-                pisi.fetcher.fetch_url(url, ctx.config.archives_dir(), self.progress)
+                pisi.fetcher.fetch_url(url, ctx.config.archives_dir(), self.progress, record_hash=True,
+                                       sha1sum=self.archive.sha1sum,
+                                       mirrors=[x for x in urls if x != url])
                 return
             except pisi.fetcher.FetchError:
                 pass
@@ -103,8 +110,9 @@ class SourceArchive:
         if not os.access(self.archiveFile, os.R_OK):
             return False
 
-        # check hash
-        if util.check_file_hash(self.archiveFile, self.archive.sha1sum):
+        # check hash, the verified hash memo saves us from reading big
+        # archives again and again
+        if pisi.hashcache.check_file_hash(self.archiveFile, self.archive.sha1sum):
             if interactive:
                 ctx.ui.info(_('%s [cached]') % self.archive.name)
             return True
@@ -114,7 +122,7 @@ class SourceArchive:
     def unpack(self, target_dir, clean_dir=True):
 
         # check archive file's integrity
-        if not util.check_file_hash(self.archiveFile, self.archive.sha1sum):
+        if not pisi.hashcache.check_file_hash(self.archiveFile, self.archive.sha1sum):
             raise Error, _("unpack: check_file_hash failed")
 
         try:
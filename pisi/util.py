@@ -17,6 +17,7 @@
 import os
 import re
 import sys
+import errno
 import fcntl
 import shutil
 import string
@@ -47,6 +48,7 @@ class Singleton(type):
 # pisi modules
 import pisi
 import pisi.context as ctx
+import pisi.profiler
 
 class Error(pisi.Error):
     pass
@@ -313,9 +315,14 @@ def check_file(_file, mode = os.F_OK):
     return True
 
 def ensure_dirs(path):
-    """Make sure the given directory path exists."""
+    """Make sure the given directory path exists. Another process may
+    create it at the same time."""
     if not os.path.exists(path):
-        os.makedirs(path)
+        try:
+            os.makedirs(path)
+        except OSError, e:
+            if e.errno != errno.EEXIST or not os.path.isdir(path):
+                raise
 
 def clean_dir(path):
     """Remove all content of a directory."""
@@ -455,6 +462,7 @@ def check_file_hash(filename, hash):
     """Check the file's integrity with a given hash."""
     return sha1_file(filename) == hash
 
+@pisi.profiler.profiled("hash.sha1")
 def sha1_file(filename):
     """Calculate sha1 hash of file."""
     # Broken links can cause problem!
@@ -640,6 +648,25 @@ def strip_file(filepath, fileinfo, outpath):
 
     return False
 
+def sync_filesystem(path):
+    """Flush the filesystem containing path to disk. All filesystems are
+    flushed if syncfs(2) is not available."""
+    try:
+        import ctypes
+        syncfs = ctypes.CDLL(None).syncfs
+    except (ImportError, OSError, AttributeError):
+        syncfs = None
+
+    if syncfs is not None:
+        fd = os.open(path, os.O_RDONLY)
+        try:
+            if syncfs(fd) == 0:
+                return
+        finally:
+            os.close(fd)
+
+    run_batch("sync")
+
 def partition_freespace(directory):
     """Return free space of given directory's partition."""
     st = os.statvfs(directory)
@@ -14,37 +14,31 @@ import os
 import glob
 import pisi
 import pisi.util as util
-from pisi.version import Version
-from pisi.delta import create_delta_package
+from pisi.operations.delta import create_delta_packages
 
-def minsandmaxes():
+def packages_by_name():
+    """Return {name: [(release, package file)]} of the packages in the
+    current directory."""
 
-    packages = map(lambda x: os.path.basename(x).split(".pisi")[0], set(glob.glob("*.pisi")) - set(glob.glob("*.delta.pisi")))
+    packages = set(glob.glob("*.pisi")) - set(glob.glob("*.delta.pisi"))
 
-    versions = {}
-    for file in packages:
-        name, version = util.parse_package_name(file)
-        versions.setdefault(name, []).append(Version(version))
+    releases = {}
+    for package in packages:
+        name, version, release, distro_id, arch = util.split_package_filename(package)
+        releases.setdefault(name, []).append((int(release), package))
 
-    mins = {}
-    maxs = {}
-    for pkg in versions.keys():
-        mins[pkg] = min(versions[pkg])
-        maxs[pkg] = max(versions[pkg])
-
-    return mins, maxs
+    return releases
 
 if __name__ == "__main__":
 
-    mi, ma = minsandmaxes()
-    for pkg in mi.keys():
-        old_pkg = "%s-%s.pisi" % (pkg, str(mi[pkg]))
-        new_pkg = "%s-%s.pisi" % (pkg, str(ma[pkg]))
-        name, version = util.parse_package_name(pkg)
-
-        if not old_pkg == new_pkg:
-        # skip if same 
-            if not os.path.exists("%s-%s-%s.delta.pisi" % (name, str(mi[pkg].build), str(ma[pkg].build))):
-            # skip if delta exists
-                print "%s --> Min: %s Max: %s \n %s-%s-%s.delta.pisi" % (pkg, old_pkg, new_pkg, name, str(mi[pkg].build), str(ma[pkg].build))
-                create_delta_package(old_pkg, new_pkg)
+    for name, packages in sorted(packages_by_name().items()):
+        packages.sort()
+        new_pkg = packages[-1][1]
+        # skip the ones which already have a delta
+        old_pkgs = [package for release, package in packages[:-1]
+                    if not glob.glob("%s-%s-%s-*.delta.pisi" % (name, release, packages[-1][0]))]
+
+        if old_pkgs:
+            print "%s --> %s\n %s" % (name, new_pkg, " ".join(old_pkgs))
+            # the new package is unpacked once for all of the old ones
+            create_delta_packages(old_pkgs, new_pkg)
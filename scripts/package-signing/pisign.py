@@ -9,6 +9,7 @@ import base64
 import getpass
 import os
 import hashlib
+import multiprocessing
 import shlex
 import subprocess
 import sys
@@ -32,12 +33,16 @@ CERT_OK, CERT_SELF, CERT_CORRUPTED = range(3)
 # Certificate trustworthiness
 CERT_TRUSTED, CERT_UNTRUSTED = range(2)
 
+# Size of the blocks files and ZIP members are hashed in
+BLOCK_SIZE = 256 * 1024
+
 def sign_data(data, key_file, password_fd):
     """
         Signs data with given key.
 
         Arguments:
-            data: Data to be signed
+            data: Data to be signed, or an open file to sign the
+                  contents of
             key_file: Private key
             password_fd: File that contains passphrase
         Returns:
@@ -51,14 +56,17 @@ def sign_data(data, key_file, password_fd):
     command = command % (key_file, password_fd.fileno())
     command = shlex.split(command)
 
-    pipe = subprocess.Popen(command, stdin=subprocess.PIPE,
-                                     stdout=subprocess.PIPE,
-                                     stderr=subprocess.PIPE)
-    pipe.stdin.write(data)
-    pipe.stdin.close()
-
-    # Get signed data
-    signed_binary = pipe.stdout.read()
+    if isinstance(data, file):
+        # openssl reads the file itself
+        pipe = subprocess.Popen(command, stdin=data,
+                                         stdout=subprocess.PIPE,
+                                         stderr=subprocess.PIPE)
+        signed_binary, error = pipe.communicate()
+    else:
+        pipe = subprocess.Popen(command, stdin=subprocess.PIPE,
+                                         stdout=subprocess.PIPE,
+                                         stderr=subprocess.PIPE)
+        signed_binary, error = pipe.communicate(data)
 
     return signed_binary
 
@@ -147,21 +155,20 @@ def verify_certificate(cert_file):
     command = command % cert_file
     command = shlex.split(command)
 
+    # Newer OpenSSL versions write the errors to stderr
     pipe = subprocess.Popen(command, stdout=subprocess.PIPE,
-                                     stderr=subprocess.PIPE)
-    lines = pipe.stdout.read().split('\n')
-    if len(lines) < 2:
-        return CERT_CORRUPTED
-    elif lines[1].startswith("error"):
-        code = lines[1].split()[1]
-        if code == '18':
-            return CERT_SELF
-        else:
-            return CERT_CORRUPTED
-    else:
+                                     stderr=subprocess.STDOUT)
+    output = pipe.communicate()[0]
+    if pipe.returncode == 0:
         return CERT_OK
+    for line in output.split('\n'):
+        fields = line.split()
+        if len(fields) > 1 and fields[0] == 'error' and fields[1] == '18':
+            return CERT_SELF
+    return CERT_CORRUPTED
 
-def verify_file(data_file, cert_file=None, signature_file=None, trust_dir=None):
+def verify_file(data_file, cert_file=None, signature_file=None, trust_dir=None,
+                data=None):
     """
         Verifies signature of file signed with given certificate.
 
@@ -172,15 +179,17 @@ def verify_file(data_file, cert_file=None, signature_file=None, trust_dir=None):
         be used.
 
         Arguments:
-            data_file: Original data file
+            data_file: Original data file (or None if data is given)
             cert_file: Certificate (or None)
             signature_file: Signature file (or None)
             trust_dir: Path to trust database.
+            data: Original data, used instead of data_file
         Returns:
             SIGN_OK, SIGN_NO, SIGN_SELF or SIGN_CORRUPTED
     """
-    # Sanitize before appending signature extension
-    data_file = os.path.realpath(data_file)
+    if data_file:
+        # Sanitize before appending signature extension
+        data_file = os.path.realpath(data_file)
 
     if not signature_file:
         signature_file = data_file + '.' + EXT_SIGN
@@ -203,14 +212,24 @@ def verify_file(data_file, cert_file=None, signature_file=None, trust_dir=None):
     pub_file.write(get_public_key(cert_file))
     pub_file.flush()
 
-    # Use OpenSSL to verify signature
-    command = '/usr/bin/openssl dgst -sha1 -verify %s -signature %s %s'
-    command = command % (pub_file.name, signature_file, data_file)
+    # Use OpenSSL to verify signature, the data is read from stdin
+    command = '/usr/bin/openssl dgst -sha1 -verify %s -signature %s'
+    command = command % (pub_file.name, signature_file)
     command = shlex.split(command)
 
-    pipe = subprocess.Popen(command, stdout=subprocess.PIPE,
-                                     stderr=subprocess.PIPE)
-    result = pipe.wait()
+    if data is None:
+        data_fd = file(data_file)
+        pipe = subprocess.Popen(command, stdin=data_fd,
+                                         stdout=subprocess.PIPE,
+                                         stderr=subprocess.PIPE)
+        pipe.communicate()
+        data_fd.close()
+    else:
+        pipe = subprocess.Popen(command, stdin=subprocess.PIPE,
+                                         stdout=subprocess.PIPE,
+                                         stderr=subprocess.PIPE)
+        pipe.communicate(data)
+    result = pipe.returncode
 
     # Destroy temporary files
     pub_file.close()
@@ -257,18 +276,12 @@ def verify_data(data, signature_data, trust_dir):
     signature_file.write(signature_binary)
     signature_file.flush()
 
-    # Keep data in a temporary file
-    data_file = tempfile.NamedTemporaryFile()
-    data_file.write(data)
-    data_file.flush()
-
     # Verify
-    result = verify_file(data_file.name, cert_file.name, signature_file.name, trust_dir)
+    result = verify_file(None, cert_file.name, signature_file.name, trust_dir, data)
 
     # Destroy temporary files
     cert_file.close()
     signature_file.close()
-    data_file.close()
 
     return result
 
@@ -289,9 +302,16 @@ def get_zip_hashes(zip_obj):
     hashes = []
 
     for info in zip_obj.infolist():
-        content = zip_obj.read(info.filename)
-        content_hash = hashlib.sha1(content).hexdigest()
-        hashes.append('%s %s' % (info.filename, content_hash))
+        # Members may be several GB, hash them block by block
+        content_hash = hashlib.sha1()
+        member = zip_obj.open(info.filename)
+        while True:
+            block = member.read(BLOCK_SIZE)
+            if not block:
+                break
+            content_hash.update(block)
+        member.close()
+        hashes.append('%s %s' % (info.filename, content_hash.hexdigest()))
 
     return "\n".join(hashes)
 
@@ -309,7 +329,7 @@ def verify_zipfile(filename, trust_dir=None):
     try:
         zip_obj = zipfile.ZipFile(filename)
     except (IOError, zipfile.BadZipfile):
-        return False
+        return SIGN_CORRUPTED
 
     # Get ZIP hashes
     hashes = get_zip_hashes(zip_obj)
@@ -333,8 +353,9 @@ def sign_file(filename, key_file, cert_file, password_fd):
             cert_file: Certificate
             password_fd: File that contains passphrase
     """
-    data = file(filename).read()
-    signed_binary = sign_data(data, key_file, password_fd)
+    data_fd = file(filename)
+    signed_binary = sign_data(data_fd, key_file, password_fd)
+    data_fd.close()
     cert_data = file(cert_file).read()
 
     # Save certificate
@@ -371,6 +392,75 @@ def sign_zipfile(filename, key_file, cert_file, password_fd):
     zip_obj._didModify = True
     zip_obj.close()
 
+def find_files(directory):
+    """
+        Finds ZIP files in a repository directory.
+
+        Arguments:
+            directory: Repository directory
+        Returns:
+            Sorted list of ZIP file paths
+    """
+    files = []
+    for root, dirs, filenames in os.walk(directory):
+        for filename in filenames:
+            if filename.endswith(ZIP_FILES):
+                files.append(os.path.join(root, filename))
+    return sorted(files)
+
+# Passphrase file of a worker process. Workers can not share one file,
+# each openssl call rewinds it.
+worker_password_fd = None
+
+def init_sign_worker(password):
+    """
+        Initializes a worker process of sign-repo.
+    """
+    global worker_password_fd
+    worker_password_fd = os.tmpfile()
+    worker_password_fd.write(password)
+    worker_password_fd.flush()
+
+def sign_worker(args):
+    """
+        Signs a ZIP file in a worker process.
+
+        Arguments:
+            args: (filename, key_file, cert_file)
+        Returns:
+            filename
+    """
+    filename, key_file, cert_file = args
+    sign_zipfile(filename, key_file, cert_file, worker_password_fd)
+    return filename
+
+def verify_worker(args):
+    """
+        Verifies a ZIP file in a worker process.
+
+        Arguments:
+            args: (filename, trust_dir)
+        Returns:
+            (filename, result)
+    """
+    filename, trust_dir = args
+    return filename, verify_zipfile(filename, trust_dir)
+
+def print_result(filename, result):
+    """
+        Prints verification result of a file.
+    """
+    if result == SIGN_OK:
+        print "%s is signed by a trusted source." % filename
+    elif result == SIGN_NO:
+        print "%s is unsigned." % filename
+    elif result == SIGN_SELF:
+        print "%s is self-signed by a trusted source." % filename
+    elif result == SIGN_UNTRUSTED:
+        print "%s is signed by an untrusted source." % filename
+    else:
+        print "%s is corrupted." % filename
+
 def print_usage():
     """
         Prints usage information of application and exits.
@@ -379,8 +469,22 @@ def print_usage():
     print "Usage:"
     print "  %s sign <priv_key> <cert> <file1 ...>" % sys.argv[0]
     print "  %s verify <trust_dir> <file1 ...>" % sys.argv[0]
+    print "  %s sign-repo <priv_key> <cert> <repo_dir> [jobs]" % sys.argv[0]
+    print "  %s verify-repo <trust_dir> <repo_dir> [jobs]" % sys.argv[0]
     sys.exit(1)
 
+def get_jobs(index):
+    """
+        Returns number of worker processes given at sys.argv[index],
+        number of CPUs by default.
+    """
+    try:
+        return max(1, int(sys.argv[index]))
+    except IndexError:
+        return multiprocessing.cpu_count()
+    except ValueError:
+        print_usage()
+
 def main():
     """
         Main
@@ -428,20 +532,53 @@ def main():
                 if filename.endswith(ZIP_FILES):
                     result = verify_zipfile(filename, trust_dir)
                 else:
-                    result = verify_file(filename, trust_dir)
-                if result == SIGN_OK:
-                    print "%s is signed by a trusted source." % filename
-                elif result == SIGN_NO:
-                    print "%s is unsigned." % filename
-                elif result == SIGN_SELF:
-                    print "%s is self-signed by a trusted source." % filename
-                elif result == SIGN_UNTRUSTED:
-                    print "%s is signed by an untrusted source." % filename
-                else:
-                    print "%s is corrupted." % filename
+                    result = verify_file(filename, trust_dir=trust_dir)
+                print_result(filename, result)
         else:
             print_usage()
 
+    elif operation == 'sign-repo':
+        try:
+            key_file = sys.argv[2]
+            cert_file = sys.argv[3]
+            repo_dir = sys.argv[4]
+        except IndexError:
+            print_usage()
+
+        jobs = get_jobs(5)
+        password = getpass.getpass()
+
+        pool = multiprocessing.Pool(jobs, init_sign_worker, (password,))
+        try:
+            args = [(filename, key_file, cert_file) for filename in find_files(repo_dir)]
+            for filename in pool.imap_unordered(sign_worker, args):
+                print "Signed %s with %s" % (filename, key_file)
+        finally:
+            pool.terminate()
+
+    elif operation == 'verify-repo':
+        try:
+            trust_dir = sys.argv[2]
+            repo_dir = sys.argv[3]
+        except IndexError:
+            print_usage()
+
+        jobs = get_jobs(4)
+        failed = 0
+
+        pool = multiprocessing.Pool(jobs)
+        try:
+            args = [(filename, trust_dir) for filename in find_files(repo_dir)]
+            for filename, result in pool.imap_unordered(verify_worker, args):
+                print_result(filename, result)
+                if result not in (SIGN_OK, SIGN_SELF):
+                    failed += 1
+        finally:
+            pool.terminate()
+
+        if failed:
+            return 1
+
     else:
         print_usage()
 
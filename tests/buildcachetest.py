@@ -0,0 +1,95 @@
+import unittest
+import os
+import shutil
+import tempfile
+
+import pisi.context as ctx
+import pisi.uri
+import pisi.util as util
+import pisi.operations.buildcache as buildcache
+
+class Struct:
+    def __init__(self, **kwargs):
+        self.__dict__.update(kwargs)
+
+class InstallDB:
+    def __init__(self, packages):
+        self.packages = packages
+
+    def has_package(self, name):
+        return self.packages.has_key(name)
+
+    def get_version(self, name):
+        version, release = self.packages[name]
+        return version, release, None
+
+class Builder:
+    def __init__(self, specdir, installed):
+        self.specdir = specdir
+        self.specuri = pisi.uri.URI(os.path.join(specdir, ctx.const.pspec_file))
+        self.spec_sha1sum = util.sha1_file(self.specuri.get_uri())
+        dep = Struct(package="gcc")
+        self.spec = Struct(source=Struct(patches=[], additionalFiles=[],
+                                         buildDependencies=[dep]),
+                           packages=[Struct(additionalFiles=[], providesComar=[],
+                                            buildDependencies=[])])
+        self.installdb = InstallDB(installed)
+        self.new_packages = []
+        self.new_debug_packages = []
+        self.delta_map = {}
+        self.rebuilt_deltas = []
+
+    def rebuild_delta_packages(self, filename):
+        self.rebuilt_deltas.append(filename)
+        return [filename + ".delta"]
+
+class BuildCacheTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        self.specdir = os.path.join(self.dir, "spec")
+        os.mkdir(self.specdir)
+        open(os.path.join(self.specdir, ctx.const.pspec_file), "w").write("<PISI/>")
+        open(os.path.join(self.specdir, ctx.const.actions_file), "w").write("")
+        self.output_dir = os.path.join(self.dir, "output")
+        os.mkdir(self.output_dir)
+        ctx.config.options.output_dir = self.output_dir
+        self.cache = buildcache.BuildCache(os.path.join(self.dir, "cache"))
+
+    def tearDown(self):
+        del ctx.config.options.output_dir
+        shutil.rmtree(self.dir)
+
+    def testKey(self):
+        builder = Builder(self.specdir, {"gcc": ("4.5.2", "10")})
+        key = self.cache.key(builder)
+        self.assertEqual(key, self.cache.key(Builder(self.specdir, {"gcc": ("4.5.2", "10")})))
+        self.assertNotEqual(key, self.cache.key(Builder(self.specdir, {"gcc": ("4.5.2", "11")})))
+        self.assertNotEqual(key, self.cache.key(Builder(self.specdir, {})))
+
+        # the spec text parsed by the builder is used, not the file
+        open(os.path.join(self.specdir, ctx.const.pspec_file), "w").write("<PISI></PISI>")
+        self.assertEqual(key, self.cache.key(builder))
+
+    def testStoreRestore(self):
+        builder = Builder(self.specdir, {"gcc": ("4.5.2", "10")})
+        key = self.cache.key(builder)
+        assert not self.cache.restore(key, builder)
+
+        package = os.path.join(self.dir, "foo-1.0-1-p11-x86_64.pisi")
+        open(package, "w").write("foo")
+        delta = os.path.join(self.dir, "foo-0.9-1-1-p11-x86_64.delta.pisi")
+        open(delta, "w").write("delta")
+        builder.new_packages = [package]
+        builder.delta_map = {package: [delta]}
+        self.cache.store(key, builder)
+
+        # deltas depend on the old packages, they are built again
+        builder = Builder(self.specdir, {"gcc": ("4.5.2", "10")})
+        assert self.cache.restore(self.cache.key(builder), builder)
+        restored = os.path.join(self.output_dir, os.path.basename(package))
+        self.assertEqual(builder.new_packages, [restored])
+        self.assertEqual(open(restored).read(), "foo")
+        self.assertEqual(builder.rebuilt_deltas, [restored])
+        self.assertEqual(builder.delta_map, {restored: [restored + ".delta"]})
+        assert not os.path.exists(os.path.join(self.output_dir, os.path.basename(delta)))
@@ -0,0 +1,119 @@
+import unittest
+import os
+import shutil
+import tempfile
+import time
+
+import comarstub
+import pisi.context as ctx
+
+class Script:
+    def __init__(self, om, name=None, script="package.py"):
+        self.om = om
+        self.name = name
+        self.script = script
+
+class ComarIfaceTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.daemon = comarstub.install()
+        import pisi.comariface
+        self.comariface = pisi.comariface
+
+        self.dir = tempfile.mkdtemp()
+        self.metapath = os.path.join(self.dir, "metadata.xml")
+        self.filepath = os.path.join(self.dir, "files.xml")
+        open(self.metapath, "w").write("<PISI/>")
+        open(self.filepath, "w").write("<Files/>")
+
+    def tearDown(self):
+        ctx.comar_updated = False
+        ctx.comar_transaction = 0
+        ctx.comar_triggers = None
+        self.comariface.reset_link()
+        shutil.rmtree(self.dir)
+
+    def post_install(self, name, scripts=[]):
+        self.comariface.post_install(name, scripts, self.dir,
+                                     self.metapath, self.filepath,
+                                     None, None, "1.0", "1")
+
+    def testLinkReuse(self):
+        link = self.comariface.get_link()
+        assert self.comariface.get_link() is link
+        self.assertEqual(self.daemon.links, 1)
+
+        ctx.comar_updated = True
+        assert self.comariface.get_link() is not link
+        self.assertEqual(self.daemon.links, 2)
+
+    def testLinkPerThread(self):
+        link = self.comariface.get_link()
+        links = []
+        def call():
+            links.append(self.comariface.get_link())
+            time.sleep(0.01)
+        self.comariface.dispatch([call] * 4, 2)
+        self.assertEqual(len(set(links)), 2)
+        assert link not in links
+
+        # links of finished threads are reused
+        self.comariface.dispatch([call] * 4, 2)
+        self.assertEqual(len(set(links)), 2)
+        self.assertEqual(self.daemon.links, 3)
+
+    def testLinkError(self):
+        def restarted(*args):
+            raise comarstub.DBusException("disconnected",
+                                          "org.freedesktop.DBus.Error.Disconnected")
+        self.daemon.add_script("System.Package", "foo", postInstall=restarted)
+        link = self.comariface.get_link()
+        self.assertRaises(self.comariface.Error, self.post_install, "foo",
+                          [Script("System.Package")])
+        assert self.comariface.get_link() is not link
+
+    def testRegistrations(self):
+        self.daemon.latency = 0.01
+        scripts = [Script("System.Package"),
+                   Script("System.Service", "foo-a"),
+                   Script("System.Service", "foo-b"),
+                   Script("Network.Link", "foo-c")]
+        self.post_install("foo", scripts)
+
+        registered = [call[1] for call in self.daemon.calls_of("register")]
+        self.assertEqual(sorted(registered), ["foo", "foo_a", "foo_b", "foo_c"])
+        self.assertEqual(len(self.daemon.calls_of("registerState")), 2)
+        assert self.daemon.max_in_flight > 1
+
+        self.comariface.post_remove("foo", self.metapath, self.filepath, scripts)
+        removed = [call[1] for call in self.daemon.calls_of("remove")]
+        self.assertEqual(sorted(removed), ["foo", "foo_a", "foo_b", "foo_c"])
+
+    def testHandlerBatching(self):
+        self.daemon.add_script("System.PackageHandler", "ldconfig",
+                               setupPackage=None, setupPackages=None,
+                               acceptsBatchCalls=lambda: True)
+        self.daemon.add_script("System.PackageHandler", "mime",
+                               setupPackage=None)
+        # batch methods are not used without the capability
+        self.daemon.add_script("System.PackageHandler", "icons",
+                               setupPackage=None, setupPackages=None)
+
+        ctx.comar_transaction = 1
+        self.post_install("foo")
+        self.post_install("bar")
+
+        setup = [call[1] for call in self.daemon.calls_of("setupPackage")]
+        self.assertEqual(setup, ["icons", "mime", "icons", "mime"])
+        # asked once per handler
+        self.assertEqual(sorted([call[1] for call in self.daemon.calls_of("acceptsBatchCalls")]),
+                         ["icons", "ldconfig", "mime"])
+
+        ctx.comar_transaction = 0
+        self.comariface.flush_triggers()
+
+        # nothing is called to find out if a handler accepts batches
+        batches = self.daemon.calls_of("setupPackages")
+        self.assertEqual(len(batches), 1)
+        self.assertEqual(batches[0][1], "ldconfig")
+        self.assertEqual(batches[0][3][0], [self.metapath, self.metapath])
@@ -0,0 +1,182 @@
+# -*- coding: utf-8 -*-
+#
+# Copyright (C) 2011, TUBITAK/UEKAE
+#
+# This program is free software; you can redistribute it and/or modify it under
+# the terms of the GNU General Public License as published by the Free
+# Software Foundation; either version 2 of the License, or (at your option)
+# any later version.
+#
+# Please read the COPYING file.
+
+"""Stand-in for the comar and dbus modules.
+
+pisi.comariface talks to the COMAR daemon over D-Bus. This module
+replaces comar.Link with a local link to a fake daemon, which records
+every call and may add a fixed latency to each of them, so the COMAR
+code paths can be tested and benchmarked without a running daemon:
+
+    import comarstub
+    daemon = comarstub.install(latency=0.005)
+    daemon.add_script("System.PackageHandler", "ldconfig", setupPackage=None)
+
+    import pisi.comariface
+    ...
+    print daemon.calls
+"""
+
+import sys
+import time
+import types
+import threading
+
+MISSING = "tr.org.pardus.comar.Missing"
+
+# methods provided by COMAR itself for the scripts of a model
+builtin_methods = {"System.Service": {"registerState": None}}
+
+
+class DBusException(Exception):
+    def __init__(self, message="", name=None):
+        Exception.__init__(self, message)
+        self._dbus_error_name = name
+
+
+class Daemon:
+    """Registered scripts and the calls made through the links."""
+
+    def __init__(self, latency=0.0):
+        self.latency = latency
+        # model -> {script -> {method -> function or None}}
+        self.scripts = {}
+        # (model, script, method, args)
+        self.calls = []
+        self.links = 0
+        self.in_flight = 0
+        self.max_in_flight = 0
+        self.lock = threading.Lock()
+
+    def add_script(self, model, name, **methods):
+        self.scripts.setdefault(model, {})[name] = methods
+
+    def remove_script(self, name):
+        for scripts in self.scripts.values():
+            scripts.pop(name, None)
+
+    def calls_of(self, method):
+        return [call for call in self.calls if call[2] == method]
+
+    def call(self, model, script, method, args, check=True):
+        self.lock.acquire()
+        self.calls.append((model, script, method, args))
+        self.in_flight += 1
+        self.max_in_flight = max(self.max_in_flight, self.in_flight)
+        self.lock.release()
+
+        try:
+            if self.latency:
+                time.sleep(self.latency)
+
+            if not check:
+                return None
+
+            methods = self.scripts.get(model, {}).get(script)
+            if methods is None or not methods.has_key(method):
+                raise DBusException("%s.%s.%s is missing" % (model, script, method),
+                                    MISSING)
+            if methods[method]:
+                return methods[method](*args)
+        finally:
+            self.lock.acquire()
+            self.in_flight -= 1
+            self.lock.release()
+
+daemon = Daemon()
+
+
+class Method:
+    def __init__(self, model, script, name):
+        self.model = model
+        self.script = script
+        self.name = name
+
+    def __call__(self, *args, **kwargs):
+        return daemon.call(self.model, self.script, self.name, args)
+
+
+class Object:
+    def __init__(self, model, script):
+        self.model = model
+        self.script = script
+
+    def __getattr__(self, name):
+        if name.startswith("__"):
+            raise AttributeError(name)
+        return Method(self.model, self.script, name)
+
+
+class Model:
+    def __init__(self, name):
+        self.name = name
+
+    def __iter__(self):
+        return iter(sorted(daemon.scripts.get(self.name, {})))
+
+    def __getitem__(self, script):
+        return Object(self.name, script)
+
+
+class Group:
+    def __init__(self, name):
+        self.name = name
+
+    def __getattr__(self, name):
+        if name.startswith("__"):
+            raise AttributeError(name)
+        return Model("%s.%s" % (self.name, name))
+
+
+class Link:
+    def __init__(self, socket=None, alternate=False):
+        self.socket = socket
+        self.alternate = alternate
+        daemon.links += 1
+
+    def setLocale(self):
+        daemon.call("Link", None, "setLocale", (), check=False)
+
+    def register(self, script, model, path, timeout=None):
+        daemon.call("Link", script, "register", (model, path), check=False)
+        daemon.scripts.setdefault(model, {}).setdefault(script,
+                                                        dict(builtin_methods.get(model, {})))
+
+    def remove(self, script, timeout=None):
+        daemon.call("Link", script, "remove", (), check=False)
+        daemon.remove_script(script)
+
+    def __getattr__(self, name):
+        if name.startswith("__"):
+            raise AttributeError(name)
+        return Group(name)
+
+
+def install(latency=0.0):
+    """Replace the comar and dbus modules with the stubs and return the
+    new fake daemon."""
+    global daemon
+    daemon = Daemon(latency)
+
+    comar = types.ModuleType("comar")
+    comar.Link = Link
+    dbus = types.ModuleType("dbus")
+    dbus.DBusException = DBusException
+    sys.modules["comar"] = comar
+    sys.modules["dbus"] = dbus
+
+    comariface = sys.modules.get("pisi.comariface")
+    if comariface:
+        comariface.comar = comar
+        comariface.dbus = dbus
+        comariface.reset_link()
+
+    return daemon
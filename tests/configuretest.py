@@ -0,0 +1,138 @@
+import unittest
+import threading
+import time
+
+import comarstub
+import pisi.graph
+import pisi.ui
+import pisi.context as ctx
+
+class InstallDB:
+    def __init__(self):
+        self.cleared = []
+
+    def clear_pending(self, package):
+        self.cleared.append(package)
+
+class Struct:
+    def __init__(self, **kwargs):
+        self.__dict__.update(kwargs)
+
+class Store:
+    def get_metadata(self, name):
+        script = Struct(om="System.Package", name=None, script="package.py")
+        return Struct(package=Struct(name=name, version="1.0", release="1",
+                                     providesComar=[script]))
+
+class PendingDB(InstallDB):
+    def package_path(self, name):
+        return "/var/lib/pisi/package/%s-1.0-1" % name
+
+class UI(pisi.ui.UI):
+    """Fails if it is called by several threads at once."""
+
+    def __init__(self):
+        pisi.ui.UI.__init__(self)
+        self.in_call = False
+        self.overlapped = False
+        self.messages = []
+
+    def call(self, msg):
+        if self.in_call:
+            self.overlapped = True
+        self.in_call = True
+        time.sleep(0.005)
+        self.messages.append(msg)
+        self.in_call = False
+
+    def info(self, msg, verbose=False, noln=False):
+        self.call(msg)
+
+    def notify(self, event, **keywords):
+        self.call(event)
+
+class ConfigureTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.daemon = comarstub.install(latency=0.005)
+        import pisi.comariface
+        import pisi.operations.configure
+        self.comariface = pisi.comariface
+        self.configure = pisi.operations.configure
+        self.configure_package = self.configure.configure_package
+
+        # a and c depend on b, d depends on a
+        self.g = pisi.graph.Digraph()
+        for x in "abcde":
+            self.g.add_vertex(x)
+        self.g.add_edge("a", "b")
+        self.g.add_edge("c", "b")
+        self.g.add_edge("d", "a")
+
+        order, levels = self.g.topological_levels()
+        levels.reverse()
+        self.levels = levels
+
+        self.configured = []
+        self.in_flight = 0
+        self.max_in_flight = 0
+        self.lock = threading.Lock()
+
+    def tearDown(self):
+        self.configure.configure_package = self.configure_package
+        self.comariface.reset_link()
+
+    def fake_configure(self, fail=()):
+        def configure_package(name, store, installdb):
+            self.lock.acquire()
+            self.in_flight += 1
+            self.max_in_flight = max(self.max_in_flight, self.in_flight)
+            self.lock.release()
+            time.sleep(0.01)
+            self.lock.acquire()
+            self.in_flight -= 1
+            self.configured.append(name)
+            self.lock.release()
+            if name in fail:
+                raise Exception("%s failed" % name)
+        self.configure.configure_package = configure_package
+
+    def testLevels(self):
+        self.fake_configure()
+        installdb = InstallDB()
+        failed = self.configure.configure_levels(self.g, self.levels, None, installdb, 4)
+
+        self.assertEqual(failed, {})
+        self.assertEqual(sorted(installdb.cleared), list("abcde"))
+        for dep, package in (("b", "a"), ("b", "c"), ("a", "d")):
+            assert self.configured.index(dep) < self.configured.index(package)
+        assert self.max_in_flight > 1
+
+    def testFailure(self):
+        self.fake_configure(fail=("a",))
+        installdb = InstallDB()
+        failed = self.configure.configure_levels(self.g, self.levels, None, installdb, 4)
+
+        self.assertEqual(sorted(failed), ["a", "d"])
+        self.assertEqual(sorted(installdb.cleared), ["b", "c", "e"])
+        assert "d" not in self.configured
+
+    def testComarCalls(self):
+        # the packages of a level are configured through COMAR at once
+        installdb = PendingDB()
+        saved, user_interface = ctx.ui, UI()
+        ctx.ui = user_interface
+        try:
+            failed = self.configure.configure_levels(self.g, self.levels, Store(),
+                                                     installdb, 4)
+        finally:
+            ctx.ui = saved
+
+        self.assertEqual(failed, {})
+        self.assertEqual(sorted(installdb.cleared), list("abcde"))
+        registered = [call[1] for call in self.daemon.calls_of("register")]
+        self.assertEqual(sorted(registered), list("abcde"))
+        assert self.daemon.max_in_flight > 1
+        assert not user_interface.overlapped
+        self.assertEqual(len([x for x in user_interface.messages
+                              if x == pisi.ui.configured]), 5)
@@ -0,0 +1,45 @@
+# -*- coding: utf-8 -*-
+#
+# Copyright (C) 2011, TUBITAK/UEKAE
+#
+# This program is free software; you can redistribute it and/or modify it under
+# the terms of the GNU General Public License as published by the Free
+# Software Foundation; either version 2 of the License, or (at your option)
+# any later version.
+#
+# Please read the COPYING file.
+#
+
+import testcase
+import pisi
+import pisi.context as ctx
+import pisi.db.filesldb
+
+class FilesLDBTestCase(testcase.TestCase):
+
+    def setUp(self):
+        testcase.TestCase.setUp(self)
+        # leveldb allows one open handle per database
+        if not ctx.filesdb:
+            ctx.filesdb = pisi.db.filesldb.FilesLDB()
+        self.filesdb = ctx.filesdb
+
+    def files(self, *paths):
+        files = pisi.files.Files()
+        for path in paths:
+            fileinfo = pisi.files.FileInfo()
+            fileinfo.path = path
+            files.list.append(fileinfo)
+        return files
+
+    def testAddPackagesFiles(self):
+        pisi_files = self.files("etc/pisi/pisi.conf", "etc/pisi/mirrors.conf")
+        bash_files = self.files("bin/bash")
+        self.filesdb.add_packages_files([("pisi", pisi_files), ("bash", bash_files)])
+
+        assert self.filesdb.get_file("etc/pisi/pisi.conf") == ("pisi", "etc/pisi/pisi.conf")
+        assert self.filesdb.get_owners(["etc/pisi/mirrors.conf", "bin/bash", "bin/sh"]) == \
+                {"etc/pisi/mirrors.conf": "pisi", "bin/bash": "bash", "bin/sh": None}
+
+        self.filesdb.remove_files(pisi_files.list + bash_files.list)
+        assert self.filesdb.get_file("bin/bash") == (None, "bin/bash")
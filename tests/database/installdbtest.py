@@ -51,6 +51,19 @@ class InstallDBTestCase(testcase.TestCase):
         assert release == "1"
         assert build == None
 
+    def testGetUpgradeInfo(self):
+        pisi.api.install(["ethtool"])
+        self.installdb = pisi.db.installdb.InstallDB()
+        pkg = self.installdb.get_package("ethtool")
+        info = (pkg.name, pkg.release, pkg.distribution,
+                pkg.distributionRelease, pkg.installTarHash)
+        assert self.installdb.get_upgrade_info("ethtool") == info
+        assert info in self.installdb.get_upgrade_table()
+
+        pisi.api.remove(["ethtool"])
+        self.installdb = pisi.db.installdb.InstallDB()
+        assert "ethtool" not in self.installdb.distro_db
+
     def testGetFiles(self):
         pisi.api.install(["ethtool"])
         self.installdb = pisi.db.installdb.InstallDB()
@@ -71,6 +84,15 @@ class InstallDBTestCase(testcase.TestCase):
         revdeps = self.installdb.get_rev_deps("openssl")
         assert set(["ctorrent", "curl"]) == set(map(lambda x:x[0], revdeps))
 
+    def testReverseDependenciesAfterRemove(self):
+        pisi.api.install(["ethtool"])
+        pisi.api.install(["ctorrent"])
+        pisi.api.remove(["ctorrent"])
+        self.installdb = pisi.db.installdb.InstallDB()
+        revdeps = self.installdb.get_rev_deps("openssl")
+        assert ["curl"] == map(lambda x:x[0], revdeps)
+        assert not self.installdb.has_rev_deps("ctorrent")
+
     def testAddRemovePackage(self):
         pisi.api.install(["ctorrent"])
         self.installdb = pisi.db.installdb.InstallDB()
@@ -0,0 +1,54 @@
+# -*- coding: utf-8 -*-
+#
+# Copyright (C) 2011, TUBITAK/UEKAE
+#
+# This program is free software; you can redistribute it and/or modify it under
+# the terms of the GNU General Public License as published by the Free
+# Software Foundation; either version 2 of the License, or (at your option)
+# any later version.
+#
+# Please read the COPYING file.
+#
+
+import unittest
+import pisi.db.objectcache as objectcache
+
+class ObjectCacheTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.decoded = []
+
+    def decode(self, name):
+        self.decoded.append(name)
+        return {"name": name, "packages": [name]}
+
+    def testHitsAndCopies(self):
+        cache = objectcache.ObjectCache()
+        obj = cache.get(("package", 1, "repo", "foo"), self.decode, "foo")
+        obj["packages"].append("bar")
+        obj = cache.get(("package", 1, "repo", "foo"), self.decode, "foo")
+        self.assertEqual(obj, {"name": "foo", "packages": ["foo"]})
+        obj["packages"].append("bar")
+        self.assertEqual(cache.get(("package", 1, "repo", "foo"), self.decode, "foo")["packages"], ["foo"])
+
+        cache.get(("package", 2, "repo", "foo"), self.decode, "foo")
+        self.assertEqual(self.decoded, ["foo", "foo"])
+        self.assertEqual((cache.hits, cache.misses), (2, 2))
+
+    def testEviction(self):
+        cache = objectcache.ObjectCache(max_items=2)
+        for name in ("a", "b", "a", "c", "a", "b"):
+            cache.get(name, self.decode, name)
+        self.assertEqual(self.decoded, ["a", "b", "c", "b"])
+
+        cache = objectcache.ObjectCache(max_bytes=1)
+        cache.get("a", self.decode, "a")
+        cache.get("a", self.decode, "a")
+        self.assertEqual(cache.bytes, 0)
+        self.assertEqual(self.decoded[-2:], ["a", "a"])
+
+    def testUnpicklable(self):
+        cache = objectcache.ObjectCache()
+        decode = lambda: lambda: None
+        cache.get("f", decode)
+        assert not cache.entries
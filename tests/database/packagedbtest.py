@@ -57,6 +57,15 @@ class PackageDBTestCase(testcase.TestCase):
         assert pkg == "curl"
         assert str(dep) == "openssl"
 
+    def testGetUpgradeInfo(self):
+        table = self.packagedb.get_upgrade_table()
+        assert table == sorted(table)
+        for info in table:
+            pkg = self.packagedb.get_package(info[0])
+            assert info == (pkg.name, pkg.release, pkg.distribution,
+                            pkg.distributionRelease, pkg.installTarHash)
+            assert self.packagedb.get_upgrade_info(info[0]) == info
+
     def testGetReplaces(self):
         # FIXME: update createrepo.py to generate replaces
         assert not self.packagedb.get_replaces()
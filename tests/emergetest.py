@@ -0,0 +1,86 @@
+import unittest
+import time
+
+import pisi.context as ctx
+import pisi.graph
+import pisi.operations.emerge as emerge
+
+class FakeBuilder:
+    install_build_deps = True
+
+    def __init__(self, scheduler, name, fail):
+        self.scheduler = scheduler
+        self.name = name
+        self.fail = fail
+        self.new_packages = [name]
+
+    def check_build_dependencies(self):
+        self.scheduler.checked.append(self.name)
+
+    def build(self):
+        if self.install_build_deps:
+            raise Exception("build may install dependencies")
+        time.sleep(0.05)
+        if self.fail:
+            raise Exception("build failed")
+
+class Scheduler(emerge.EmergeScheduler):
+    poll_interval = 0.01
+
+    def __init__(self, order, G, jobs, failing=()):
+        emerge.EmergeScheduler.__init__(self, order, G, jobs)
+        self.failing = failing
+        self.started = []
+        self.checked = []
+        self.installed = []
+        self.max_running = 0
+
+    def builder(self, name):
+        self.started.append(name)
+        self.max_running = max(self.max_running, len(self.running) + 1)
+        return FakeBuilder(self, name, name in self.failing)
+
+    def install(self, packages):
+        self.installed.extend(packages)
+
+class EmergeSchedulerTestCase(unittest.TestCase):
+
+    def setUp(self):
+        # c depends on b, b on a, f on c and e on d
+        self.G = pisi.graph.Digraph()
+        for u, v in (("b", "a"), ("c", "b"), ("f", "c"), ("e", "d")):
+            self.G.add_edge(u, v)
+        self.order = ["a", "d", "b", "e", "c", "f"]
+
+    def tearDown(self):
+        ctx.config.options.keep_going = None
+
+    def checkOrder(self, scheduler):
+        for name in scheduler.installed:
+            for dep in scheduler.deps[name]:
+                assert scheduler.installed.index(dep) < scheduler.installed.index(name)
+
+    def testJobs(self):
+        for jobs in (1, 3):
+            scheduler = Scheduler(self.order, self.G, jobs)
+            scheduler.run()
+            self.assertEqual(sorted(scheduler.installed), sorted(self.order))
+            self.checkOrder(scheduler)
+            assert scheduler.max_running <= jobs
+            self.assertEqual(scheduler.checked, scheduler.started)
+        self.assertEqual(Scheduler(self.order, self.G, 1).order, self.order)
+
+    def testFailure(self):
+        scheduler = Scheduler(self.order, self.G, 1, failing=("b",))
+        self.assertRaises(Exception, scheduler.run)
+        self.assertEqual(scheduler.started, ["a", "d", "b"])
+        self.assertEqual(scheduler.installed, ["a", "d"])
+
+    def testKeepGoing(self):
+        ctx.config.options.keep_going = True
+        scheduler = Scheduler(self.order, self.G, 2, failing=("b",))
+        self.assertRaises(Exception, scheduler.run)
+        self.assertEqual(sorted(scheduler.installed), ["a", "d", "e"])
+        self.checkOrder(scheduler)
+        self.assertEqual(scheduler.failed.keys(), ["b"])
+        self.assertEqual(scheduler.blocked(), ["c", "f"])
@@ -1,7 +1,14 @@
 import unittest
+import os
+import bz2
+import shutil
+import hashlib
+import tempfile
+
 from pisi.specfile import SpecFile
 from pisi import uri
-from pisi.file import File
+from pisi.file import File, AlreadyHaveException
+from pisi.hashcache import HashCache
 
 class FileTestCase(unittest.TestCase):
 
@@ -32,4 +39,39 @@ class FileTestCase(unittest.TestCase):
         r = f.readlines()
         assert (len(r) > 0)
 
+    def testDownloadDecompress(self):
+        data = "".join(["line %d\n" % i for i in range(100000)])
+        compressed = bz2.compress(data)
+
+        source_dir = tempfile.mkdtemp()
+        transfer_dir = tempfile.mkdtemp()
+        try:
+            source = os.path.join(source_dir, "pisi-index.xml.bz2")
+            open(source, "w").write(compressed)
+            open(source + ".sha1sum", "w").write(hashlib.sha1(compressed).hexdigest())
+
+            localfile = File.download(uri.URI(source), transfer_dir, sha1sum=True,
+                                      compress=File.COMPRESSION_TYPE_AUTO, copylocal=True)
+            self.assertEqual(localfile, os.path.join(transfer_dir, "pisi-index.xml"))
+            self.assertEqual(open(localfile).read(), data)
+
+            self.assertRaises(AlreadyHaveException, File.download, uri.URI(source),
+                              transfer_dir, sha1sum=True,
+                              compress=File.COMPRESSION_TYPE_AUTO, copylocal=True)
+        finally:
+            shutil.rmtree(source_dir)
+            shutil.rmtree(transfer_dir)
+
+    def testDownloadRecordsHash(self):
+        source_dir = tempfile.mkdtemp()
+        transfer_dir = tempfile.mkdtemp()
+        try:
+            source = os.path.join(source_dir, "foo-1.0-1-1.pisi")
+            open(source, "w").write("pisi" * 1024)
 
+            localfile = File.download(uri.URI(source), transfer_dir, copylocal=True)
+            self.assertEqual(HashCache(transfer_dir).lookup(localfile),
+                             hashlib.sha1("pisi" * 1024).hexdigest())
+        finally:
+            shutil.rmtree(source_dir)
+            shutil.rmtree(transfer_dir)
@@ -35,3 +35,33 @@ class GraphTestCase(unittest.TestCase):
         order = self.g1.topological_sort()
         assert order[0] == 0
         assert order[-1] == 4
+
+    def testDeepGraph(self):
+        g = pisi.graph.Digraph()
+        for i in range(20000):
+            g.add_edge(i, i + 1)
+        order = g.topological_sort()
+        assert order[0] == 0
+        assert order[-1] == 20000
+
+    def testTopologicalLevels(self):
+        order, levels = self.g1.topological_levels()
+        assert order[0] == 0
+        assert order[-1] == 4
+        self.assertEqual(levels[0], [0])
+        self.assertEqual(sorted(levels[1]), [2, 3])
+        self.assertEqual(levels[2], [4])
+
+    def testStronglyConnectedComponents(self):
+        self.g0.add_edge(5, 6)
+        self.g0.add_edge(6, 5)
+        self.g0.add_edge(7, 1)
+        cycles = sorted([sorted(c) for c in self.g0.cycles()])
+        self.assertEqual(cycles, [[1, 2, 3, 4], [5, 6]])
+
+        try:
+            self.g0.topological_levels()
+        except pisi.graph.CycleException, e:
+            self.assertEqual(len(e.components), 2)
+        else:
+            self.fail()
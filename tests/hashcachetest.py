@@ -0,0 +1,42 @@
+import unittest
+import os
+import time
+import shutil
+import tempfile
+
+from pisi import util
+import pisi.hashcache
+
+class HashCacheTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        self.path = os.path.join(self.dir, "archive.tar.gz")
+        open(self.path, "w").write("pisi" * 1024)
+        self.sha1sum = util.sha1_file(self.path)
+
+    def tearDown(self):
+        shutil.rmtree(self.dir)
+
+    def testRecordAndLookup(self):
+        cache = pisi.hashcache.HashCache(self.dir)
+        assert not cache.lookup(self.path)
+        assert cache.check_file_hash(self.path, self.sha1sum)
+        self.assertEqual(cache.lookup(self.path), self.sha1sum)
+
+        # the memo is persistent
+        cache = pisi.hashcache.HashCache(self.dir)
+        self.assertEqual(cache.lookup(self.path), self.sha1sum)
+
+    def testStaleEntry(self):
+        pisi.hashcache.record(self.path, self.sha1sum)
+        time.sleep(1)
+        open(self.path, "a").write("changed")
+        cache = pisi.hashcache.HashCache(self.dir)
+        assert not cache.lookup(self.path)
+        assert not cache.check_file_hash(self.path, self.sha1sum)
+
+    def testForget(self):
+        pisi.hashcache.record(self.path, self.sha1sum)
+        pisi.hashcache.forget(self.path)
+        assert not pisi.hashcache.HashCache(self.dir).lookup(self.path)
@@ -1,5 +1,9 @@
+import os
+import shutil
+import tempfile
 import unittest
 import pisi.relation
+import pisi.historyindex
 
 class HistoryTestCase(unittest.TestCase):
 
@@ -18,6 +22,30 @@ class HistoryTestCase(unittest.TestCase):
         history.read('history/002_remove.xml')
         assert not '099' == history._get_latest()
 
+    def testIndex(self):
+        tmpdir = tempfile.mkdtemp()
+        try:
+            logs = filter(lambda x:x.endswith(".xml"), os.listdir("history"))
+            for log in logs:
+                shutil.copy(os.path.join("history", log), tmpdir)
+
+            index = pisi.historyindex.HistoryIndex(tmpdir)
+            index.sync(logs)
+            assert index.list_operations() == [4, 3, 2, 1]
+
+            # records are read back from the index file
+            index = pisi.historyindex.HistoryIndex(tmpdir)
+            operation = index.get_operation(1)
+            assert operation.type == "upgrade"
+            assert operation.date == "2008-01-14"
+            assert len(operation.packages) == 4
+            gdb = operation.packages[0]
+            assert gdb.name == "gdb"
+            assert (gdb.before.version, gdb.before.release) == ("6.6", "8")
+            assert gdb.after.release == "9"
+            assert operation.packages[3].before is None
+        finally:
+            shutil.rmtree(tmpdir)
 
 
 
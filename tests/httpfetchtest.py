@@ -0,0 +1,152 @@
+import unittest
+import os
+import shutil
+import hashlib
+import tempfile
+import threading
+import BaseHTTPServer
+import SocketServer
+
+import pisi.context as ctx
+import pisi.fetcher
+
+class Handler(BaseHTTPServer.BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+
+    def setup(self):
+        BaseHTTPServer.BaseHTTPRequestHandler.setup(self)
+        self.server.connections += 1
+
+    def log_message(self, *args):
+        pass
+
+    def reply(self, status, data="", headers={}):
+        self.send_response(status)
+        self.send_header("Content-Length", str(len(data)))
+        for name, value in headers.items():
+            self.send_header(name, value)
+        self.end_headers()
+        if self.command != "HEAD":
+            self.wfile.write(data)
+
+    def do_GET(self):
+        self.server.requests.append((self.path, self.headers.getheader("range")))
+        if self.path == "/old":
+            return self.reply(301, headers={"Location": "/a"})
+        if not self.server.files.has_key(self.path):
+            return self.reply(404)
+
+        data = self.server.files[self.path]
+        byte_range = self.headers.getheader("range")
+        if byte_range:
+            start, end = byte_range[len("bytes="):].split("-")
+            start, end = int(start), int(end or len(data) - 1)
+            if start >= len(data):
+                return self.reply(416)
+            return self.reply(206, data[start:end + 1],
+                              {"Content-Range": "bytes %d-%d/%d" % (start, end, len(data))})
+        self.reply(200, data, {"Accept-Ranges": "bytes"})
+
+    do_HEAD = do_GET
+
+class Server(SocketServer.ThreadingMixIn, BaseHTTPServer.HTTPServer):
+    daemon_threads = True
+
+    def handle_error(self, request, client_address):
+        # the client closes connections after reading a part of a response
+        pass
+
+class HTTPFetchTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.server = Server(("127.0.0.1", 0), Handler)
+        self.server.connections = 0
+        self.server.requests = []
+        self.server.files = {}
+        for name in "abc":
+            self.server.files["/" + name] = os.urandom(300000)
+        self.thread = threading.Thread(target=self.server.serve_forever)
+        self.thread.setDaemon(True)
+        self.thread.start()
+        self.base = "http://127.0.0.1:%d" % self.server.server_address[1]
+        self.server.files["/big"] = self.server.files["/mirror/big"] = os.urandom(1000000)
+        self.dir = tempfile.mkdtemp()
+        pisi.fetcher.pool.close()
+        ctx.config.values.general.fetch_segment_threshold = 512
+
+    def tearDown(self):
+        del ctx.config.values.general.fetch_segment_threshold
+        pisi.fetcher.pool.close()
+        self.server.shutdown()
+        self.server.server_close()
+        shutil.rmtree(self.dir)
+
+    def check(self, fetcher, path):
+        data = self.server.files[path]
+        self.assertEqual(open(fetcher.archive_file).read(), data)
+        self.assertEqual(fetcher.sha1sum, hashlib.sha1(data).hexdigest())
+
+    def testKeepAlive(self):
+        urls = [self.base + path for path in ("/a", "/b", "/c")]
+        fetchers = pisi.fetcher.fetch_urls(urls, self.dir)
+        for fetcher, path in zip(fetchers, ("/a", "/b", "/c")):
+            self.check(fetcher, path)
+
+        assert pisi.fetcher.Fetcher(self.base + "/a", self.dir).test()
+        assert not pisi.fetcher.Fetcher(self.base + "/missing", self.dir).test()
+        self.assertEqual(self.server.connections, 1)
+
+    def testResume(self):
+        data = self.server.files["/a"]
+        fetcher = pisi.fetcher.Fetcher(self.base + "/a", self.dir)
+        open(fetcher.partial_file, "w").write(data[:1000])
+        fetcher.fetch()
+        self.check(fetcher, "/a")
+        self.assertEqual(self.server.requests, [("/a", "bytes=1000-")])
+
+        # a partial file longer than the remote file is fetched again
+        open(fetcher.partial_file, "w").write(data + "x")
+        fetcher.fetch()
+        self.check(fetcher, "/a")
+        self.assertEqual(self.server.connections, 1)
+
+    def testErrors(self):
+        fetcher = pisi.fetcher.fetch_url(self.base + "/old", self.dir, destfile="a")
+        self.check(fetcher, "/a")
+
+        fetcher = pisi.fetcher.Fetcher(self.base + "/missing", self.dir)
+        self.assertRaises(pisi.fetcher.FetchError, fetcher.fetch)
+        assert not os.path.exists(fetcher.archive_file)
+        self.assertEqual(self.server.connections, 1)
+
+    def testSegments(self):
+        data = self.server.files["/big"]
+        fetcher = pisi.fetcher.fetch_url(self.base + "/big", self.dir,
+                                         sha1sum=hashlib.sha1(data).hexdigest(),
+                                         mirrors=[self.base + "/mirror/big"])
+        self.check(fetcher, "/big")
+        assert not os.path.exists(fetcher.segments_file)
+        self.assertEqual(sorted([path for path, byte_range in self.server.requests]),
+                         ["/big", "/big", "/mirror/big", "/mirror/big"])
+
+    def testSegmentsResume(self):
+        data = self.server.files["/big"]
+        fetcher = pisi.fetcher.Fetcher(self.base + "/big", self.dir)
+        partial = open(fetcher.partial_file, "w")
+        partial.write(data[:1000])
+        partial.seek(500000)
+        partial.write(data[500000:600000])
+        partial.close()
+        open(fetcher.segments_file, "w").write("1000000\n0 500000 1000\n500000 1000000 600000\n")
+
+        fetcher.fetch()
+        self.check(fetcher, "/big")
+        self.assertEqual(sorted(self.server.requests),
+                         [("/big", "bytes=1000-499999"), ("/big", "bytes=600000-999999")])
+
+    def testIntegrity(self):
+        fetcher = pisi.fetcher.Fetcher(self.base + "/big", self.dir)
+        fetcher.expected_sha1sum = hashlib.sha1("x").hexdigest()
+        self.assertRaises(pisi.fetcher.FetchError, fetcher.fetch)
+        assert not os.path.exists(fetcher.partial_file)
+        assert not os.path.exists(fetcher.archive_file)
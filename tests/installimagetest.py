@@ -0,0 +1,122 @@
+import unittest
+import os
+import shutil
+import tempfile
+
+import pisi.context as ctx
+import pisi.files
+import pisi.util
+import pisi.db.installdb
+import pisi.db.historydb
+import pisi.atomicoperations
+import pisi.operations.install as install
+
+class Struct:
+    def __init__(self, **kwargs):
+        self.__dict__.update(kwargs)
+
+class FakeInstallOp:
+    def __init__(self, directory, name, paths, conflicts=(), size=1000):
+        self.package_fname = os.path.join(directory, "%s-1.0-1-p11-x86_64.pisi" % name)
+        self.pkginfo = Struct(name=name, version="1.0", release="1", installedSize=size,
+                              conflicts=[Struct(package=x) for x in conflicts])
+        self.files = pisi.files.Files()
+        for path, hash in paths:
+            self.files.list.append(Struct(path=path, hash=hash))
+        self.metadata = Struct(package=Struct(providesComar=[]))
+        self.package = Struct(pkg_dir=lambda: os.path.join(directory, "package", name))
+
+    def check_versioning(self, version, release):
+        pass
+
+class FakeDB:
+    def __init__(self):
+        self.calls = []
+        self.installed_extra = []
+
+    def __getattr__(self, name):
+        return lambda *args, **kwargs: self.calls.append((name, args, kwargs))
+
+# extracted packages are recorded as files, workers run in other processes
+extract_dir = None
+
+def fake_extract(args):
+    path, pkg_dir, pisi_files = args
+    open(os.path.join(extract_dir, os.path.basename(path)), "w").write(str(pisi_files))
+
+class InstallImageTestCase(unittest.TestCase):
+
+    def setUp(self):
+        global extract_dir
+        self.dir = extract_dir = tempfile.mkdtemp()
+        self.info_dir = os.path.join(self.dir, "info")
+        os.mkdir(self.info_dir)
+
+        self.saved = (pisi.db.installdb.InstallDB, pisi.db.historydb.HistoryDB,
+                      install.extract_image_package, ctx.filesdb)
+        self.installdb, self.historydb, ctx.filesdb = FakeDB(), FakeDB(), FakeDB()
+        pisi.db.installdb.InstallDB = lambda: self.installdb
+        pisi.db.historydb.HistoryDB = lambda: self.historydb
+        install.extract_image_package = fake_extract
+        ctx.config.info_dir = lambda: self.info_dir
+
+    def tearDown(self):
+        (pisi.db.installdb.InstallDB, pisi.db.historydb.HistoryDB,
+         install.extract_image_package, ctx.filesdb) = self.saved
+        del ctx.config.info_dir
+        shutil.rmtree(self.dir)
+
+    def testInstallImage(self):
+        ops = [FakeInstallOp(self.dir, "bash", [("bin", None), ("bin/bash", "a")]),
+               FakeInstallOp(self.dir, "zlib", [("usr/lib", None), ("usr/lib/libz.so", "b")]),
+               FakeInstallOp(self.dir, "curl", [("usr/lib", None), ("usr/bin/curl", "c")])]
+        install.install_image(ops, {ops[1].package_fname: "zlib"})
+
+        for op in ops:
+            assert os.path.exists(os.path.join(self.dir, os.path.basename(op.package_fname)))
+
+        self.assertEqual(ctx.filesdb.calls,
+                         [("add_packages_files", ([(op.pkginfo.name, op.files) for op in ops],), {})])
+        self.assertEqual([args[0].name for name, args, kwargs in self.installdb.calls
+                          if name == "add_package"], ["bash", "zlib", "curl"])
+        self.assertEqual(self.installdb.calls[-1],
+                         ("mark_pending_packages", (["bash", "zlib", "curl"],), {}))
+        self.assertEqual(self.historydb.calls[-1][0], "update_history")
+        self.assertEqual(open(os.path.join(self.info_dir, ctx.const.installed_extra)).read(),
+                         "zlib\n")
+
+    def testFileConflicts(self):
+        ops = [FakeInstallOp(self.dir, "bash", [("bin/sh", "a")]),
+               FakeInstallOp(self.dir, "dash", [("bin/sh", "b")])]
+        self.assertRaises(pisi.atomicoperations.Error, install.install_image, ops, {})
+        assert not self.installdb.calls
+
+        ops[1] = FakeInstallOp(self.dir, "dash", [("bin/sh", "b")], conflicts=["bash"])
+        install.install_image(ops, {})
+
+    def testFreeSpace(self):
+        free = pisi.util.partition_freespace(ctx.config.dest_dir())
+        ops = [FakeInstallOp(self.dir, "bash", [("bin/bash", "a")], size=free / 2),
+               FakeInstallOp(self.dir, "zlib", [("usr/lib/libz.so", "b")], size=free / 2 + 1)]
+        self.assertRaises(pisi.atomicoperations.Error, install.install_image, ops, {})
+        assert not self.installdb.calls
+
+    def testInterrupts(self):
+        calls = []
+        saved = ctx.disable_keyboard_interrupts, ctx.enable_keyboard_interrupts
+        ctx.disable_keyboard_interrupts = lambda: calls.append("disable")
+        ctx.enable_keyboard_interrupts = lambda: calls.append("enable")
+        ctx.filesdb.add_packages_files = None
+        try:
+            ops = [FakeInstallOp(self.dir, "bash", [("bin/bash", "a")])]
+            self.assertRaises(TypeError, install.install_image, ops, {})
+        finally:
+            ctx.disable_keyboard_interrupts, ctx.enable_keyboard_interrupts = saved
+        self.assertEqual(calls, ["disable", "enable"])
+
+    def testPackageFiles(self):
+        ctx.config.options.image = True
+        try:
+            self.assertRaises(Exception, install.install_pkg_files, ["bash-1.0-1-p11-x86_64.pisi"])
+        finally:
+            ctx.config.options.image = None
@@ -0,0 +1,39 @@
+import unittest
+from pisi.pathmatcher import PathMatcher
+
+class PathMatcherTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.matcher = PathMatcher(["/usr/bin",
+                                    "/usr/share",
+                                    "/usr/share/doc",
+                                    "/usr/lib/*.so",
+                                    "/usr/lib/lib*",
+                                    "/etc/foo.conf",
+                                    "/usr/share/doc"])
+
+    def testExact(self):
+        self.assertEqual(self.matcher.match("/usr/share/doc"), 2)
+        self.assertEqual(self.matcher.match("/etc/foo.conf"), 5)
+
+    def testGlob(self):
+        # the last matching glob wins
+        self.assertEqual(self.matcher.match("/usr/lib/libfoo.so"), 4)
+        self.assertEqual(self.matcher.match("/usr/lib/foo.so"), 3)
+
+    def testDirectory(self):
+        # the longest directory rule wins, the first one on ties
+        self.assertEqual(self.matcher.match("/usr/bin/pisi"), 0)
+        self.assertEqual(self.matcher.match("/usr/share/doc/pisi/README"), 2)
+        self.assertEqual(self.matcher.match("/usr/share/pisi"), 1)
+        self.assertEqual(self.matcher.match("/usr/lib/libfoo.so/x"), 4)
+
+    def testNoMatch(self):
+        assert not self.matcher.matches("/usr/sbin/pisi")
+        assert not self.matcher.matches("/usr/lib/foo.a")
+        assert not self.matcher.matches("/usr/binary")
+
+    def testDirectoryRule(self):
+        matcher = PathMatcher(["/etc/foo.conf"],
+                              directory_rule=lambda x: False)
+        assert not matcher.matches("/etc/foo.conf/bar")
@@ -0,0 +1,180 @@
+import unittest
+import os
+import time
+import shutil
+import hashlib
+import tempfile
+import threading
+
+import pisi.context as ctx
+import pisi.uri
+import pisi.file
+import pisi.fetcher
+import pisi.peercache
+import pisi.atomicoperations
+from httpfetchtest import Handler, Server
+
+class SlowHandler(Handler):
+    def do_GET(self):
+        time.sleep(0.2)
+        Handler.do_GET(self)
+
+    do_HEAD = do_GET
+
+def start(server):
+    thread = threading.Thread(target=server.serve_forever)
+    thread.setDaemon(True)
+    thread.start()
+    return "http://127.0.0.1:%d" % server.server_address[1]
+
+class PeerCacheTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.upstream = Server(("127.0.0.1", 0), SlowHandler)
+        self.upstream.connections = 0
+        self.upstream.requests = []
+        self.upstream.files = {"/repo/foo-1.pisi": os.urandom(100000),
+                               "/repo/pisi-index.xml": "<PISI/>",
+                               "/private/bar-1.pisi": "bar"}
+        self.upstream_base = start(self.upstream)
+
+        self.dir = tempfile.mkdtemp()
+        ctx.config.cached_packages_dir = lambda: os.path.join(self.dir, "packages")
+        ctx.config.peer_cache_dir = lambda: os.path.join(self.dir, "peer")
+        self.hashes = {self.upstream_base + "/repo/foo-1.pisi":
+                           hashlib.sha1(self.upstream.files["/repo/foo-1.pisi"]).hexdigest()}
+        self.cache = pisi.peercache.CacheServer(("127.0.0.1", 0),
+                                                [self.upstream_base + "/repo/"],
+                                                package_hashes=lambda: self.hashes)
+        self.cache_base = start(self.cache)
+        pisi.fetcher.pool.close()
+
+    def tearDown(self):
+        del ctx.config.cached_packages_dir
+        del ctx.config.peer_cache_dir
+        if "peer_cache" in ctx.config.values.general.__dict__:
+            del ctx.config.values.general.peer_cache
+        pisi.fetcher.pool.close()
+        for server in (self.cache, self.upstream):
+            server.shutdown()
+            server.server_close()
+        shutil.rmtree(self.dir)
+
+    def peer(self, path):
+        return self.cache_base + "/http/127.0.0.1:%d%s" % (self.upstream.server_address[1], path)
+
+    def get(self, path, headers={}):
+        response = pisi.fetcher.http_request("GET", self.peer(path), headers)
+        data = response.read()
+        response.release()
+        return response.status, data
+
+    def upstream_requests(self, path):
+        return len([x for x in self.upstream.requests if x[0] == path])
+
+    def testSingleFetch(self):
+        results = []
+        def get():
+            results.append(self.get("/repo/foo-1.pisi"))
+        threads = [threading.Thread(target=get) for i in range(5)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        data = self.upstream.files["/repo/foo-1.pisi"]
+        self.assertEqual(results, [(200, data)] * 5)
+        self.assertEqual(self.get("/repo/foo-1.pisi", {"Range": "bytes=10-19"}),
+                         (206, data[10:20]))
+        self.assertEqual(self.upstream_requests("/repo/foo-1.pisi"), 1)
+        assert os.path.exists(os.path.join(self.dir, "packages", "foo-1.pisi"))
+
+    def testIndexMaxAge(self):
+        self.assertEqual(self.get("/repo/pisi-index.xml"), (200, "<PISI/>"))
+        self.assertEqual(self.get("/repo/pisi-index.xml"), (200, "<PISI/>"))
+        self.assertEqual(self.upstream_requests("/repo/pisi-index.xml"), 1)
+
+        self.cache.max_age = 0
+        self.get("/repo/pisi-index.xml")
+        self.assertEqual(self.upstream_requests("/repo/pisi-index.xml"), 2)
+
+    def testErrors(self):
+        self.assertEqual(self.get("/private/bar-1.pisi")[0], 404)
+        self.assertEqual(self.get("/repo/../private/bar-1.pisi")[0], 404)
+        self.assertEqual(self.get("/repo/missing-1.pisi")[0], 404)
+        self.assertEqual(self.get("/repo/missing.xml")[0], 502)
+        self.assertEqual(self.upstream_requests("/private/bar-1.pisi"), 0)
+        self.assertEqual(self.upstream_requests("/repo/missing-1.pisi"), 0)
+
+    def testPackageHash(self):
+        data = self.upstream.files["/repo/foo-1.pisi"]
+        self.upstream.files["/repo/foo-1.pisi"] = data[:1000]
+        self.assertEqual(self.get("/repo/foo-1.pisi")[0], 502)
+        assert not os.path.exists(os.path.join(self.dir, "packages", "foo-1.pisi"))
+
+        self.upstream.files["/repo/foo-1.pisi"] = data
+        self.assertEqual(self.get("/repo/foo-1.pisi"), (200, data))
+
+        # a corrupted cached copy is fetched again
+        open(os.path.join(self.dir, "packages", "foo-1.pisi"), "w").write("foo")
+        self.assertEqual(self.get("/repo/foo-1.pisi"), (200, data))
+        self.assertEqual(self.upstream_requests("/repo/foo-1.pisi"), 3)
+
+    def testSha1sum(self):
+        self.upstream.files["/repo/pisi-index.xml.sha1sum"] = hashlib.sha1("<PISI/>").hexdigest()
+        self.get("/repo/pisi-index.xml.sha1sum")
+        self.assertEqual(self.get("/repo/pisi-index.xml"), (200, "<PISI/>"))
+
+        # the index is updated before max_age is over
+        self.upstream.files["/repo/pisi-index.xml"] = "<PISI></PISI>"
+        self.upstream.files["/repo/pisi-index.xml.sha1sum"] = hashlib.sha1("<PISI></PISI>").hexdigest()
+        self.assertEqual(self.get("/repo/pisi-index.xml.sha1sum"),
+                         (200, self.upstream.files["/repo/pisi-index.xml.sha1sum"]))
+        self.assertEqual(self.get("/repo/pisi-index.xml"), (200, "<PISI></PISI>"))
+        self.assertEqual(self.get("/repo/pisi-index.xml"), (200, "<PISI></PISI>"))
+        self.assertEqual(self.upstream_requests("/repo/pisi-index.xml"), 2)
+
+    def testClient(self):
+        uri = pisi.uri.URI(self.upstream_base + "/repo/foo-1.pisi")
+        data = self.upstream.files["/repo/foo-1.pisi"]
+        target = os.path.join(self.dir, "client")
+
+        ctx.config.values.general.peer_cache = self.cache_base
+        fetcher = pisi.file.File.fetch(uri, target)
+        self.assertEqual(open(fetcher.archive_file).read(), data)
+        self.assertEqual(self.upstream_requests("/repo/foo-1.pisi"), 1)
+        assert fetcher.url.get_uri().startswith(self.cache_base)
+
+        # the repository is used if the peer cache is down
+        os.unlink(fetcher.archive_file)
+        ctx.config.values.general.peer_cache = "http://127.0.0.1:1"
+        fetcher = pisi.file.File.fetch(uri, target)
+        self.assertEqual(open(fetcher.archive_file).read(), data)
+        self.assertEqual(self.upstream_requests("/repo/foo-1.pisi"), 2)
+
+    def testClientFallback(self):
+        data = self.upstream.files["/repo/foo-1.pisi"]
+        index_sha1sum = hashlib.sha1("<PISI/>").hexdigest()
+        self.upstream.files["/repo/pisi-index.xml.sha1sum"] = index_sha1sum
+
+        # a peer serving corrupted files
+        peer = Server(("127.0.0.1", 0), Handler)
+        peer.connections = 0
+        peer.requests = []
+        prefix = "/http/127.0.0.1:%d/repo/" % self.upstream.server_address[1]
+        peer.files = {prefix + "foo-1.pisi": "foo",
+                      prefix + "pisi-index.xml": "<PISI>",
+                      prefix + "pisi-index.xml.sha1sum": index_sha1sum}
+        ctx.config.values.general.peer_cache = start(peer)
+        try:
+            index = pisi.uri.URI(self.upstream_base + "/repo/pisi-index.xml")
+            path = pisi.file.File.download(index, os.path.join(self.dir, "client"), sha1sum=True)
+            self.assertEqual(open(path).read(), "<PISI/>")
+
+            pisi.atomicoperations.Install.download(self.upstream_base + "/repo/foo-1.pisi",
+                                                   hashlib.sha1(data).hexdigest())
+            self.assertEqual(open(os.path.join(self.dir, "packages", "foo-1.pisi")).read(), data)
+            self.assertEqual(len(peer.requests), 3)
+        finally:
+            peer.shutdown()
+            peer.server_close()
@@ -0,0 +1,48 @@
+import unittest
+import os
+import json
+import tempfile
+
+import pisi.profiler
+
+class ProfilerTestCase(unittest.TestCase):
+
+    def testNullProfiler(self):
+        profiler = pisi.profiler.NullProfiler()
+        assert not profiler.enabled
+        with profiler.span("db.init", db="InstallDB"):
+            profiler.count("filesdb.put", 3)
+
+    def testSpans(self):
+        profiler = pisi.profiler.Profiler()
+        with profiler.span("plan.install"):
+            for i in range(2):
+                with profiler.span("packagedb.get_package", package="zlib"):
+                    pass
+        profiler.count("filesdb.put", 3)
+        profiler.count("filesdb.put")
+
+        summary = profiler.summary()
+        self.assertEqual(summary["packagedb.get_package"][0], 2)
+        self.assertEqual(summary["plan.install"][0], 1)
+        self.assertEqual(profiler.counters["filesdb.put"], 4)
+
+        stacks = [line.rsplit(" ", 1)[0] for line in profiler.folded().splitlines()]
+        self.assertEqual(stacks, ["plan.install", "plan.install;packagedb.get_package"])
+
+    def testWrite(self):
+        profiler = pisi.profiler.Profiler()
+        with profiler.span("fetch", url="http://localhost/a.pisi"):
+            pass
+
+        fd, path = tempfile.mkstemp(suffix=".json")
+        os.close(fd)
+        try:
+            profiler.write(path)
+            trace = json.load(open(path))
+            event = trace["traceEvents"][0]
+            self.assertEqual(event["name"], "fetch")
+            self.assertEqual(event["ph"], "X")
+            self.assertEqual(event["args"]["url"], "http://localhost/a.pisi")
+        finally:
+            os.unlink(path)
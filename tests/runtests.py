@@ -24,27 +24,41 @@ from database.sourcedbtest import SourceDBTestCase
 from database.installdbtest import InstallDBTestCase
 from database.componentdbtest import ComponentDBTestCase
 from database.filesdbtest import FilesDBTestCase
+from database.filesldbtest import FilesLDBTestCase
 from database.lazydbtest import LazyDBTestCase
 from database.itembyrepotest import ItemByRepoTestCase
+from database.objectcachetest import ObjectCacheTestCase
 
 from archivetests import ArchiveTestCase
+from buildcachetest import BuildCacheTestCase
+from comarifacetest import ComarIfaceTestCase
 from configfiletest import ConfigFileTestCase
+from configuretest import ConfigureTestCase
 from conflicttests import ConflictTestCase
 from constanttest import ConstantTestCase
 from dependencytest import DependencyTestCase
+from emergetest import EmergeSchedulerTestCase
 from fetchtest import FetchTestCase
 from filetest import FileTestCase
 from filestest import FilesTestCase
 from graphtest import GraphTestCase
+from hashcachetest import HashCacheTestCase
 from historytest import HistoryTestCase
+from httpfetchtest import HTTPFetchTestCase
+from installimagetest import InstallImageTestCase
 from metadatatest import MetadataTestCase
 from mirrorstest import MirrorsTestCase
 from packagetest import PackageTestCase
+from pathmatchertest import PathMatcherTestCase
+from peercachetest import PeerCacheTestCase
+from profilertest import ProfilerTestCase
 from relationtest import RelationTestCase
 from replacetest import ReplaceTestCase
 from shelltest import ShellTestCase
+from signaturetest import SignatureTestCase
 from specfiletests import SpecFileTestCase
 from srcarchivetest import SourceArchiveTestCase
+from upgradetest import UpgradeTestCase
 from uritest import UriTestCase
 from utiltest import UtilTestCase
 from versiontest import VersionTestCase
@@ -0,0 +1,134 @@
+import unittest
+import os
+import base64
+import shutil
+import tempfile
+import zipfile
+import hashlib
+import subprocess
+
+import pisi.context as ctx
+import pisi.archive
+import pisi.signature
+import pisi.operations.install as install
+
+class SignatureTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        self.key = os.path.join(self.dir, "key.pem")
+        self.cert = os.path.join(self.dir, "cert.pem")
+        self.trusted = os.path.join(self.dir, "trusted")
+        os.mkdir(self.trusted)
+        devnull = open(os.devnull, "w")
+        subprocess.check_call(["openssl", "req", "-x509", "-newkey", "rsa:1024",
+                               "-nodes", "-subj", "/CN=Test", "-days", "1",
+                               "-keyout", self.key, "-out", self.cert],
+                              stdout=devnull, stderr=devnull)
+        shutil.copy(self.cert, self.trusted)
+
+        self.install_data = os.urandom(100000)
+        self.package = os.path.join(self.dir, "foo.pisi")
+        zip_obj = zipfile.ZipFile(self.package, "w")
+        zip_obj.writestr("metadata.xml", "<PISI/>")
+        zip_obj.writestr("install.tar.xz", self.install_data)
+        zip_obj.close()
+
+    def tearDown(self):
+        shutil.rmtree(self.dir)
+
+    def sign(self, members):
+        manifest = "\n".join(["%s %s" % (name, hashlib.sha1(data).hexdigest())
+                              for name, data in members])
+        pipe = subprocess.Popen(["openssl", "dgst", "-sha1", "-sign", self.key],
+                                stdin=subprocess.PIPE, stdout=subprocess.PIPE)
+        signature = pipe.communicate(manifest)[0]
+        zip_obj = zipfile.ZipFile(self.package, "a")
+        zip_obj.comment = "%s:%s:%s" % (pisi.signature.HEADER,
+                                        base64.b64encode(open(self.cert).read()),
+                                        base64.b64encode(signature))
+        zip_obj._didModify = True
+        zip_obj.close()
+
+    def install_archive(self, files):
+        root = tempfile.mkdtemp(dir=self.dir)
+        path = os.path.join(root, "install.tar.xz")
+        tar = pisi.archive.ArchiveTar(path, "tarxz")
+        for name, data in files:
+            open(os.path.join(root, name), "w").write(data)
+            tar.add_to_archive(os.path.join(root, name), name)
+        tar.close()
+        return open(path).read()
+
+    def extract(self, verifier):
+        zip_obj = verifier.zip_obj
+        reader = verifier.wrap("install.tar.xz", zip_obj.open("install.tar.xz"))
+        self.assertEqual(reader.read(10), self.install_data[:10])
+
+    def testUnsigned(self):
+        verifier = pisi.signature.PackageVerifier(zipfile.ZipFile(self.package))
+        self.assertEqual(verifier.verify(), pisi.signature.SIGN_NO)
+
+    def testStreamed(self):
+        self.sign([("metadata.xml", "<PISI/>"), ("install.tar.xz", self.install_data)])
+
+        verifier = pisi.signature.PackageVerifier(zipfile.ZipFile(self.package),
+                                                  self.trusted)
+        self.extract(verifier)
+        self.assertEqual(verifier.verify(), pisi.signature.SIGN_SELF)
+
+        untrusted = os.path.join(self.dir, "untrusted")
+        os.mkdir(untrusted)
+        verifier = pisi.signature.PackageVerifier(zipfile.ZipFile(self.package),
+                                                  untrusted)
+        self.assertEqual(verifier.verify(), pisi.signature.SIGN_UNTRUSTED)
+
+    def testClaims(self):
+        self.sign([("metadata.xml", "<PISI/>"), ("install.tar.xz", self.install_data)])
+        verifier = pisi.signature.PackageVerifier(zipfile.ZipFile(self.package))
+        claims = {"install.tar.xz": hashlib.sha1(self.install_data).hexdigest()}
+        self.assertEqual(verifier.verify(claims), pisi.signature.SIGN_SELF)
+        self.extract(verifier)
+        self.assertEqual(verifier.check_claims(), pisi.signature.SIGN_OK)
+
+        verifier = pisi.signature.PackageVerifier(zipfile.ZipFile(self.package))
+        claims = {"install.tar.xz": hashlib.sha1("x").hexdigest()}
+        self.assertEqual(verifier.verify(claims), pisi.signature.SIGN_CORRUPTED)
+
+    def testTampered(self):
+        self.sign([("metadata.xml", "<PISI/>"), ("install.tar.xz", "x")])
+        verifier = pisi.signature.PackageVerifier(zipfile.ZipFile(self.package))
+        self.extract(verifier)
+        self.assertEqual(verifier.verify(), pisi.signature.SIGN_CORRUPTED)
+
+    def testTamperedInstall(self):
+        genuine = self.install_archive([("foo", "foo")])
+        tampered = self.install_archive([("foo", "evil"), ("evil", "evil")])
+        metadata = open("metadata.xml").read().replace(
+            "</InstalledSize>", "</InstalledSize>\n<PackageFormat>1.2</PackageFormat>")
+
+        root = os.path.join(self.dir, "root")
+        os.mkdir(root)
+        open(os.path.join(root, "foo"), "w").write("old")
+        ctx.config.dest_dir = lambda: root
+        ctx.config.trusted_certs_dir = lambda: self.trusted
+        verify_signatures = ctx.config.values.general.verify_signatures
+        ctx.config.values.general.verify_signatures = True
+        try:
+            # with and without the hash in metadata.xml, nothing is extracted
+            for tags in ("", "<InstallTarHash>%s</InstallTarHash>" % hashlib.sha1(genuine).hexdigest()):
+                package_metadata = metadata.replace("</PackageFormat>", "</PackageFormat>\n" + tags)
+                zip_obj = zipfile.ZipFile(self.package, "w")
+                zip_obj.writestr("metadata.xml", package_metadata)
+                zip_obj.writestr("install.tar.xz", tampered)
+                zip_obj.close()
+                self.sign([("metadata.xml", package_metadata), ("install.tar.xz", genuine)])
+
+                job = (self.package, os.path.join(self.dir, "package"), [])
+                self.assertRaises(pisi.signature.Error, install.extract_image_package, job)
+                self.assertEqual(open(os.path.join(root, "foo")).read(), "old")
+                assert not os.path.lexists(os.path.join(root, "evil"))
+        finally:
+            ctx.config.values.general.verify_signatures = verify_signatures
+            del ctx.config.dest_dir
+            del ctx.config.trusted_certs_dir
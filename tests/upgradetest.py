@@ -0,0 +1,91 @@
+import unittest
+
+import pisi.context as ctx
+import pisi.version
+import pisi.db.installdb
+import pisi.db.packagedb
+import pisi.operations.upgrade as upgrade
+
+class FakeDB:
+    def __init__(self, table):
+        self.table = dict([(info[0], info) for info in table])
+
+    def get_upgrade_table(self):
+        return sorted(self.table.values())
+
+    def has_package(self, name):
+        return self.table.has_key(name)
+
+# (name, release, distribution, distribution release, install tar hash)
+installed = [("bash", "5", "Pardus", "2008", "a"),
+             ("curl", "2", "Pardus", "2008", "a"),
+             ("ethtool", "1", "Pardus", "2009", "a"),
+             ("jpeg", "3", "Pardus", "2009", "a"),
+             ("lynx", "1", "Pardus", "2009", "a"),
+             ("pam", "7", "Pardus", "2009", "a"),
+             ("xorg", "1", "Pardus", "2009", "a"),
+             ("zlib", "1", "Pardus", "2009", "a")]
+
+available = [("bash", "3", "Pardus", "2009", "b"),
+             ("curl", "2", "Other", "2010", "b"),
+             ("ethtool", "1", "Pardus", "2009", "a"),
+             ("jpeg", "4", "Pardus", "2009", "b"),
+             ("pam", "7", "Pardus", "2009", "b"),
+             ("vim", "1", "Pardus", "2009", "a"),
+             ("xorg", "2", "Pardus", "2009", "b"),
+             ("zlib", "2", "Other", "2008", "b")]
+
+replaces = {"xorg": ["xorg-server"]}
+
+def old_find_upgrades(packages, replaces, compare_sha1sum):
+    """The per package checks find_upgrades did before the merge-join."""
+    i_table = dict([(info[0], info) for info in installed])
+    table = dict([(info[0], info) for info in available])
+    upgrades = []
+    for name in packages:
+        if name in replaces.keys() or not i_table.has_key(name) \
+                or not table.has_key(name):
+            continue
+        name, release, distro, distro_release, hash = i_table[name]
+        name, p_release, p_distro, p_distro_release, p_hash = table[name]
+        if p_distro == distro and \
+                pisi.version.make_version(p_distro_release) > pisi.version.make_version(distro_release):
+            upgrades.append(name)
+        elif int(release) < int(p_release):
+            upgrades.append(name)
+        elif compare_sha1sum and int(release) == int(p_release) and not p_hash == hash:
+            upgrades.append(name)
+    return upgrades
+
+class UpgradeTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.InstallDB = pisi.db.installdb.InstallDB
+        self.PackageDB = pisi.db.packagedb.PackageDB
+        installdb, packagedb = FakeDB(installed), FakeDB(available)
+        pisi.db.installdb.InstallDB = lambda: installdb
+        pisi.db.packagedb.PackageDB = lambda: packagedb
+
+    def tearDown(self):
+        pisi.db.installdb.InstallDB = self.InstallDB
+        pisi.db.packagedb.PackageDB = self.PackageDB
+        ctx.config.options.compare_sha1sum = None
+
+    def testCandidates(self):
+        candidates = upgrade.upgrade_candidates()
+        self.assertEqual(sorted(candidates.keys()),
+                         ["bash", "curl", "ethtool", "jpeg", "pam", "xorg", "zlib"])
+        self.assertEqual(candidates["bash"], (installed[0], available[0], "release"))
+        self.assertEqual(candidates["pam"][2], None)
+        self.assertEqual(upgrade.upgrade_candidates(compare_sha1sum=True)["pam"][2], "sha1sum")
+        self.assertEqual(upgrade.upgrade_candidates(["jpeg", "vim"]).keys(), ["jpeg"])
+
+    def testFindUpgrades(self):
+        packages = [info[0] for info in installed] + ["vim"]
+        for compare_sha1sum, expected in ((False, ["bash", "jpeg", "zlib"]),
+                                          (True, ["bash", "curl", "jpeg", "pam", "zlib"])):
+            ctx.config.options.compare_sha1sum = compare_sha1sum
+            upgrades = sorted(upgrade.find_upgrades(packages, replaces))
+            self.assertEqual(upgrades, expected)
+            self.assertEqual(upgrades, sorted(old_find_upgrades(packages, replaces,
+                                                                compare_sha1sum)))
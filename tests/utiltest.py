@@ -1,5 +1,6 @@
 import unittest
 import shutil
+import tempfile
 from pisi.util import *
 import os
 
@@ -53,6 +54,31 @@ class UtilTestCase(unittest.TestCase):
         assert None == clean_dir('usr/local')
         assert not 'tmp/pisi-root' == clean_dir('usr/tmp')
 
+    def testEnsureDirs(self):
+        path = os.path.join(tempfile.mkdtemp(), "a", "b")
+        try:
+            ensure_dirs(path)
+            assert os.path.isdir(path)
+
+            # created by another process after the check
+            open(path + "/c", "w").close()
+            exists = os.path.exists
+            os.path.exists = lambda p: False
+            try:
+                ensure_dirs(path)
+                self.assertRaises(OSError, ensure_dirs, path + "/c")
+            finally:
+                os.path.exists = exists
+        finally:
+            shutil.rmtree(os.path.dirname(os.path.dirname(path)))
+
+    def testSyncFilesystem(self):
+        path = tempfile.mkdtemp()
+        try:
+            sync_filesystem(path)
+        finally:
+            shutil.rmtree(path)
+
     def testDirSize(self):
         self.assertNotEqual(dir_size('usr/lib/pardus'),2940)
         self.assertNotEqual(dir_size('usr/lib'),65)